@@ -2,6 +2,7 @@ import os
 
 from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from config import Config
 
@@ -16,6 +17,19 @@ STATUS_COLORS = {
     "Failed/Returned": "danger",
 }
 
+STATUS_HINTS = {
+    "Created": "Shipment created; awaiting assignment.",
+    "Assigned": "Courier assigned; pickup scheduled.",
+    "Picked up": "Parcel picked up; heading to destination hub.",
+    "Out for delivery": "Courier is delivering today.",
+    "Attempted/Rescheduled": "Delivery attempt made; rescheduled with recipient.",
+    "Delivered": "Delivered to recipient.",
+    "Returned to sender": "Parcel is being returned to sender.",
+    "Failed/Returned": "Delivery failed; contact support.",
+}
+
+TERMINAL_STATUSES = ("Delivered", "Returned to sender", "Failed/Returned")
+
 db = SQLAlchemy()
 
 
@@ -25,36 +39,59 @@ def create_app(config_class=Config):
 
     os.makedirs(app.instance_path, exist_ok=True)
 
+    hops = app.config["TRUSTED_PROXY_HOPS"]
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
     db.init_app(app)
 
+    from app import analytics, archive, assignment, backup, changefeed, compression, courier_sync, event_writer, fragments, live, purge, ratelimit, scheduler, sharding, stuck, tracking_filter, webhooks
+
+    scheduler.init_app(app)
+    fragments.init_app(app)
+    sharding.init_app(app)
+    purge.init_app(app)
+    archive.init_app(app)
+    live.init_app(app)
+    webhooks.init_app(app)
+    courier_sync.init_app(app)
+    assignment.init_app(app)
+    tracking_filter.init_app(app)
+    ratelimit.init_app(app)
+    changefeed.init_app(app)
+    backup.init_app(app)
+    compression.init_app(app)
+    analytics.init_app(app)
+    stuck.init_app(app)
+    event_writer.init_app(app)
+
     from app.routes.auth import auth_bp
+    from app.routes.backups import backups_bp
     from app.routes.admin import admin_bp
     from app.routes.courier import courier_bp
+    from app.routes.feed import feed_bp
+    from app.routes.health import health_bp
     from app.routes.public import public_bp
     from app.routes.support import support_bp
+    from app.routes.webhooks import webhooks_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(admin_bp)
+    app.register_blueprint(backups_bp)
     app.register_blueprint(courier_bp)
+    app.register_blueprint(feed_bp)
+    app.register_blueprint(health_bp)
     app.register_blueprint(public_bp)
     app.register_blueprint(support_bp)
+    app.register_blueprint(webhooks_bp)
 
     @app.context_processor
     def inject_status_helpers():
-        hints = {
-            "Created": "Shipment created; awaiting assignment.",
-            "Assigned": "Courier assigned; pickup scheduled.",
-            "Picked up": "Parcel picked up; heading to destination hub.",
-            "Out for delivery": "Courier is delivering today.",
-            "Attempted/Rescheduled": "Delivery attempt made; rescheduled with recipient.",
-            "Delivered": "Delivered to recipient.",
-            "Returned to sender": "Parcel is being returned to sender.",
-            "Failed/Returned": "Delivery failed; contact support.",
-        }
         return {
             "status_badge": lambda status: STATUS_COLORS.get(status, "secondary"),
             "status_choices": list(STATUS_COLORS.keys()),
-            "status_hint": lambda status: hints.get(status, ""),
+            "status_hint": lambda status: STATUS_HINTS.get(status, ""),
+            "terminal_statuses": TERMINAL_STATUSES,
         }
 
     @app.errorhandler(404)
@@ -70,9 +107,15 @@ def create_app(config_class=Config):
         """Create database tables."""
         from app import models  # noqa: F401
         from app import models_support  # noqa: F401
+        from app import models_webhooks  # noqa: F401
 
         with app.app_context():
             db.create_all()
         print("Database initialized.")
 
+    if app.config["PRELOAD_HEAVY_MODULES"]:
+        from app.preload import warm_up
+
+        warm_up(app)
+
     return app
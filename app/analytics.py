@@ -0,0 +1,217 @@
+"""
+Delivery-time analytics per courier and per city.
+
+For the shipments delivered in a date range (found through the (status,
+last_event_at) index), one grouped query per shard pivots the tracking events
+into a row per shipment: when it was created, first picked up and delivered,
+as epoch seconds so no datetime objects are built, and how many delivery
+attempts failed. The rows are loaded into NumPy arrays once. Durations,
+grouping and percentiles are then computed on whole columns for all groups at
+once; nothing loops over shipments in Python.
+
+Reports are cached per date range for ``ANALYTICS_CACHE_SECONDS`` in each
+process. Events already moved to the archive database are not read, so ranges
+older than ``ARCHIVE_AFTER_DAYS`` come out incomplete.
+"""
+import time
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, func, select
+
+from app import db
+from app.fragments import FragmentCache
+from app.models import Courier, Shipment, TrackingEvent
+from app.sharding import each_shard
+
+CREATED = "Created"
+PICKED_UP = "Picked up"
+ATTEMPTED = "Attempted/Rescheduled"
+DELIVERED = "Delivered"
+# Julian day number of 1970-01-01 00:00 UTC.
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+UNASSIGNED = -1
+QUANTILES = (50, 90, 95)
+# name: (label, start column, end column) of the pivoted timestamps.
+DURATIONS = {
+    "to_pickup": ("Created to picked up", "created", "picked_up"),
+    "pickup_to_delivery": ("Picked up to delivered", "picked_up", "delivered"),
+    "to_delivery": ("Created to delivered", "created", "delivered"),
+}
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+def init_app(app):
+    app.extensions["analytics_cache"] = FragmentCache(app.config["ANALYTICS_CACHE_SIZE"])
+
+
+def parse_range(start, end):
+    """``(start, end)`` dates from ISO strings; the last ``ANALYTICS_DEFAULT_DAYS`` days by default."""
+    config = current_app.config
+    try:
+        end = date.fromisoformat(end) if end else datetime.utcnow().date()
+        start = date.fromisoformat(start) if start else end - timedelta(days=config["ANALYTICS_DEFAULT_DAYS"] - 1)
+    except ValueError:
+        raise AnalyticsError("Dates must look like 2024-05-31.") from None
+    if start > end:
+        raise AnalyticsError("The start date must not be after the end date.")
+    if (end - start).days >= config["ANALYTICS_MAX_DAYS"]:
+        raise AnalyticsError(f"The range can span at most {config['ANALYTICS_MAX_DAYS']} days.")
+    return start, end
+
+
+def _epoch(column):
+    return (func.julianday(column) - UNIX_EPOCH_JULIAN_DAY) * 86400.0
+
+
+def _first(status):
+    return func.min(case((TrackingEvent.status == status, _epoch(TrackingEvent.created_at))))
+
+
+def _pivot_query(start, end):
+    """One row per shipment delivered between ``start`` and ``end`` (inclusive)."""
+    return (
+        select(
+            func.coalesce(Shipment.assigned_courier_id, UNASSIGNED),
+            func.coalesce(Shipment.city, ""),
+            func.coalesce(_first(CREATED), _epoch(Shipment.created_at)),
+            _first(PICKED_UP),
+            _first(DELIVERED),
+            func.sum(case((TrackingEvent.status == ATTEMPTED, 1), else_=0)),
+        )
+        .join(TrackingEvent, TrackingEvent.shipment_id == Shipment.id)
+        .where(
+            Shipment.status == DELIVERED,
+            Shipment.last_event_at >= datetime.combine(start, datetime.min.time()),
+            Shipment.last_event_at < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+        )
+        # Grouping in index order (status is fixed) avoids a temporary B-tree.
+        .group_by(Shipment.last_event_at, Shipment.id)
+    )
+
+
+def load_deliveries(start, end):
+    """Column arrays of the delivered shipments: courier ids, city codes and names, epoch times, failed attempts."""
+    import numpy as np
+
+    rows = []
+    query = _pivot_query(start, end)
+    for _ in each_shard():
+        rows += db.session.execute(query).all()
+    couriers, cities, created, picked_up, delivered, failed = zip(*rows) if rows else ((),) * 6
+    city_names, city_codes = np.unique(np.array(cities, dtype=object), return_inverse=True)
+    return {
+        "courier": np.array(couriers, dtype=np.int64),
+        "city": city_codes.reshape(-1),
+        "city_names": city_names,
+        # None (no such event) becomes NaN.
+        "created": np.array(created, dtype=float),
+        "picked_up": np.array(picked_up, dtype=float),
+        "delivered": np.array(delivered, dtype=float),
+        "failed": np.array(failed, dtype=float),
+    }
+
+
+def grouped_stats(keys, values):
+    """``(groups, stats)``: count, mean, max and ``QUANTILES`` of the non-NaN ``values`` per distinct key.
+
+    Percentiles interpolate linearly between the closest ranks, like ``numpy.percentile``.
+    """
+    import numpy as np
+
+    valid = ~np.isnan(values)
+    keys, values = keys[valid], values[valid]
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    groups, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    if not len(groups):
+        return groups, {}
+    last = counts - 1
+    stats = {"count": counts, "mean": np.add.reduceat(values, starts) / counts, "max": values[starts + last]}
+    for quantile in QUANTILES:
+        position = starts + last * (quantile / 100)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        stats[f"p{quantile}"] = values[low] + (values[high] - values[low]) * (position - low)
+    return groups, stats
+
+
+def _hours(seconds):
+    return round(float(seconds) / 3600, 2)
+
+
+def summarize(keys, data):
+    """{key: summary} of delivery durations (hours) and attempts for each group in ``keys``."""
+    import numpy as np
+
+    summaries = {}
+    groups, stats = grouped_stats(keys, np.zeros(len(keys)))
+    for index, key in enumerate(groups.tolist()):
+        summaries[key] = {"shipments": int(stats["count"][index])}
+    for name, (_, start_column, end_column) in DURATIONS.items():
+        durations = data[end_column] - data[start_column]
+        # Events entered out of order would give negative durations; leave them out.
+        durations[durations < 0] = np.nan
+        groups, stats = grouped_stats(keys, durations)
+        found = {key: index for index, key in enumerate(groups.tolist())}
+        for key, summary in summaries.items():
+            index = found.get(key)
+            if index is None:
+                summary[name] = {"count": 0}
+                continue
+            summary[name] = {"count": int(stats["count"][index]), "mean": _hours(stats["mean"][index])}
+            summary[name].update({f"p{q}": _hours(stats[f"p{q}"][index]) for q in QUANTILES})
+    attempts = data["failed"] + 1
+    groups, stats = grouped_stats(keys, attempts)
+    _, first_attempt = grouped_stats(keys, (attempts == 1).astype(float))
+    for index, key in enumerate(groups.tolist()):
+        summaries[key]["attempts"] = {
+            "mean": round(float(stats["mean"][index]), 2),
+            "max": int(stats["max"][index]),
+            "first_attempt_rate": round(float(first_attempt["mean"][index]), 3),
+        }
+    return summaries
+
+
+def build_report(start, end):
+    import numpy as np
+
+    data = load_deliveries(start, end)
+    courier_names = {courier.id: f"{courier.first_name} {courier.last_name}" for courier in Courier.query}
+    overall = summarize(np.zeros(len(data["courier"]), dtype=np.int64), data).get(0, {"shipments": 0})
+    couriers = summarize(data["courier"], data)
+    cities = summarize(data["city"], data)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "generated_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "durations": {name: label for name, (label, _, _) in DURATIONS.items()},
+        "overall": overall,
+        "couriers": [
+            {
+                "courier_id": None if key == UNASSIGNED else key,
+                "name": "Unassigned" if key == UNASSIGNED else courier_names.get(key, f"Courier #{key}"),
+                **summary,
+            }
+            for key, summary in sorted(couriers.items(), key=lambda item: -item[1]["shipments"])
+        ],
+        "cities": [
+            {"city": str(data["city_names"][key]) or "Unknown", **summary}
+            for key, summary in sorted(cities.items(), key=lambda item: -item[1]["shipments"])
+        ],
+    }
+
+
+def delivery_report(start, end, refresh=False):
+    """The report for ``start``..``end``, from the per-range cache unless it expired or ``refresh`` is set."""
+    cache = current_app.extensions["analytics_cache"]
+    key = ("delivery", start, end)
+    cached = None if refresh else cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    report = build_report(start, end)
+    cache.set(key, (time.monotonic() + current_app.config["ANALYTICS_CACHE_SECONDS"], report))
+    return report
@@ -0,0 +1,318 @@
+"""
+Hot/cold archival of tracking history.
+
+Events of shipments that reached a terminal status long ago are moved into a
+separate SQLite file that is ATTACHed to every connection as ``archive``.
+Optionally the shipment rows move as well. Timelines are resolved from both
+databases through ``Shipment.timeline()`` and ``find_archived_shipment()``.
+Batches wait while a backup copies the files, so a backup set does not catch
+events halfway between the two.
+"""
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text, event, func, select
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app import TERMINAL_STATUSES, backup, db
+
+SCHEMA = "archive"
+BACKUP_POLL_SECONDS = 5
+
+archive_metadata = MetaData(schema=SCHEMA)
+
+archived_events = Table(
+    "tracking_event",
+    archive_metadata,
+    Column("archive_id", Integer, primary_key=True),
+    Column("id", Integer, nullable=False),
+    Column("shipment_id", Integer, nullable=False),
+    Column("courier_id", Integer),
+    Column("status", String(50), nullable=False),
+    Column("location_description", String(255), nullable=False),
+    Column("notes", Text),
+    Column("proof_url", String(512)),
+    Column("created_at", DateTime),
+    Column("archived_at", DateTime),
+)
+Index("ix_archive_tracking_event_shipment_id", archived_events.c.shipment_id)
+
+archived_shipments = Table(
+    "shipment",
+    archive_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("customer_id", Integer, nullable=False),
+    Column("sender_address", String(255), nullable=False),
+    Column("receiver_address", String(255), nullable=False),
+    Column("city", String(120)),
+    Column("requested_date", DateTime, nullable=False),
+    Column("tracking_number", String(64), nullable=False, unique=True),
+    Column("assigned_courier_id", Integer),
+    Column("status", String(50)),
+    Column("last_event_at", DateTime),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+    Column("events_archived_at", DateTime),
+)
+
+_EVENT_COLUMNS = "id, shipment_id, courier_id, status, location_description, notes, proof_url, created_at"
+_SHIPMENT_COLUMNS = (
+    "id, customer_id, sender_address, receiver_address, city, requested_date, "
+    "tracking_number, assigned_courier_id, status, last_event_at, created_at, updated_at"
+)
+
+
+def init_app(app):
+    """Attach the archive database to every pooled connection and register CLI commands."""
+    app.cli.add_command(archive_command)
+    path = app.config.get("ARCHIVE_DB_PATH")
+    if not path:
+        return
+
+    with app.app_context():
+        engine = db.engine
+
+    ddl = [str(CreateTable(table, if_not_exists=True).compile(dialect=engine.dialect)) for table in archive_metadata.sorted_tables]
+    ddl += [
+        str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+        for table in archive_metadata.sorted_tables
+        for index in table.indexes
+    ]
+
+    @event.listens_for(engine, "connect")
+    def attach_archive(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+        for statement in ddl:
+            dbapi_connection.execute(statement)
+
+
+def is_enabled():
+    return bool(current_app.config.get("ARCHIVE_DB_PATH"))
+
+
+class ArchivedEvent:
+    """Read-only stand-in for a ``TrackingEvent`` that lives in the archive."""
+
+    __slots__ = ("id", "shipment_id", "courier_id", "status", "location_description", "notes", "proof_url", "created_at")
+    archived = True
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, row[name])
+
+    @property
+    def courier(self):
+        from app.models import Courier
+
+        return db.session.get(Courier, self.courier_id) if self.courier_id else None
+
+
+class ArchivedShipment:
+    """Read-only stand-in for a ``Shipment`` whose row was moved to the archive."""
+
+    archived = True
+
+    def __init__(self, row):
+        for key, value in row.items():
+            setattr(self, key, value)
+        self.tracking_events = load_archived_events(self.id)
+
+    @property
+    def customer(self):
+        from app.models import Customer
+
+        return db.session.get(Customer, self.customer_id)
+
+    @property
+    def courier(self):
+        from app.models import Courier
+
+        return db.session.get(Courier, self.assigned_courier_id) if self.assigned_courier_id else None
+
+    def timeline(self):
+        return self.tracking_events
+
+    def recent_events(self, limit, before_id=None):
+        events = sorted(self.tracking_events, key=lambda e: e.id)
+        if before_id is not None:
+            events = [e for e in events if e.id < before_id]
+        return events[-limit:], len(events) > limit
+
+    def latest_event(self, status=None):
+        return max((e for e in self.tracking_events if not status or e.status == status), key=lambda e: e.id, default=None)
+
+    def latest_status(self):
+        return self.status or "Created"
+
+    def latest_event_id(self):
+        return max((e.id for e in self.tracking_events), default=0)
+
+
+def load_archived_events(shipment_id):
+    if not is_enabled():
+        return []
+    rows = db.session.execute(
+        select(archived_events)
+        .where(archived_events.c.shipment_id == shipment_id)
+        .order_by(archived_events.c.created_at, archived_events.c.id)
+    ).mappings()
+    return [ArchivedEvent(row) for row in rows]
+
+
+def archived_event_window(shipment_id, limit, before_id=None, status=None):
+    """Newest-first archived events of a shipment, older than ``before_id``."""
+    if not is_enabled():
+        return []
+    query = select(archived_events).where(archived_events.c.shipment_id == shipment_id)
+    if before_id is not None:
+        query = query.where(archived_events.c.id < before_id)
+    if status:
+        query = query.where(archived_events.c.status == status)
+    rows = db.session.execute(query.order_by(archived_events.c.id.desc()).limit(limit)).mappings()
+    return [ArchivedEvent(row) for row in rows]
+
+
+def latest_archived_event_id(shipment_id):
+    if not is_enabled():
+        return None
+    return db.session.execute(
+        select(func.max(archived_events.c.id)).where(archived_events.c.shipment_id == shipment_id)
+    ).scalar()
+
+
+def find_archived_shipment(tracking_number):
+    if not is_enabled() or not tracking_number:
+        return None
+    row = (
+        db.session.execute(select(archived_shipments).where(archived_shipments.c.tracking_number == tracking_number))
+        .mappings()
+        .first()
+    )
+    return ArchivedShipment(row) if row else None
+
+
+def tracking_number_exists(tracking_number):
+    if not is_enabled():
+        return False
+    return (
+        db.session.execute(
+            select(archived_shipments.c.id).where(archived_shipments.c.tracking_number == tracking_number)
+        ).first()
+        is not None
+    )
+
+
+def find_candidates(cutoff, limit=None):
+    """Shipment ids whose latest event is terminal and older than ``cutoff``."""
+    from app.models import Shipment
+
+    query = (
+        select(Shipment.id)
+        .where(
+            Shipment.status.in_(TERMINAL_STATUSES),
+            Shipment.last_event_at < cutoff,
+            Shipment.events_archived_at.is_(None),
+        )
+        .order_by(Shipment.id)
+    )
+    if limit:
+        query = query.limit(limit)
+    return list(db.session.execute(query).scalars())
+
+
+def archive_completed(older_than_days, batch_size=500, include_shipments=False, progress=None):
+    """Move terminal shipments' events (and optionally the shipments) to the archive in batches.
+
+    Each batch is copied and deleted in one transaction, so a crash never leaves
+    an event in both databases or in neither.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    totals = {"shipments": 0, "events": 0}
+    while True:
+        _wait_for_backup()
+        ids = find_candidates(cutoff, limit=batch_size)
+        if not ids:
+            break
+        moved = _archive_batch(ids, include_shipments)
+        totals["shipments"] += len(ids)
+        totals["events"] += moved
+        if progress:
+            progress(totals)
+    if include_shipments:
+        # Shipments whose events were archived by an earlier events-only run.
+        while True:
+            _wait_for_backup()
+            ids = _events_archived_shipments(limit=batch_size)
+            if not ids:
+                break
+            _archive_batch(ids, include_shipments=True)
+            totals["shipments"] += len(ids)
+            if progress:
+                progress(totals)
+    return totals
+
+
+def _wait_for_backup():
+    while backup.is_running():
+        time.sleep(BACKUP_POLL_SECONDS)
+
+
+def _events_archived_shipments(limit):
+    from app.models import Shipment
+
+    query = select(Shipment.id).where(Shipment.events_archived_at.is_not(None)).order_by(Shipment.id).limit(limit)
+    return list(db.session.execute(query).scalars())
+
+
+def _archive_batch(shipment_ids, include_shipments):
+    now = datetime.utcnow()
+    id_list = ", ".join(str(int(shipment_id)) for shipment_id in shipment_ids)
+    conn = db.session.connection()
+    conn.exec_driver_sql(
+        f"INSERT INTO {SCHEMA}.tracking_event ({_EVENT_COLUMNS}, archived_at) "
+        f"SELECT {_EVENT_COLUMNS}, ? FROM main.tracking_event WHERE shipment_id IN ({id_list})",
+        (now,),
+    )
+    moved = conn.exec_driver_sql(f"DELETE FROM main.tracking_event WHERE shipment_id IN ({id_list})").rowcount
+    conn.exec_driver_sql(
+        f"UPDATE main.shipment SET events_archived_at = coalesce(events_archived_at, ?) WHERE id IN ({id_list})",
+        (now,),
+    )
+    if include_shipments:
+        conn.exec_driver_sql(
+            f"INSERT OR REPLACE INTO {SCHEMA}.shipment ({_SHIPMENT_COLUMNS}, events_archived_at) "
+            f"SELECT {_SHIPMENT_COLUMNS}, events_archived_at FROM main.shipment WHERE id IN ({id_list})"
+        )
+        conn.exec_driver_sql(f"DELETE FROM main.shipment WHERE id IN ({id_list})")
+    db.session.commit()
+    return moved
+
+
+@click.command("archive-events")
+@click.option("--days", type=int, default=None, help="Archive terminal shipments idle for this many days.")
+@click.option("--batch-size", type=int, default=None, help="Shipments moved per transaction.")
+@click.option("--include-shipments", is_flag=True, help="Also move the shipment rows to the archive.")
+@click.option("--dry-run", is_flag=True, help="Only count the shipments that would be archived.")
+@with_appcontext
+def archive_command(days, batch_size, include_shipments, dry_run):
+    """Move old delivered/returned shipments' tracking events to the archive database."""
+    if not is_enabled():
+        raise click.ClickException("ARCHIVE_DB_PATH is not configured.")
+    if current_app.config.get("SHARD_REGIONS"):
+        raise click.ClickException("Archiving is not supported together with SHARD_REGIONS.")
+    days = days if days is not None else current_app.config["ARCHIVE_AFTER_DAYS"]
+    batch_size = batch_size or current_app.config["ARCHIVE_BATCH_SIZE"]
+    if dry_run:
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        print(f"{len(find_candidates(cutoff))} shipments would be archived.")
+        return
+    totals = archive_completed(
+        days,
+        batch_size=batch_size,
+        include_shipments=include_shipments,
+        progress=lambda t: print(f"Archived {t['shipments']} shipments / {t['events']} events..."),
+    )
+    print(f"Archive complete: {totals['shipments']} shipments, {totals['events']} events.")
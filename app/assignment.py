@@ -0,0 +1,300 @@
+"""
+Bulk and automatic courier assignment.
+
+``assign_batch`` writes many assignments in the routed shard with one ``UPDATE``
+(a ``CASE`` on the shipment id when several couriers are involved) and one
+multi-row insert of the matching "Assigned" events. Bulk statements skip the
+per-event ORM hooks, so the shipment's denormalized status is set by the same
+UPDATE and the webhook outbox, courier sync log and live updates are fed explicitly.
+The UPDATE only takes rows that still have the courier read just before and
+still match the caller's selection; a concurrent run or admin action that got
+there first wins, and events and log rows are written only for the rows changed.
+
+``auto_assign`` hands every unassigned active shipment to a courier whose region
+matches the shipment's city. Active loads are read once (one GROUP BY per shard)
+into a min-heap per region, so picking a courier costs O(log n) and no query.
+"""
+import heapq
+import logging
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import case, func, insert, or_, select, update
+
+from app import db, scheduler
+from app.courier_sync import record_assignments
+from app.live import mark_changed
+from app.models import ACTIVE_SHIPMENT_FILTER, Courier, Shipment, TrackingEvent
+from app.sharding import current_shard, each_shard, follow_courier, is_enabled, region_shard
+from app.webhooks import enqueue_events
+
+logger = logging.getLogger(__name__)
+
+
+def init_app(app):
+    app.cli.add_command(auto_assign_command)
+    scheduler.schedule(app, "auto-assign", _scheduled_run, app.config["AUTO_ASSIGN_INTERVAL"])
+
+
+class AssignmentError(ValueError):
+    pass
+
+
+def active_loads(courier_ids):
+    """{courier id: number of active shipments} across every shard, one GROUP BY per shard."""
+    loads = dict.fromkeys(courier_ids, 0)
+    if not loads:
+        return loads
+    for _ in each_shard():
+        rows = db.session.execute(
+            select(Shipment.assigned_courier_id, func.count())
+            .where(Shipment.assigned_courier_id.in_(list(loads)), ACTIVE_SHIPMENT_FILTER)
+            .group_by(Shipment.assigned_courier_id)
+        )
+        for courier_id, count in rows:
+            loads[courier_id] += count
+    return loads
+
+
+class LoadBalancer:
+    """Min-heap of (active load, courier id): each pick goes to the least-loaded courier."""
+
+    def __init__(self, loads):
+        self._heap = [(load, courier_id) for courier_id, load in loads.items()]
+        heapq.heapify(self._heap)
+
+    def pick(self):
+        load, courier_id = self._heap[0]
+        heapq.heapreplace(self._heap, (load + 1, courier_id))
+        return courier_id
+
+    def loads(self):
+        return {courier_id: load for load, courier_id in self._heap}
+
+
+def assign_batch(plan, now=None, criteria=()):
+    """Apply ``[(shipment_id, courier_id), ...]`` in the currently routed shard; the caller commits.
+
+    Only active shipments that still match ``criteria`` (the caller's selection) are changed.
+    Returns the "Assigned" events written, one per changed shipment.
+    """
+    if not plan:
+        return []
+    now = now or datetime.utcnow()
+    targets = dict(plan)
+    previous = dict(
+        db.session.execute(
+            select(Shipment.id, Shipment.assigned_courier_id).where(Shipment.id.in_(list(targets)))
+        ).all()
+    )
+    if not previous:
+        return []
+    courier_ids = set(targets.values())
+    courier_value = next(iter(courier_ids)) if len(courier_ids) == 1 else case(targets, value=Shipment.id)
+    changed = db.session.execute(
+        update(Shipment)
+        .where(
+            Shipment.id.in_(list(previous)),
+            Shipment.assigned_courier_id.isnot_distinct_from(case(previous, value=Shipment.id)),
+            ACTIVE_SHIPMENT_FILTER,
+            *criteria,
+        )
+        .values(assigned_courier_id=courier_value, status="Assigned", last_event_at=now)
+        .returning(Shipment.id),
+        execution_options={"synchronize_session": False},
+    ).scalars().all()
+    if not changed:
+        return []
+    targets = {shipment_id: targets[shipment_id] for shipment_id in sorted(changed)}
+    events = db.session.execute(
+        insert(TrackingEvent).returning(
+            TrackingEvent.id,
+            TrackingEvent.shipment_id,
+            TrackingEvent.courier_id,
+            TrackingEvent.status,
+            TrackingEvent.location_description,
+            TrackingEvent.notes,
+            TrackingEvent.proof_url,
+            TrackingEvent.created_at,
+        ),
+        [
+            {
+                "shipment_id": shipment_id,
+                "courier_id": courier_id,
+                "status": "Assigned",
+                "location_description": "Courier assigned",
+                "notes": "Courier assigned to shipment",
+                "created_at": now,
+            }
+            for shipment_id, courier_id in targets.items()
+        ],
+    ).all()
+    enqueue_events(db.session.connection(), events, current_shard())
+    record_assignments(db.session.connection(), [(shipment_id, previous[shipment_id], courier_id) for shipment_id, courier_id in targets.items()])
+    mark_changed(db.session(), set(targets))
+    return events
+
+
+def reassign_shipments(courier_ids, shipment_ids=None, from_courier_id=None):
+    """Move active shipments to ``courier_ids`` in one transaction, least-loaded courier first.
+
+    Takes the given ``shipment_ids``, or everything active for ``from_courier_id``
+    (narrowed to ``shipment_ids`` when both are given). Shipments that are
+    delivered/returned or already with one of the target couriers are skipped.
+    """
+    started = time.perf_counter()
+    courier_ids = list(dict.fromkeys(courier_ids or []))
+    shipment_ids = list(dict.fromkeys(shipment_ids or []))
+    if not courier_ids:
+        raise AssignmentError("Choose at least one courier to assign to.")
+    if not shipment_ids and from_courier_id is None:
+        raise AssignmentError("Select shipments or a courier to reassign from.")
+    if from_courier_id in courier_ids:
+        raise AssignmentError("The courier being relieved can't also be a target.")
+    couriers = {c.id: c for c in Courier.query.filter(Courier.id.in_(courier_ids))}
+    missing = [courier_id for courier_id in courier_ids if courier_id not in couriers]
+    if missing:
+        raise AssignmentError(f"Unknown courier id(s): {', '.join(map(str, missing))}.")
+
+    balancer = LoadBalancer(active_loads(courier_ids))
+    now = datetime.utcnow()
+    assigned = []
+    criteria = []
+    if shipment_ids:
+        criteria.append(Shipment.id.in_(shipment_ids))
+    if from_courier_id is not None:
+        criteria.append(Shipment.assigned_courier_id == from_courier_id)
+    else:
+        criteria.append(or_(Shipment.assigned_courier_id.is_(None), Shipment.assigned_courier_id.notin_(courier_ids)))
+    for _ in each_shard():
+        query = select(Shipment.id).where(ACTIVE_SHIPMENT_FILTER, *criteria).order_by(Shipment.id)
+        plan = [(shipment_id, balancer.pick()) for shipment_id in db.session.execute(query).scalars()]
+        events = assign_batch(plan, now, criteria)
+        assigned += [(event.shipment_id, event.courier_id) for event in events]
+    moved = 0
+    if is_enabled():
+        moved = sum(follow_courier(shipment_id, couriers[courier_id]) for shipment_id, courier_id in assigned)
+    db.session.commit()
+
+    per_courier = dict.fromkeys(courier_ids, 0)
+    for _, courier_id in assigned:
+        per_courier[courier_id] += 1
+    return {
+        "reassigned": len(assigned),
+        "skipped": max(len(shipment_ids) - len(assigned), 0),
+        "per_courier": per_courier,
+        "moved_shards": moved,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _region_key(value):
+    return (value or "").strip().casefold()
+
+
+def auto_assign(dry_run=False, batch_size=None, progress=None):
+    """Assign unassigned active shipments to couriers of the region named like their city.
+
+    Oldest requests go first, each to the least-loaded courier of its region.
+    Assignments are committed ``batch_size`` at a time. With ``dry_run`` nothing
+    is written and the report shows what would happen.
+    """
+    started = time.perf_counter()
+    batch_size = batch_size or current_app.config["AUTO_ASSIGN_BATCH_SIZE"]
+    couriers = {courier.id: courier for courier in Courier.query.order_by(Courier.id)}
+    loads = active_loads(list(couriers))
+    regions = {}
+    for courier in couriers.values():
+        if _region_key(courier.region):
+            regions.setdefault(_region_key(courier.region), {})[courier.id] = loads[courier.id]
+    balancers = {region: LoadBalancer(region_loads) for region, region_loads in regions.items()}
+
+    per_courier = {}
+    unmatched = {}
+    assigned = batches = moved = 0
+    for schema in each_shard():
+        rows = db.session.execute(
+            select(Shipment.id, Shipment.city)
+            .where(Shipment.assigned_courier_id.is_(None), ACTIVE_SHIPMENT_FILTER)
+            .order_by(Shipment.requested_date, Shipment.id)
+        ).all()
+        plan = []
+        for shipment_id, city in rows:
+            balancer = balancers.get(_region_key(city))
+            if balancer is None:
+                unmatched[city or ""] = unmatched.get(city or "", 0) + 1
+                continue
+            plan.append((shipment_id, balancer.pick()))
+        if dry_run:
+            for _, courier_id in plan:
+                per_courier[courier_id] = per_courier.get(courier_id, 0) + 1
+            assigned += len(plan)
+            continue
+        for start in range(0, len(plan), batch_size):
+            events = assign_batch(plan[start : start + batch_size], criteria=[Shipment.assigned_courier_id.is_(None)])
+            batch = [(event.shipment_id, event.courier_id) for event in events]
+            for _, courier_id in batch:
+                per_courier[courier_id] = per_courier.get(courier_id, 0) + 1
+            if is_enabled():
+                moved += sum(
+                    follow_courier(shipment_id, couriers[courier_id])
+                    for shipment_id, courier_id in batch
+                    if region_shard(couriers[courier_id].region) != schema
+                )
+            db.session.commit()
+            assigned += len(batch)
+            batches += 1
+            if progress:
+                progress(assigned)
+
+    return {
+        "dry_run": dry_run,
+        "assigned": assigned,
+        "batches": batches,
+        "moved_shards": moved,
+        "per_courier": [
+            {
+                "courier_id": courier_id,
+                "name": f"{couriers[courier_id].first_name} {couriers[courier_id].last_name}",
+                "region": couriers[courier_id].region,
+                "active_before": loads[courier_id],
+                "new": per_courier[courier_id],
+            }
+            for courier_id in sorted(per_courier, key=lambda cid: (_region_key(couriers[cid].region), cid))
+        ],
+        "unmatched": dict(sorted(unmatched.items(), key=lambda item: -item[1])),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _scheduled_run():
+    report = auto_assign()
+    if report["assigned"]:
+        logger.info("Auto-assigned %s shipments", report["assigned"])
+
+
+def print_report(report):
+    verb = "Would assign" if report["dry_run"] else "Assigned"
+    print(f"{verb} {report['assigned']} shipments in {report['elapsed_ms']}ms.")
+    for row in report["per_courier"]:
+        print(f"  {row['region']:<16} {row['name']:<28} {row['active_before']:>5} active  +{row['new']}")
+    for city, count in report["unmatched"].items():
+        print(f"  no courier for city {city or '(blank)'!r}: {count}")
+
+
+@click.command("auto-assign")
+@click.option("--dry-run", is_flag=True, help="Report the assignments without writing them.")
+@click.option("--batch-size", type=int, default=None, help="Assignments committed per transaction.")
+@click.option("--every", type=int, default=None, metavar="SECONDS", help="Keep running on this interval.")
+@with_appcontext
+def auto_assign_command(dry_run, batch_size, every):
+    """Assign unassigned shipments to couriers whose region matches the shipment city."""
+    while True:
+        print_report(auto_assign(dry_run=dry_run, batch_size=batch_size))
+        if not every:
+            return
+        db.session.remove()
+        time.sleep(every)
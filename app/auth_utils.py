@@ -1,14 +1,17 @@
 from functools import wraps
 
-import bcrypt
 from flask import flash, g, redirect, session, url_for
 
 
 def hash_password(password: str) -> str:
+    import bcrypt
+
     return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
 
 
 def check_password(password: str, hashed: str) -> bool:
+    import bcrypt
+
     try:
         return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
     except ValueError:
@@ -0,0 +1,465 @@
+"""
+Online backups of the SQLite files while the app keeps running.
+
+Each file (main database, region shards, archive) is copied with SQLite's
+online backup API ``BACKUP_PAGES_PER_STEP`` pages at a time, sleeping between
+steps so writers get the lock in between. Another connection writing to the
+source restarts the copy. After ``BACKUP_MAX_RESTARTS`` restarts the copy is
+abandoned and started over after a backoff, with twice as many pages per step,
+up to ``BACKUP_MAX_ATTEMPTS`` times; the file is never copied in one blocking
+step, since a reader holding the lock that long stalls every writer in
+rollback-journal mode. ``--vacuum`` snapshots compact the finished copy with
+``VACUUM INTO``, so the live database is never locked for the vacuum.
+
+A backup set is written to ``<BACKUP_DIR>/<timestamp>.partial`` and renamed
+once every copy passed ``PRAGMA quick_check`` and its SHA-256 is recorded in
+``manifest.json``. Sets beyond the newest ``BACKUP_KEEP`` are deleted, and
+``.partial`` sets left by a process that died are deleted once the lock is free.
+
+The files are copied one after another, so a set is not one point-in-time
+snapshot across files, and the manifest says so. ``flask archive-events`` waits
+between batches while a backup runs; shard moves can't wait, so every set is
+checked across files (a shipment in two shards or in none, an event both live
+and archived) when it is written and when it is verified.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app import db
+from app.sharding import SHARD_PREFIX
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+CONSISTENCY_NOTE = (
+    "Files are copied one after another, not as one point-in-time snapshot: rows moved between files "
+    "during the backup (shard moves, archiving) can be in two files or in none. cross_file_problems lists "
+    "what the check found."
+)
+PROGRESS = "progress.json"
+PARTIAL_SUFFIX = ".partial"
+LOCK_FILE = ".backup.lock"
+
+
+class BackupError(RuntimeError):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def init_app(app):
+    app.cli.add_command(backup_command)
+    app.cli.add_command(verify_command)
+
+
+def backup_dir():
+    return current_app.config["BACKUP_DIR"]
+
+
+def database_files():
+    """[(name, path)] of every SQLite file holding app data."""
+    main = db.engine.url.database
+    if not main or main == ":memory:":
+        raise BackupError("In-memory databases can't be backed up.")
+    files = [("main", main)]
+    shards = current_app.extensions.get("shards")
+    if shards:
+        files += [(schema, path) for schema, path in shards["paths"].items()]
+    archive_path = current_app.config.get("ARCHIVE_DB_PATH")
+    if archive_path and archive_path != ":memory:" and os.path.exists(archive_path):
+        files.append(("archive", archive_path))
+    return files
+
+
+def copy_database(source_path, target_path, pages=None, sleep=None, max_restarts=None, progress=None):
+    """Copy one live database with the backup API; returns how many times the copy restarted."""
+    config = current_app.config
+    pages = pages or config["BACKUP_PAGES_PER_STEP"]
+    sleep = config["BACKUP_STEP_SLEEP"] if sleep is None else sleep
+    max_restarts = config["BACKUP_MAX_RESTARTS"] if max_restarts is None else max_restarts
+    restarts = 0
+    for attempt in range(config["BACKUP_MAX_ATTEMPTS"]):
+        if attempt:
+            delay = config["BACKUP_RETRY_BACKOFF"] * 2 ** (attempt - 1)
+            logger.info("Backup of %s kept restarting; retrying in %ss with %s pages per step", source_path, delay, pages)
+            time.sleep(delay)
+        try:
+            return restarts + _copy_in_steps(source_path, target_path, pages, sleep, max_restarts, progress)
+        except _Restarted as exc:
+            restarts += exc.args[0]
+            pages *= 2
+    raise BackupError(f"{os.path.basename(source_path)} changed too often to back up; try again when it is less busy.")
+
+
+def _copy_in_steps(source_path, target_path, pages, sleep, max_restarts, progress):
+    restarts = 0
+    previous = None
+
+    def on_step(status, remaining, total):
+        nonlocal restarts, previous
+        # A restart shows up as more pages remaining than after the previous step.
+        if previous is not None and remaining > previous:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _Restarted(restarts)
+        previous = remaining
+        if progress:
+            progress(total - remaining, total)
+
+    source = sqlite3.connect(source_path, timeout=30)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=pages, progress=on_step, sleep=sleep)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return restarts
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def quick_check(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _has_table(conn, schema, table):
+    query = f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?"
+    return conn.execute(query, (table,)).fetchone() is not None
+
+
+def cross_file_problems(path, files):
+    """Rows a set holds in two files or in none because they moved between copies; empty when consistent.
+
+    ``files`` are the manifest entries of the set in ``path``.
+    """
+    by_name = {item["name"]: os.path.join(path, item["file"]) for item in files}
+    if len(by_name) < 2 or "main" not in by_name:
+        return []
+    conn = sqlite3.connect(f"file:{by_name['main']}?mode=ro", uri=True)
+    problems = []
+    try:
+        for name, file_path in by_name.items():
+            if name != "main":
+                conn.execute(f"ATTACH DATABASE ? AS {name}", (f"file:{file_path}?mode=ro",))
+        if "archive" in by_name:
+            for table, what in (("tracking_event", "tracking events"), ("shipment", "shipments")):
+                if not (_has_table(conn, "main", table) and _has_table(conn, "archive", table)):
+                    continue
+                (count,) = conn.execute(
+                    f"SELECT count(*) FROM archive.{table} a JOIN main.{table} m ON m.id = a.id"
+                ).fetchone()
+                if count:
+                    problems.append(f"{count} {what} are in both main and archive (archived during the backup).")
+        shards = [name for name in by_name if name.startswith(SHARD_PREFIX)]
+        if shards and _has_table(conn, "main", "shipment_directory"):
+            for shard in shards:
+                (stray,) = conn.execute(
+                    f"SELECT count(*) FROM {shard}.shipment s LEFT JOIN main.shipment_directory d ON d.id = s.id "
+                    "WHERE d.shard IS NOT ?",
+                    (shard,),
+                ).fetchone()
+                (missing,) = conn.execute(
+                    f"SELECT count(*) FROM main.shipment_directory WHERE shard = ? "
+                    f"AND id NOT IN (SELECT id FROM {shard}.shipment)",
+                    (shard,),
+                ).fetchone()
+                if stray:
+                    problems.append(f"{stray} shipments in {shard} are listed under another shard or none.")
+                if missing:
+                    problems.append(f"{missing} shipments listed under {shard} are missing from it.")
+    finally:
+        conn.close()
+    return problems
+
+
+def _lock_owner(path):
+    """Pid holding the backup lock, or None when the lock is free or stale."""
+    try:
+        with open(path) as handle:
+            pid = int(handle.read().strip() or 0)
+        os.kill(pid, 0)
+    except (ValueError, ProcessLookupError, FileNotFoundError):
+        return None
+    except PermissionError:
+        pass
+    return pid
+
+
+def is_running():
+    return _lock_owner(os.path.join(backup_dir(), LOCK_FILE)) is not None
+
+
+def _acquire_lock(root):
+    path = os.path.join(root, LOCK_FILE)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if _lock_owner(path) is not None:
+                raise BackupError("Another backup is already running.") from None
+            # Left behind by a process that died mid-backup.
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as handle:
+            handle.write(str(os.getpid()))
+        return path
+    raise BackupError("Another backup is already running.")
+
+
+def sweep_abandoned():
+    """Delete ``.partial`` sets left by backups whose process died; returns their names.
+
+    Takes the backup lock, so a set that is still being written is never touched.
+    """
+    root = backup_dir()
+    if not os.path.isdir(root):
+        return []
+    try:
+        lock = _acquire_lock(root)
+    except BackupError:
+        return []
+    try:
+        return _remove_partials(root)
+    finally:
+        os.remove(lock)
+
+
+def _remove_partials(root):
+    removed = []
+    for entry in os.listdir(root):
+        if entry.endswith(PARTIAL_SUFFIX) and os.path.isdir(os.path.join(root, entry)):
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+            removed.append(entry[: -len(PARTIAL_SUFFIX)])
+    return removed
+
+
+def _write_json(path, data):
+    temporary = path + ".tmp"
+    with open(temporary, "w") as handle:
+        json.dump(data, handle, indent=2)
+    os.replace(temporary, path)
+
+
+def run_backup(vacuum=False, keep=None, progress=None):
+    """Write a verified backup set and rotate old ones; returns its manifest."""
+    started = time.perf_counter()
+    files = database_files()
+    root = backup_dir()
+    os.makedirs(root, exist_ok=True)
+    keep = current_app.config["BACKUP_KEEP"] if keep is None else keep
+    lock = _acquire_lock(root)
+    try:
+        _remove_partials(root)
+        created_at = datetime.utcnow()
+        name = created_at.strftime("%Y%m%d-%H%M%S") + ("-vacuum" if vacuum else "")
+        final = os.path.join(root, name)
+        partial = final + PARTIAL_SUFFIX
+        if os.path.exists(final):
+            raise BackupError(f"Backup {name} already exists.")
+        os.makedirs(partial)
+        manifest = {
+            "name": name,
+            "mode": "vacuum" if vacuum else "online",
+            "created_at": created_at.isoformat() + "Z",
+            "point_in_time": False,
+            "consistency": CONSISTENCY_NOTE,
+            "files": [],
+        }
+        try:
+            for index, (label, source_path) in enumerate(files):
+
+                def report(copied, total, label=label, index=index):
+                    state = {"file": label, "file_index": index + 1, "file_count": len(files), "copied": copied, "total": total}
+                    _write_json(os.path.join(partial, PROGRESS), state)
+                    if progress:
+                        progress(state)
+
+                filename = os.path.basename(source_path)
+                target = os.path.join(partial, filename)
+                copy_target = target + ".copy" if vacuum else target
+                restarts = copy_database(source_path, copy_target, progress=report)
+                if vacuum:
+                    conn = sqlite3.connect(copy_target)
+                    try:
+                        conn.execute("VACUUM INTO ?", (target,))
+                    finally:
+                        conn.close()
+                    os.remove(copy_target)
+                check = quick_check(target)
+                if check != "ok":
+                    raise BackupError(f"{filename} failed the integrity check: {check}")
+                manifest["files"].append(
+                    {
+                        "name": label,
+                        "file": filename,
+                        "source": source_path,
+                        "bytes": os.path.getsize(target),
+                        "sha256": file_checksum(target),
+                        "restarts": restarts,
+                    }
+                )
+            manifest["cross_file_problems"] = cross_file_problems(partial, manifest["files"])
+            for problem in manifest["cross_file_problems"]:
+                logger.warning("Backup %s: %s", name, problem)
+            manifest["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            _write_json(os.path.join(partial, MANIFEST), manifest)
+            os.remove(os.path.join(partial, PROGRESS))
+            os.rename(partial, final)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        manifest["removed"] = rotate(keep)
+        return manifest
+    finally:
+        os.remove(lock)
+
+
+def list_backups():
+    """Backup sets newest first: manifests of complete sets, progress of the one being written."""
+    root = backup_dir()
+    if not os.path.isdir(root):
+        return []
+    if not is_running():
+        sweep_abandoned()
+    backups = []
+    for entry in sorted(os.listdir(root), reverse=True):
+        path = os.path.join(root, entry)
+        if not os.path.isdir(path):
+            continue
+        if entry.endswith(PARTIAL_SUFFIX):
+            try:
+                with open(os.path.join(path, PROGRESS)) as handle:
+                    state = json.load(handle)
+            except (OSError, ValueError):
+                state = {}
+            backups.append({"name": entry[: -len(PARTIAL_SUFFIX)], "complete": False, "progress": state})
+            continue
+        try:
+            with open(os.path.join(path, MANIFEST)) as handle:
+                manifest = json.load(handle)
+        except (OSError, ValueError):
+            continue
+        manifest["complete"] = True
+        manifest["bytes"] = sum(item["bytes"] for item in manifest["files"])
+        backups.append(manifest)
+    return backups
+
+
+def rotate(keep):
+    """Delete complete backup sets beyond the newest ``keep``; returns their names."""
+    if not keep:
+        return []
+    removed = [backup["name"] for backup in list_backups() if backup["complete"]][keep:]
+    for name in removed:
+        shutil.rmtree(os.path.join(backup_dir(), name), ignore_errors=True)
+    return removed
+
+
+def verify_backup(name):
+    """Problems found in a backup set (missing files, checksum mismatches, failed checks, cross-file gaps); empty when sound."""
+    path = os.path.join(backup_dir(), os.path.basename(name))
+    try:
+        with open(os.path.join(path, MANIFEST)) as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return [f"{name}: manifest is missing or unreadable."]
+    problems = []
+    for item in manifest["files"]:
+        target = os.path.join(path, item["file"])
+        if not os.path.exists(target):
+            problems.append(f"{item['file']}: missing.")
+        elif file_checksum(target) != item["sha256"]:
+            problems.append(f"{item['file']}: checksum mismatch.")
+        else:
+            check = quick_check(target)
+            if check != "ok":
+                problems.append(f"{item['file']}: {check}")
+    if not problems:
+        problems = cross_file_problems(path, manifest["files"])
+    return problems
+
+
+def start_backup_job(vacuum=False):
+    """Run ``run_backup`` on a background thread of this process."""
+    app = current_app._get_current_object()
+    threading.Thread(target=_run_in_background, args=(app, vacuum), name="backup", daemon=True).start()
+
+
+def _run_in_background(app, vacuum):
+    with app.app_context():
+        try:
+            manifest = run_backup(vacuum=vacuum)
+            logger.info("Backup %s written in %sms", manifest["name"], manifest["elapsed_ms"])
+        except Exception:
+            logger.exception("Backup failed")
+
+
+@click.command("backup-db")
+@click.option("--vacuum", is_flag=True, help="Compact the copies with VACUUM INTO.")
+@click.option("--keep", type=int, default=None, help="Backup sets to keep (default BACKUP_KEEP, 0 keeps all).")
+@with_appcontext
+def backup_command(vacuum, keep):
+    """Back up the databases online into BACKUP_DIR and rotate old sets."""
+    shown = {}
+
+    def echo(state):
+        percent = state["copied"] * 100 // max(state["total"], 1)
+        if shown.get(state["file"]) != percent // 10:
+            shown[state["file"]] = percent // 10
+            print(f"  {state['file']}: {percent}%")
+
+    try:
+        manifest = run_backup(vacuum=vacuum, keep=keep, progress=echo)
+    except BackupError as exc:
+        raise click.ClickException(str(exc)) from None
+    print(f"Backup {manifest['name']} written to {os.path.join(backup_dir(), manifest['name'])} in {manifest['elapsed_ms']}ms.")
+    for item in manifest["files"]:
+        print(f"  {item['file']:<32} {item['bytes']:>12} bytes  sha256 {item['sha256'][:16]}")
+    for problem in manifest["cross_file_problems"]:
+        print(f"Warning: {problem}")
+    for name in manifest["removed"]:
+        print(f"Removed old backup {name}.")
+
+
+@click.command("backup-verify")
+@click.argument("name", required=False)
+@with_appcontext
+def verify_command(name):
+    """Check a backup set's checksums and integrity (default: the newest)."""
+    if name is None:
+        complete = [backup["name"] for backup in list_backups() if backup["complete"]]
+        if not complete:
+            raise click.ClickException("No backups found.")
+        name = complete[0]
+    problems = verify_backup(name)
+    if problems:
+        raise click.ClickException(f"Backup {name} is damaged:\n  " + "\n  ".join(problems))
+    print(f"Backup {name} verified.")
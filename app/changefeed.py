@@ -0,0 +1,190 @@
+"""
+Cursor-based change feed of tracking events for downstream consumers.
+
+Events are read in id order strictly after a cursor, joined with the shipment's
+tracking number and customer/courier ids, and returned as NDJSON pages of at
+most ``CHANGE_FEED_PAGE_MAX`` rows. SQLite has a single writer, so ids become
+visible in commit order and resuming from the last cursor neither skips nor
+repeats events. Long-polls subscribe to the live-updates hub and return as soon
+as a commit wakes them.
+
+Each shard numbers its events independently, so with sharding on the cursor
+holds one id per shard (``central:120,east:88``). A shipment moved to another
+shard gets new event ids there and its history is delivered again.
+"""
+import heapq
+import json
+import os
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from app import db
+from app.live import ANY_SHIPMENT
+from app.models import Shipment, TrackingEvent
+from app.sharding import SHARD_PREFIX, all_shards, each_shard, is_enabled as sharding_enabled, shard_name
+
+
+class CursorError(ValueError):
+    pass
+
+
+def init_app(app):
+    app.cli.add_command(changefeed_command)
+
+
+def parse_cursor(text):
+    """{shard schema (None when not sharded): last event id} from a cursor string."""
+    positions = dict.fromkeys(all_shards(), 0)
+    text = (text or "").strip()
+    if not text or text == "0":
+        return positions
+    if not sharding_enabled():
+        if not text.isdigit():
+            raise CursorError("The cursor must be an event id.")
+        return {None: int(text)}
+    for part in text.split(","):
+        name, _, value = part.partition(":")
+        schema = SHARD_PREFIX + name.strip()
+        if schema not in positions or not value.strip().isdigit():
+            raise CursorError(f"Invalid cursor part {part!r}; expected <shard>:<event id>.")
+        positions[schema] = int(value)
+    return positions
+
+
+def format_cursor(positions):
+    if not sharding_enabled():
+        return str(positions[None])
+    return ",".join(f"{shard_name(schema)}:{event_id}" for schema, event_id in positions.items())
+
+
+def _record(row, schema):
+    record = {
+        "event_id": row.id,
+        "shipment_id": row.shipment_id,
+        "tracking_number": row.tracking_number,
+        "customer_id": row.customer_id,
+        "courier_id": row.courier_id,
+        "assigned_courier_id": row.assigned_courier_id,
+        "status": row.status,
+        "location_description": row.location_description,
+        "notes": row.notes,
+        "proof_url": row.proof_url,
+        "occurred_at": row.created_at.isoformat() + "Z" if row.created_at else None,
+    }
+    if schema is not None:
+        record["shard"] = shard_name(schema)
+    return record
+
+
+def read_page(cursor, limit):
+    """Events after ``cursor``: ``(records, next cursor, has_more)``.
+
+    Each record carries the cursor to resume right after it. Shards are merged by
+    event time, keeping each shard's id order.
+    """
+    positions = parse_cursor(cursor)
+    query = (
+        select(
+            TrackingEvent.id,
+            TrackingEvent.shipment_id,
+            TrackingEvent.courier_id,
+            TrackingEvent.status,
+            TrackingEvent.location_description,
+            TrackingEvent.notes,
+            TrackingEvent.proof_url,
+            TrackingEvent.created_at,
+            Shipment.tracking_number,
+            Shipment.customer_id,
+            Shipment.assigned_courier_id,
+        )
+        .join(Shipment, Shipment.id == TrackingEvent.shipment_id)
+        .order_by(TrackingEvent.id)
+        .limit(limit + 1)
+    )
+    per_shard = {}
+    for schema in each_shard():
+        rows = db.session.execute(query.where(TrackingEvent.id > positions[schema])).all()
+        per_shard[schema] = rows
+    merged = heapq.merge(
+        *([(schema, row) for row in rows] for schema, rows in per_shard.items()),
+        key=lambda item: item[1].created_at or datetime.min,
+    )
+    records = []
+    taken = dict.fromkeys(per_shard, 0)
+    for schema, row in merged:
+        if len(records) == limit:
+            break
+        positions[schema] = row.id
+        taken[schema] += 1
+        record = _record(row, schema)
+        record["cursor"] = format_cursor(positions)
+        records.append(record)
+    has_more = any(len(rows) > taken[schema] for schema, rows in per_shard.items())
+    return records, format_cursor(positions), has_more
+
+
+def read_feed(cursor, limit, wait=0, client_id="feed"):
+    """Like ``read_page``, but wait up to ``wait`` seconds for events when none are pending."""
+    hub = current_app.extensions.get("live_updates")
+    subscription = hub.subscribe(ANY_SHIPMENT, client_id) if hub and wait > 0 else None
+    try:
+        page = read_page(cursor, limit)
+        if subscription is None:
+            return page
+        deadline = time.monotonic() + wait
+        while not page[0] and not hub.closing:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Release the pooled connection while idle.
+            db.session.close()
+            if subscription.wait(remaining):
+                page = read_page(cursor, limit)
+        return page
+    finally:
+        if subscription is not None:
+            hub.unsubscribe(subscription)
+
+
+def page_size(limit):
+    config = current_app.config
+    return max(1, min(limit or config["CHANGE_FEED_PAGE_SIZE"], config["CHANGE_FEED_PAGE_MAX"]))
+
+
+def _save_cursor(path, cursor):
+    temporary = path + ".tmp"
+    with open(temporary, "w") as handle:
+        handle.write(cursor + "\n")
+    os.replace(temporary, path)
+
+
+@click.command("changefeed")
+@click.option("--after", "cursor", default=None, help="Start after this cursor (default: the beginning).")
+@click.option("--cursor-file", type=click.Path(dir_okay=False), default=None, help="Read the start cursor from this file and keep it updated.")
+@click.option("--limit", type=int, default=None, help="Events per page.")
+@click.option("--follow", is_flag=True, help="Keep waiting for new events instead of exiting when caught up.")
+@with_appcontext
+def changefeed_command(cursor, cursor_file, limit, follow):
+    """Print tracking events as NDJSON, resuming from a cursor."""
+    if cursor is None and cursor_file and os.path.exists(cursor_file):
+        with open(cursor_file) as handle:
+            cursor = handle.read().strip()
+    try:
+        parse_cursor(cursor)
+    except CursorError as exc:
+        raise click.BadParameter(str(exc), param_hint="--after") from None
+    limit = page_size(limit)
+    wait = current_app.config["CHANGE_FEED_MAX_WAIT"] if follow else 0
+    while True:
+        records, cursor, has_more = read_feed(cursor, limit, wait=wait, client_id="cli")
+        for record in records:
+            click.echo(json.dumps(record))
+        if cursor_file and records:
+            _save_cursor(cursor_file, cursor)
+        if not has_more and not follow:
+            return
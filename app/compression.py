@@ -0,0 +1,118 @@
+"""
+Response compression negotiated from ``Accept-Encoding``.
+
+Text responses (HTML, JSON, CSV, NDJSON, ...) of at least ``COMPRESS_MIN_SIZE``
+bytes are sent with brotli when the client accepts it and the optional
+``brotli`` package is installed, otherwise with gzip. PDFs and other binary
+types are left alone, and so are Server-Sent Events, which proxies would buffer.
+
+Streamed responses stay streamed: every chunk the view yields is compressed and
+flushed on its own, so a client sees each chunk as soon as it is produced.
+"""
+import zlib
+
+from flask import current_app, request
+
+_brotli = None
+
+
+def _load_brotli():
+    """The brotli module, or False when it isn't installed (imported on first use)."""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+        except ImportError:
+            brotli = False
+        _brotli = brotli
+    return _brotli
+
+
+def init_app(app):
+    if app.config["COMPRESS_ENABLED"]:
+        app.after_request(compress_response)
+
+
+def choose_encoding(accept_encodings):
+    """"br", "gzip" or None, preferring the client's higher quality and then brotli."""
+    options = []
+    if _load_brotli() and accept_encodings.quality("br") > 0:
+        options.append((accept_encodings.quality("br"), 1, "br"))
+    if accept_encodings.quality("gzip") > 0:
+        options.append((accept_encodings.quality("gzip"), 0, "gzip"))
+    return max(options)[2] if options else None
+
+
+class _Compressor:
+    def __init__(self, encoding, config):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = _load_brotli().Compressor(quality=config["COMPRESS_BROTLI_QUALITY"])
+        else:
+            self._zlib = zlib.compressobj(config["COMPRESS_LEVEL"], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        if self.encoding == "br":
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def flush(self):
+        """Everything compressed so far, decodable by the client without the rest of the stream."""
+        if self.encoding == "br":
+            return self._brotli.flush()
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def _compress_stream(chunks, original, compressor):
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield compressor.compress(chunk) + compressor.flush()
+        yield compressor.finish()
+    finally:
+        close = getattr(original, "close", None)
+        if close is not None:
+            close()
+
+
+def compress_response(response):
+    config = current_app.config
+    if (
+        request.method == "HEAD"
+        or response.status_code != 200
+        or response.mimetype not in config["COMPRESS_MIMETYPES"]
+        or "Content-Encoding" in response.headers
+        or "no-transform" in response.headers.get("Cache-Control", "")
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    min_size = config["COMPRESS_MIN_SIZE"]
+
+    if response.is_streamed:
+        if response.content_length is not None and response.content_length < min_size:
+            return response
+        chunks = response.iter_encoded()
+        original = response.response
+        response.response = _compress_stream(chunks, original, _Compressor(encoding, config))
+        response.headers.pop("Content-Length", None)
+        response.direct_passthrough = False
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        compressor = _Compressor(encoding, config)
+        response.set_data(compressor.compress(data) + compressor.finish())
+    response.headers["Content-Encoding"] = encoding
+    if response.headers.get("ETag"):
+        # The compressed body differs from the identity one; a strong validator would lie.
+        etag, weak = response.get_etag()
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,332 @@
+"""
+Delta sync for courier mobile clients.
+
+``sync`` returns the courier's shipments that changed since a cursor, each with
+its new tracking events, plus tombstones for shipments taken away from them.
+The cursor combines:
+
+* the ``(updated_at, id)`` position of the last shipment sent, read through the
+  (courier, updated_at) index. Once a client is caught up the position drops to
+  ``SYNC_OVERLAP_SECONDS`` before the server time, so a change committed a
+  little after it was stamped is still picked up (and occasionally sent twice);
+* the highest tracking event id seen, for the events of changed shipments;
+* the highest ``courier_assignment_log`` id seen. Assignments and unassignments
+  are logged in the same transaction as the change, from a session hook and
+  from the bulk writers (``assign_batch``, ``delete_shipments``).
+
+Without a usable cursor (first sync, shard move, or older than
+``SYNC_LOG_RETENTION_DAYS``) the client gets ``reset`` and a snapshot of its
+active shipments with their latest events, paged by id. Clients upsert shipments
+and events by id, replace a shipment's events when ``replace_events`` is set and
+drop ``removed`` shipments.
+"""
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, func, insert, inspect, select, tuple_
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import ACTIVE_SHIPMENT_FILTER, Customer, Shipment, TrackingEvent
+from app.sharding import current_shard
+
+CURSOR_VERSION = "1"
+EPOCH = datetime(1970, 1, 1)
+
+
+class CourierAssignmentLog(db.Model):
+    __tablename__ = "courier_assignment_log"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    courier_id = db.Column(db.Integer, nullable=False)
+    shipment_id = db.Column(db.Integer, nullable=False)
+    assigned = db.Column(db.Boolean, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<CourierAssignmentLog courier={self.courier_id} shipment={self.shipment_id} assigned={self.assigned}>"
+
+
+db.Index("ix_courier_assignment_log_courier", CourierAssignmentLog.courier_id, CourierAssignmentLog.id)
+
+
+def init_app(app):
+    _register_session_hooks()
+
+
+def record_assignments(connection, changes):
+    """Log ``[(shipment_id, old courier id, new courier id)]`` on the writer's connection."""
+    now = datetime.utcnow()
+    rows = []
+    for shipment_id, old, new in changes:
+        if old == new:
+            continue
+        if old is not None:
+            rows.append({"courier_id": old, "shipment_id": shipment_id, "assigned": False, "created_at": now})
+        if new is not None:
+            rows.append({"courier_id": new, "shipment_id": shipment_id, "assigned": True, "created_at": now})
+    if rows:
+        connection.execute(insert(CourierAssignmentLog), rows)
+        _prune(connection, now)
+
+
+_next_prune = 0.0
+
+
+def _prune(connection, now):
+    """Drop log rows older than the retention window, at most once an hour per process."""
+    global _next_prune
+    if time.monotonic() < _next_prune:
+        return
+    _next_prune = time.monotonic() + 3600
+    cutoff = now - timedelta(days=current_app.config["SYNC_LOG_RETENTION_DAYS"])
+    connection.execute(CourierAssignmentLog.__table__.delete().where(CourierAssignmentLog.created_at < cutoff))
+
+
+_hooks_registered = False
+
+
+def _register_session_hooks():
+    global _hooks_registered
+    if _hooks_registered:
+        return
+    _hooks_registered = True
+    event.listen(Session, "after_flush", _log_flushed_assignments)
+
+
+def _log_flushed_assignments(session, flush_context):
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, Shipment) and obj.assigned_courier_id is not None:
+            changes.append((obj.id, None, obj.assigned_courier_id))
+    for obj in session.dirty:
+        if not isinstance(obj, Shipment):
+            continue
+        history = inspect(obj).attrs.assigned_courier_id.history
+        if history.has_changes():
+            old = history.deleted[0] if history.deleted else None
+            changes.append((obj.id, old, obj.assigned_courier_id))
+    for obj in session.deleted:
+        if isinstance(obj, Shipment) and obj.assigned_courier_id is not None:
+            changes.append((obj.id, obj.assigned_courier_id, None))
+    if changes:
+        record_assignments(session.connection(), changes)
+
+
+def _micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _shard_label():
+    shard = current_shard()
+    return shard or "-"
+
+
+def format_cursor(state):
+    return ".".join(
+        [
+            CURSOR_VERSION,
+            state["shard"],
+            state["mode"],
+            str(state["since"]),
+            str(state["after_id"]),
+            str(state["event_id"]),
+            str(state["log_id"]),
+        ]
+    )
+
+
+def parse_cursor(text):
+    """Cursor state, or None when the client has to start over with a snapshot."""
+    parts = (text or "").split(".")
+    if len(parts) != 7 or parts[0] != CURSOR_VERSION or parts[2] not in ("s", "d"):
+        return None
+    try:
+        since, after_id, event_id, log_id = (int(part) for part in parts[3:])
+    except ValueError:
+        return None
+    if parts[1] != _shard_label():
+        # The courier's shipments moved shard; their event ids changed.
+        return None
+    retention = timedelta(days=current_app.config["SYNC_LOG_RETENTION_DAYS"])
+    if _from_micros(since) < datetime.utcnow() - retention:
+        return None
+    return {"shard": parts[1], "mode": parts[2], "since": since, "after_id": after_id, "event_id": event_id, "log_id": log_id}
+
+
+def _event_payload(tracking_event):
+    return {
+        "id": tracking_event.id,
+        "status": tracking_event.status,
+        "location_description": tracking_event.location_description,
+        "notes": tracking_event.notes or "",
+        "proof_url": tracking_event.proof_url or "",
+        "created_at": tracking_event.created_at.isoformat() if tracking_event.created_at else None,
+    }
+
+
+def _shipment_payload(row, events, replace_events):
+    return {
+        "id": row.id,
+        "tracking_number": row.tracking_number,
+        "status": row.status,
+        "customer": f"{row.first_name} {row.last_name}",
+        "customer_phone": row.phone,
+        "sender_address": row.sender_address,
+        "receiver_address": row.receiver_address,
+        "city": row.city,
+        "requested_date": row.requested_date.date().isoformat() if row.requested_date else None,
+        "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+        "replace_events": replace_events,
+        "events": [_event_payload(tracking_event) for tracking_event in events],
+    }
+
+
+def _latest_events(shipment_ids, per_shipment):
+    """{shipment id: newest ``per_shipment`` events, oldest first} in one windowed query."""
+    if not shipment_ids:
+        return {}
+    rank = (
+        func.row_number()
+        .over(partition_by=TrackingEvent.shipment_id, order_by=TrackingEvent.id.desc())
+        .label("rank")
+    )
+    ranked = select(TrackingEvent.id, rank).where(TrackingEvent.shipment_id.in_(shipment_ids)).subquery()
+    events = (
+        TrackingEvent.query.join(ranked, ranked.c.id == TrackingEvent.id)
+        .filter(ranked.c.rank <= per_shipment)
+        .order_by(TrackingEvent.id)
+    )
+    grouped = {}
+    for tracking_event in events:
+        grouped.setdefault(tracking_event.shipment_id, []).append(tracking_event)
+    return grouped
+
+
+def _events_after(shipment_ids, event_id):
+    if not shipment_ids:
+        return {}
+    grouped = {}
+    events = TrackingEvent.query.filter(
+        TrackingEvent.shipment_id.in_(shipment_ids), TrackingEvent.id > event_id
+    ).order_by(TrackingEvent.id)
+    for tracking_event in events:
+        grouped.setdefault(tracking_event.shipment_id, []).append(tracking_event)
+    return grouped
+
+
+def sync(courier, cursor=None, limit=None):
+    """One page of changes for ``courier``; the session must already be routed to their shard."""
+    config = current_app.config
+    limit = max(1, min(limit or config["SYNC_PAGE_SIZE"], config["SYNC_PAGE_MAX"]))
+    per_shipment = config["SYNC_EVENTS_PER_SHIPMENT"]
+    now = datetime.utcnow()
+    # Read the high-water marks first: everything after them is picked up next time.
+    max_event_id = db.session.execute(select(func.coalesce(func.max(TrackingEvent.id), 0))).scalar()
+    max_log_id = db.session.execute(select(func.coalesce(func.max(CourierAssignmentLog.id), 0))).scalar()
+    overlap = timedelta(seconds=config["SYNC_OVERLAP_SECONDS"])
+
+    state = parse_cursor(cursor)
+    reset = state is None
+    if reset:
+        state = {
+            "shard": _shard_label(),
+            "mode": "s",
+            "since": _micros(now - overlap),
+            "after_id": 0,
+            "event_id": max_event_id,
+            "log_id": max_log_id,
+        }
+
+    query = (
+        select(
+            Shipment.id,
+            Shipment.tracking_number,
+            Shipment.status,
+            Shipment.sender_address,
+            Shipment.receiver_address,
+            Shipment.city,
+            Shipment.requested_date,
+            Shipment.updated_at,
+            Customer.first_name,
+            Customer.last_name,
+            Customer.phone,
+        )
+        .join(Customer, Customer.id == Shipment.customer_id)
+        .where(Shipment.assigned_courier_id == courier.id)
+        .limit(limit + 1)
+    )
+    if state["mode"] == "s":
+        query = query.where(ACTIVE_SHIPMENT_FILTER, Shipment.id > state["after_id"]).order_by(Shipment.id)
+    else:
+        position = tuple_(Shipment.updated_at, Shipment.id) > tuple_(_from_micros(state["since"]), state["after_id"])
+        query = query.where(position).order_by(Shipment.updated_at, Shipment.id)
+    rows = db.session.execute(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    shipment_ids = [row.id for row in rows]
+
+    if state["mode"] == "s":
+        replaced = set(shipment_ids)
+    else:
+        replaced = set(
+            db.session.execute(
+                select(CourierAssignmentLog.shipment_id).where(
+                    CourierAssignmentLog.courier_id == courier.id,
+                    CourierAssignmentLog.id > state["log_id"],
+                    CourierAssignmentLog.assigned.is_(True),
+                    CourierAssignmentLog.shipment_id.in_(shipment_ids),
+                )
+            ).scalars()
+        )
+    events = _latest_events([i for i in shipment_ids if i in replaced], per_shipment)
+    events.update(_events_after([i for i in shipment_ids if i not in replaced], state["event_id"]))
+    shipments = [_shipment_payload(row, events.get(row.id, []), row.id in replaced) for row in rows]
+
+    removed = []
+    next_state = dict(state)
+    if has_more:
+        if state["mode"] == "s":
+            next_state["after_id"] = rows[-1].id
+        else:
+            next_state["since"], next_state["after_id"] = _micros(rows[-1].updated_at), rows[-1].id
+    else:
+        if state["mode"] == "d":
+            unassigned = db.session.execute(
+                select(CourierAssignmentLog.shipment_id)
+                .where(
+                    CourierAssignmentLog.courier_id == courier.id,
+                    CourierAssignmentLog.id > state["log_id"],
+                    CourierAssignmentLog.id <= max_log_id,
+                    CourierAssignmentLog.assigned.is_(False),
+                )
+                .distinct()
+            ).scalars().all()
+            if unassigned:
+                still_mine = set(
+                    db.session.execute(
+                        select(Shipment.id).where(Shipment.id.in_(unassigned), Shipment.assigned_courier_id == courier.id)
+                    ).scalars()
+                )
+                removed = sorted(set(unassigned) - still_mine)
+            catch_up = _micros(now - overlap)
+            if catch_up > state["since"]:
+                next_state["since"], next_state["after_id"] = catch_up, 0
+            next_state["event_id"], next_state["log_id"] = max_event_id, max_log_id
+        # A finished snapshot continues as deltas from the time it started (minus the overlap).
+        next_state["mode"] = "d"
+        if state["mode"] == "s":
+            next_state["after_id"] = 0
+    return {
+        "cursor": format_cursor(next_state),
+        "reset": reset,
+        "has_more": has_more,
+        "shipments": shipments,
+        "removed": removed,
+    }
@@ -0,0 +1,178 @@
+"""
+Group commit for courier tracking events.
+
+Every SQLite commit waits for the journal to reach the disk, and commits
+serialize on the database's write lock. When many couriers submit at once,
+requests queue for the lock (or give up with "database is locked") and most of
+the time goes into fsyncs. With ``EVENT_GROUP_COMMIT`` on, requests hand their
+event to one writer thread per process instead. The writer takes whatever is
+queued, and while the previous batch held more than one event also whatever
+arrives within ``EVENT_GROUP_COMMIT_WINDOW_MS`` (at most
+``EVENT_GROUP_COMMIT_MAX_BATCH`` events). It inserts the batch through the ORM,
+flushing once per shard so the usual hooks (shipment status, webhook outbox,
+live updates) still run, and commits once. Each request returns after the
+commit that holds its event. If one event's data is rejected, the batch is
+retried one event at a time, so only that request fails. Lock timeouts and other
+database errors would hit every event alike, so they fail the whole batch at
+once and its couriers are asked to resubmit. A request waits at most twice
+``EVENT_GROUP_COMMIT_TIMEOUT``.
+
+The writer only coalesces requests served by threads of the same process. The
+thread is started on first use, so it survives servers that fork after loading
+the app.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from flask import current_app
+from sqlalchemy.exc import DataError, IntegrityError, ProgrammingError, SQLAlchemyError
+
+from app import db
+from app.models import TrackingEvent
+from app.sharding import current_shard, use_shard
+
+logger = logging.getLogger(__name__)
+
+# Raised because of one event's values; the rest of its batch can still be written.
+DATA_ERRORS = (IntegrityError, DataError, ProgrammingError, TypeError, ValueError)
+
+
+class EventWriterError(RuntimeError):
+    pass
+
+
+def init_app(app):
+    if app.config["EVENT_GROUP_COMMIT"]:
+        app.extensions["event_writer"] = EventWriter(app)
+
+
+def record_event(**fields):
+    """Insert a ``TrackingEvent`` in the current shard and commit it; returns its id.
+
+    Goes through the group-commit writer when enabled, else commits the request's session.
+    """
+    writer = current_app.extensions.get("event_writer")
+    if writer is None:
+        event = TrackingEvent(**fields)
+        db.session.add(event)
+        db.session.commit()
+        return event.id
+    return writer.submit(current_shard(), fields)
+
+
+class EventWriter:
+    def __init__(self, app):
+        self.app = app
+        self.window = app.config["EVENT_GROUP_COMMIT_WINDOW_MS"] / 1000
+        self.max_batch = app.config["EVENT_GROUP_COMMIT_MAX_BATCH"]
+        self.timeout = app.config["EVENT_GROUP_COMMIT_TIMEOUT"]
+        self.batches = 0
+        self.events = 0
+        self._last_batch = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def _ensure_running(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked child inherits neither the thread nor a usable queue.
+                self._queue = queue.SimpleQueue()
+                threading.Thread(target=self._run, args=(self._queue,), name="event-writer", daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, shard, fields):
+        """Queue an event for ``shard`` and wait until its batch is committed; returns the event id."""
+        self._ensure_running()
+        future = Future()
+        self._queue.put((shard, fields, future))
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise EventWriterError("The event could not be saved in time. Please submit it again.") from None
+        # The writer has started its batch; SQLite's busy timeout bounds how long that can take.
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            logger.warning("Group commit still running after %ss; giving up on the request", 2 * self.timeout)
+            raise EventWriterError(
+                "The event is taking unusually long to save. Check the shipment's timeline before submitting it again."
+            ) from None
+
+    def _run(self, pending):
+        while True:
+            batch = [item for item in self._next_batch(pending) if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                with self.app.app_context():
+                    self._write(batch)
+            except Exception as exc:  # keep the writer alive; no request may wait forever
+                logger.exception("Group commit failed")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+
+    def _next_batch(self, pending):
+        batch = [pending.get()]
+        # Wait for company only under load: a lone submitter shouldn't pay the window on every event.
+        deadline = time.monotonic() + (self.window if self._last_batch > 1 else 0)
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait())
+            except queue.Empty:
+                break
+        self._last_batch = len(batch)
+        return batch
+
+    def _write(self, batch):
+        try:
+            ids = self._commit(batch)
+        except DATA_ERRORS as exc:
+            db.session.rollback()
+            if len(batch) == 1:
+                batch[0][2].set_exception(exc)
+                return
+            for item in batch:
+                self._write([item])
+            return
+        except SQLAlchemyError as exc:
+            # "database is locked" and the like: retrying event by event would only repeat the wait.
+            db.session.rollback()
+            logger.warning("Group commit of %s events failed: %s", len(batch), exc)
+            for _, _, future in batch:
+                error = EventWriterError("The database is busy and the event was not saved. Please submit it again.")
+                error.__cause__ = exc
+                future.set_exception(error)
+            return
+        self.batches += 1
+        self.events += len(batch)
+        for (_, _, future), event_id in zip(batch, ids):
+            future.set_result(event_id)
+
+    def _commit(self, batch):
+        """Insert the batch, one flush per shard, and commit once; returns the event ids in batch order."""
+        by_shard = {}
+        for index, (shard, _, _) in enumerate(batch):
+            by_shard.setdefault(shard, []).append(index)
+        ids = [None] * len(batch)
+        for shard, indexes in by_shard.items():
+            use_shard(shard)
+            events = [TrackingEvent(**batch[index][1]) for index in indexes]
+            db.session.add_all(events)
+            db.session.flush()
+            for index, event in zip(indexes, events):
+                ids[index] = event.id
+            # Event ids are only unique within a shard; don't let the next shard's collide in the identity map.
+            db.session.expunge_all()
+        db.session.commit()
+        return ids
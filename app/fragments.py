@@ -0,0 +1,96 @@
+"""
+Template caching: rendered fragments and compiled templates.
+
+The tracking timeline renders to the same HTML on the public, admin and courier
+shipment pages and only changes when an event is added or archived. It is cached
+per process under a key built from the shipment and its latest event id, so a
+new event simply produces a new key and stale entries age out of the LRU.
+Compiled templates are stored in a bytecode cache under the instance folder so
+freshly started workers skip the Jinja compile step.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, render_template
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+TIMELINE_TEMPLATE = "partials/timeline.html"
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered HTML fragments."""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def init_app(app):
+    """Must run before anything touches ``app.jinja_env``."""
+    cache_dir = app.config.get("JINJA_BYTECODE_CACHE_DIR")
+    if cache_dir:
+        cache_dir = os.path.join(app.instance_path, cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_options = {**app.jinja_options, "bytecode_cache": FileSystemBytecodeCache(cache_dir)}
+
+    app.extensions["fragment_cache"] = FragmentCache(app.config["FRAGMENT_CACHE_SIZE"])
+    app.jinja_env.globals["timeline_fragment"] = timeline_fragment
+
+
+def timeline_key(shipment):
+    # The tracking number guards against SQLite reusing the id of a deleted shipment.
+    return (
+        "timeline",
+        getattr(shipment, "archived", False),
+        shipment.id,
+        shipment.tracking_number,
+        shipment.latest_event_id(),
+        getattr(shipment, "events_archived_at", None),
+    )
+
+
+def _render_timeline(shipment):
+    events, has_earlier = shipment.recent_events(current_app.config["TIMELINE_WINDOW"])
+    return Markup(render_template(TIMELINE_TEMPLATE, shipment=shipment, events=events, has_earlier=has_earlier))
+
+
+def timeline_fragment(shipment):
+    """Rendered ``partials/timeline.html`` (the newest ``TIMELINE_WINDOW`` events), cached when possible."""
+    cache = current_app.extensions["fragment_cache"]
+    if not cache.max_entries:
+        return _render_timeline(shipment)
+    key = timeline_key(shipment)
+    html = cache.get(key)
+    if html is None:
+        html = _render_timeline(shipment)
+        cache.set(key, html)
+    return html
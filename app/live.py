@@ -0,0 +1,275 @@
+"""
+Live tracking updates pushed to browsers over Server-Sent Events.
+
+Commits that insert ``TrackingEvent`` rows wake the streams of the affected
+shipments through an in-process hub. A watcher thread per process also polls
+SQLite's ``PRAGMA data_version`` on its own connection, so commits made by other
+worker processes (or raw SQL) wake streams too. Streams always re-read events
+from the database after the last id they sent, so duplicate wake-ups are free.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import STATUS_COLORS, STATUS_HINTS, TERMINAL_STATUSES, db
+
+logger = logging.getLogger(__name__)
+
+
+# Subscribe with this "shipment id" to be woken by events of every shipment (change feed long-polls).
+ANY_SHIPMENT = None
+
+
+class Subscription:
+    def __init__(self, shipment_id, client_id):
+        self.shipment_id = shipment_id
+        self.client_id = client_id
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    def wait(self, timeout):
+        woke = self._event.wait(timeout)
+        self._event.clear()
+        return woke
+
+
+class LiveUpdateHub:
+    """Fan-out of "shipment changed" notifications to open streams in this process."""
+
+    def __init__(self, db_paths=(), poll_interval=1.0, max_connections=200, max_per_client=4):
+        self.db_paths = list(db_paths)
+        self.poll_interval = poll_interval
+        self.max_connections = max_connections
+        self.max_per_client = max_per_client
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._per_client = defaultdict(int)
+        self._count = 0
+        self._watcher = None
+        self.closing = False
+
+    def subscribe(self, shipment_id, client_id):
+        """Register a stream, or return None when a connection limit is reached."""
+        with self._lock:
+            if self.closing or self._count >= self.max_connections or self._per_client[client_id] >= self.max_per_client:
+                return None
+            subscription = Subscription(shipment_id, client_id)
+            self._subscribers[shipment_id].add(subscription)
+            self._per_client[client_id] += 1
+            self._count += 1
+        self._ensure_watcher()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.shipment_id)
+            if not subscribers or subscription not in subscribers:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.shipment_id]
+            self._per_client[subscription.client_id] -= 1
+            if not self._per_client[subscription.client_id]:
+                del self._per_client[subscription.client_id]
+            self._count -= 1
+
+    def notify(self, shipment_ids):
+        shipment_ids = set(shipment_ids)
+        with self._lock:
+            targets = [sub for shipment_id in shipment_ids for sub in self._subscribers.get(shipment_id, ())]
+            if shipment_ids:
+                targets += self._subscribers.get(ANY_SHIPMENT, ())
+        for subscription in targets:
+            subscription.notify()
+
+    def shutdown(self):
+        """Wake every stream so it ends; browsers reconnect to another worker."""
+        with self._lock:
+            self.closing = True
+            targets = [sub for subscribers in self._subscribers.values() for sub in subscribers]
+        for subscription in targets:
+            subscription.notify()
+
+    @property
+    def connection_count(self):
+        return self._count
+
+    def _ensure_watcher(self):
+        if not self.db_paths or (self._watcher and self._watcher.is_alive()):
+            return
+        with self._lock:
+            if self._watcher and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch, name="live-updates-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        """Poll data_version and wake streams for events committed by other connections or processes.
+
+        One connection per database file that holds tracking events (one per shard when sharded).
+        """
+        watched = []
+        try:
+            for path in self.db_paths:
+                conn = sqlite3.connect(path, check_same_thread=False)
+                last_id = conn.execute("SELECT coalesce(max(id), 0) FROM tracking_event").fetchone()[0]
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                watched.append([conn, last_id, version])
+            while True:
+                time.sleep(self.poll_interval)
+                with self._lock:
+                    if not self._count:
+                        self._watcher = None
+                        return
+                for state in watched:
+                    conn, last_id, version = state
+                    current = conn.execute("PRAGMA data_version").fetchone()[0]
+                    if current == version:
+                        continue
+                    state[2] = current
+                    rows = conn.execute(
+                        "SELECT id, shipment_id FROM tracking_event WHERE id > ? ORDER BY id", (last_id,)
+                    ).fetchall()
+                    if rows:
+                        state[1] = rows[-1][0]
+                        self.notify(row[1] for row in rows)
+        except sqlite3.Error:
+            logger.exception("Live update watcher stopped")
+            with self._lock:
+                self._watcher = None
+        finally:
+            for conn, _, _ in watched:
+                conn.close()
+
+
+def init_app(app):
+    with app.app_context():
+        database = db.engine.url.database
+    if "shards" in app.extensions:
+        db_paths = list(app.extensions["shards"]["paths"].values())
+    else:
+        db_paths = [database] if database and database != ":memory:" else []
+    hub = LiveUpdateHub(
+        db_paths=db_paths,
+        poll_interval=app.config["LIVE_POLL_INTERVAL"],
+        max_connections=connection_limit(app.config),
+        max_per_client=app.config["LIVE_MAX_CONNECTIONS_PER_CLIENT"],
+    )
+    app.extensions["live_updates"] = hub
+    _register_session_hooks()
+
+
+def connection_limit(config):
+    """``LIVE_MAX_CONNECTIONS``, lowered to leave ``LIVE_RESERVED_THREADS`` of the server's threads free."""
+    limit = config["LIVE_MAX_CONNECTIONS"]
+    if config["SERVER_THREADS"]:
+        limit = min(limit, max(config["SERVER_THREADS"] - config["LIVE_RESERVED_THREADS"], 0))
+    return limit
+
+
+def get_hub():
+    return current_app.extensions["live_updates"]
+
+
+_hooks_registered = False
+
+
+def _register_session_hooks():
+    global _hooks_registered
+    if _hooks_registered:
+        return
+    _hooks_registered = True
+    event.listen(Session, "after_flush", _collect_new_events)
+    event.listen(Session, "after_commit", _publish_new_events)
+    event.listen(Session, "after_rollback", _discard_new_events)
+
+
+def _collect_new_events(session, flush_context):
+    from app.models import TrackingEvent
+
+    mark_changed(session, {obj.shipment_id for obj in session.new if isinstance(obj, TrackingEvent)})
+
+
+def mark_changed(session, shipment_ids):
+    """Notify subscribers of these shipments once the session commits (for bulk inserts)."""
+    if shipment_ids:
+        session.info.setdefault("live_shipment_ids", set()).update(shipment_ids)
+
+
+def _publish_new_events(session):
+    shipment_ids = session.info.pop("live_shipment_ids", None)
+    if shipment_ids and current_app:
+        hub = current_app.extensions.get("live_updates")
+        if hub:
+            hub.notify(shipment_ids)
+
+
+def _discard_new_events(session):
+    session.info.pop("live_shipment_ids", None)
+
+
+def format_sse(data, event_name=None, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event_name:
+        lines.append(f"event: {event_name}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def event_payload(tracking_event):
+    return {
+        "id": tracking_event.id,
+        "status": tracking_event.status,
+        "location_description": tracking_event.location_description,
+        "notes": tracking_event.notes or "",
+        "proof_url": tracking_event.proof_url or "",
+        "created_at": tracking_event.created_at.strftime("%Y-%m-%d %H:%M"),
+        "badge": STATUS_COLORS.get(tracking_event.status, "secondary"),
+        "hint": STATUS_HINTS.get(tracking_event.status, ""),
+    }
+
+
+def stream_shipment_events(subscription, last_id):
+    """Yield SSE frames for events after ``last_id`` until the shipment finishes or the stream expires."""
+    from app.models import TrackingEvent
+
+    hub = get_hub()
+    heartbeat = current_app.config["LIVE_HEARTBEAT_SECONDS"]
+    deadline = time.monotonic() + current_app.config["LIVE_MAX_STREAM_SECONDS"]
+    try:
+        yield "retry: 5000\n\n"
+        woke = True  # catch up on anything committed between page render and connect
+        while time.monotonic() < deadline and not hub.closing:
+            if woke:
+                events = (
+                    TrackingEvent.query.filter(
+                        TrackingEvent.shipment_id == subscription.shipment_id, TrackingEvent.id > last_id
+                    )
+                    .order_by(TrackingEvent.id)
+                    .all()
+                )
+                payloads = [event_payload(tracking_event) for tracking_event in events]
+                # Release the pooled connection while the stream idles.
+                db.session.close()
+                for payload in payloads:
+                    last_id = payload["id"]
+                    yield format_sse(payload, event_name="tracking", event_id=last_id)
+                if payloads and payloads[-1]["status"] in TERMINAL_STATUSES:
+                    yield format_sse({"status": payloads[-1]["status"]}, event_name="end")
+                    return
+            else:
+                yield ": heartbeat\n\n"
+            woke = subscription.wait(heartbeat)
+    finally:
+        hub.unsubscribe(subscription)
@@ -1,6 +1,9 @@
 from datetime import datetime
 
-from app import db
+from sqlalchemy import bindparam, event, or_
+
+from app import TERMINAL_STATUSES, db
+from app.sharding import SHARD_SCHEMA
 
 
 class TimestampMixin:
@@ -17,7 +20,8 @@ class Customer(db.Model, TimestampMixin):
     address = db.Column(db.String(255), nullable=False)
     city = db.Column(db.String(120), nullable=False)
 
-    shipments = db.relationship("Shipment", back_populates="customer", cascade="all, delete-orphan")
+    # Deleted set-based by app.purge (and ON DELETE CASCADE where foreign keys are enforced).
+    shipments = db.relationship("Shipment", back_populates="customer", cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return f"<Customer {self.email}>"
@@ -40,6 +44,13 @@ class Courier(db.Model, TimestampMixin):
         return f"<Courier {self.email}>"
 
 
+# Typeahead pickers: case-insensitive name prefix ranges (email is stored lowercase, so its unique index serves).
+db.Index("ix_customer_first_name_nocase", Customer.first_name.collate("NOCASE"))
+db.Index("ix_customer_last_name_nocase", Customer.last_name.collate("NOCASE"))
+db.Index("ix_courier_first_name_nocase", Courier.first_name.collate("NOCASE"))
+db.Index("ix_courier_last_name_nocase", Courier.last_name.collate("NOCASE"))
+
+
 class Admin(db.Model, TimestampMixin):
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(120), nullable=False)
@@ -53,34 +64,117 @@ class Admin(db.Model, TimestampMixin):
 
 
 class Shipment(db.Model, TimestampMixin):
+    # Stored in the main database, or in a region file when sharding is on (see app/sharding.py).
+    __table_args__ = {"schema": SHARD_SCHEMA}
+
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id"), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id", ondelete="CASCADE"), nullable=False)
     sender_address = db.Column(db.String(255), nullable=False)
     receiver_address = db.Column(db.String(255), nullable=False)
     city = db.Column(db.String(120))
     requested_date = db.Column(db.DateTime, nullable=False)
     tracking_number = db.Column(db.String(64), unique=True, nullable=False)
-    assigned_courier_id = db.Column(db.Integer, db.ForeignKey("courier.id"))
+    assigned_courier_id = db.Column(db.Integer, db.ForeignKey("courier.id", ondelete="SET NULL"))
+    # Denormalized from the latest TrackingEvent (kept in sync by _sync_shipment_status).
+    status = db.Column(db.String(50), nullable=False, default="Created", server_default="Created")
+    last_event_at = db.Column(db.DateTime)
+    events_archived_at = db.Column(db.DateTime)
 
     customer = db.relationship("Customer", back_populates="shipments")
     courier = db.relationship("Courier", back_populates="shipments")
     tracking_events = db.relationship(
-        "TrackingEvent", back_populates="shipment", cascade="all, delete-orphan", order_by="TrackingEvent.created_at"
+        "TrackingEvent",
+        back_populates="shipment",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="TrackingEvent.created_at",
     )
 
+    def timeline(self):
+        """Tracking events in order, including any moved to the archive database."""
+        if not self.events_archived_at:
+            return self.tracking_events
+        from app.archive import load_archived_events
+
+        return load_archived_events(self.id) + list(self.tracking_events)
+
+    def recent_events(self, limit, before_id=None):
+        """A window of at most ``limit`` events older than ``before_id`` (the newest by default).
+
+        Returns ``(events oldest first, has_earlier)``. Windows follow event ids through
+        the (shipment_id, id) index, continuing into the archive when events were moved there.
+        """
+        query = TrackingEvent.query.filter(TrackingEvent.shipment_id == self.id)
+        if before_id is not None:
+            query = query.filter(TrackingEvent.id < before_id)
+        events = query.order_by(TrackingEvent.id.desc()).limit(limit + 1).all()
+        if len(events) <= limit and self.events_archived_at:
+            from app.archive import archived_event_window
+
+            older_than = events[-1].id if events else before_id
+            events += archived_event_window(self.id, limit + 1 - len(events), older_than)
+        return list(reversed(events[:limit])), len(events) > limit
+
+    def latest_event(self, status=None):
+        """Newest event (optionally with ``status``): one backwards step on the (shipment_id, id) index."""
+        query = TrackingEvent.query.filter(TrackingEvent.shipment_id == self.id)
+        if status:
+            query = query.filter(TrackingEvent.status == status)
+        latest = query.order_by(TrackingEvent.id.desc()).first()
+        if latest is None and self.events_archived_at:
+            from app.archive import archived_event_window
+
+            latest = next(iter(archived_event_window(self.id, 1, status=status)), None)
+        return latest
+
     def latest_status(self):
-        if self.tracking_events:
-            return self.tracking_events[-1].status
-        return "Created"
+        return self.status or "Created"
+
+    def latest_event_id(self):
+        """Id of the newest tracking event, from the index alone (0 when there are none)."""
+        latest = (
+            db.session.query(db.func.max(TrackingEvent.id)).filter(TrackingEvent.shipment_id == self.id).scalar()
+        )
+        if latest is None and self.events_archived_at:
+            from app.archive import latest_archived_event_id
+
+            latest = latest_archived_event_id(self.id)
+        return latest or 0
+
+    def is_active(self):
+        return self.latest_status() not in TERMINAL_STATUSES
 
     def __repr__(self):
         return f"<Shipment {self.tracking_number}>"
 
 
+# Terminal statuses are rendered as literals so SQLite can match the partial index below.
+ACTIVE_SHIPMENT_FILTER = Shipment.status.notin_(
+    bindparam("terminal_statuses", list(TERMINAL_STATUSES), expanding=True, literal_execute=True)
+)
+
+# Courier history tabs: equality on courier, IN on status, ordered by created_at.
+db.Index("ix_shipment_courier_status_created", Shipment.assigned_courier_id, Shipment.status, Shipment.created_at)
+# Courier delta sync: the courier's shipments in (updated_at, id) order.
+db.Index("ix_shipment_courier_updated", Shipment.assigned_courier_id, Shipment.updated_at)
+# Delivery analytics: delivered shipments by delivery time.
+db.Index("ix_shipment_status_last_event", Shipment.status, Shipment.last_event_at)
+# "Today's stops": only non-terminal shipments are indexed, so it stays small however long the history grows.
+db.Index(
+    "ix_shipment_courier_active",
+    Shipment.assigned_courier_id,
+    Shipment.created_at,
+    sqlite_where=Shipment.status.notin_(TERMINAL_STATUSES),
+)
+
+
 class TrackingEvent(db.Model):
+    # AUTOINCREMENT: ids are never reused after deletes, so change-feed cursors stay valid.
+    __table_args__ = {"schema": SHARD_SCHEMA, "sqlite_autoincrement": True}
+
     id = db.Column(db.Integer, primary_key=True)
-    shipment_id = db.Column(db.Integer, db.ForeignKey("shipment.id"), nullable=False)
-    courier_id = db.Column(db.Integer, db.ForeignKey("courier.id"))
+    shipment_id = db.Column(db.Integer, db.ForeignKey(f"{SHARD_SCHEMA}.shipment.id", ondelete="CASCADE"), nullable=False)
+    courier_id = db.Column(db.Integer, db.ForeignKey("courier.id", ondelete="SET NULL"))
     status = db.Column(db.String(50), nullable=False)
     location_description = db.Column(db.String(255), nullable=False)
     notes = db.Column(db.Text)
@@ -92,3 +186,19 @@ class TrackingEvent(db.Model):
 
     def __repr__(self):
         return f"<TrackingEvent {self.status} for {self.shipment_id}>"
+
+
+# Per-shipment timeline and "latest event" lookups.
+db.Index("ix_tracking_event_shipment_id", TrackingEvent.shipment_id, TrackingEvent.id)
+
+
+@event.listens_for(TrackingEvent, "after_insert")
+def _sync_shipment_status(mapper, connection, target):
+    """Copy the newest event's status onto its shipment; out-of-order backfills are ignored."""
+    shipment = Shipment.__table__
+    connection.execute(
+        shipment.update()
+        .where(shipment.c.id == target.shipment_id)
+        .where(or_(shipment.c.last_event_at.is_(None), shipment.c.last_event_at <= target.created_at))
+        .values(status=target.status, last_event_at=target.created_at)
+    )
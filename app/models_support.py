@@ -1,7 +1,11 @@
 from datetime import datetime
 
+from sqlalchemy import DDL, column, event, select, table, text
+
 from app import db
 
+TICKET_STATUSES = ["Open", "In Progress", "Resolved", "Closed"]
+
 
 class SupportTicket(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -10,19 +14,88 @@ class SupportTicket(db.Model):
     name = db.Column(db.String(120), nullable=False)
     email = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # customer or courier
-    tracking_number = db.Column(db.String(64))
+    tracking_number = db.Column(db.String(64), index=True)
     subject = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=False)
     status = db.Column(db.String(50), default="Open")
     admin_notes = db.Column(db.Text)
-    comments = db.relationship("SupportComment", back_populates="ticket", cascade="all, delete-orphan")
+    # Set on tickets opened by the stuck-shipment scan: when the shipment's last event was.
+    stuck_since = db.Column(db.DateTime)
+    comments = db.relationship(
+        "SupportComment", back_populates="ticket", cascade="all, delete-orphan", order_by="SupportComment.created_at"
+    )
+    shipment = db.relationship(
+        "Shipment",
+        primaryjoin="foreign(SupportTicket.tracking_number) == Shipment.tracking_number",
+        viewonly=True,
+        uselist=False,
+    )
+
+    __table_args__ = (
+        # Keyset pagination over the queue, with and without a status filter.
+        db.Index("ix_support_ticket_updated", "updated_at", "id"),
+        db.Index("ix_support_ticket_status_updated", "status", "updated_at", "id"),
+        # One stuck-scan ticket per stuck episode, however many scans race to open it.
+        db.Index(
+            "ux_support_ticket_stuck",
+            "tracking_number",
+            "stuck_since",
+            unique=True,
+            sqlite_where=text("stuck_since IS NOT NULL"),
+        ),
+    )
 
 
 class SupportComment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    ticket_id = db.Column(db.Integer, db.ForeignKey("support_ticket.id"), nullable=False)
+    ticket_id = db.Column(db.Integer, db.ForeignKey("support_ticket.id"), nullable=False, index=True)
     author = db.Column(db.String(120), nullable=False)  # Admin name/email placeholder
     body = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     ticket = db.relationship("SupportTicket", back_populates="comments")
+
+
+# Full-text search over tickets: an external-content FTS5 table kept in sync by triggers.
+SEARCH_INDEX_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS support_ticket_fts USING fts5("
+    "subject, description, tracking_number, content='support_ticket', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS support_ticket_fts_ai AFTER INSERT ON support_ticket BEGIN "
+    "INSERT INTO support_ticket_fts(rowid, subject, description, tracking_number) "
+    "VALUES (new.id, new.subject, new.description, new.tracking_number); END",
+    "CREATE TRIGGER IF NOT EXISTS support_ticket_fts_ad AFTER DELETE ON support_ticket BEGIN "
+    "INSERT INTO support_ticket_fts(support_ticket_fts, rowid, subject, description, tracking_number) "
+    "VALUES ('delete', old.id, old.subject, old.description, old.tracking_number); END",
+    "CREATE TRIGGER IF NOT EXISTS support_ticket_fts_au AFTER UPDATE OF subject, description, tracking_number "
+    "ON support_ticket BEGIN "
+    "INSERT INTO support_ticket_fts(support_ticket_fts, rowid, subject, description, tracking_number) "
+    "VALUES ('delete', old.id, old.subject, old.description, old.tracking_number); "
+    "INSERT INTO support_ticket_fts(rowid, subject, description, tracking_number) "
+    "VALUES (new.id, new.subject, new.description, new.tracking_number); END",
+]
+
+for _statement in SEARCH_INDEX_DDL:
+    event.listen(SupportTicket.__table__, "after_create", DDL(_statement))
+
+
+def ensure_search_index(connection):
+    """Create the FTS table/triggers on an existing database and index current tickets."""
+    for statement in SEARCH_INDEX_DDL:
+        connection.execute(text(statement))
+    connection.execute(text("INSERT INTO support_ticket_fts(support_ticket_fts) VALUES ('rebuild')"))
+
+
+support_ticket_fts = table("support_ticket_fts", column("rowid"), column("support_ticket_fts"))
+
+
+def fts_query(search):
+    """Turn free text into a safe FTS5 query: every word must match, as a prefix."""
+    terms = ['"' + term.replace('"', '""') + '"*' for term in search.split()]
+    return " ".join(terms)
+
+
+def search_ticket_ids(search):
+    """Subquery of ticket ids matching ``search`` in subject, description or tracking number."""
+    return select(support_ticket_fts.c.rowid).where(
+        support_ticket_fts.c.support_ticket_fts.op("MATCH")(fts_query(search))
+    )
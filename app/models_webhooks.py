@@ -0,0 +1,53 @@
+from datetime import datetime
+
+from app import db
+
+
+def parse_statuses(value):
+    return [s.strip() for s in (value or "").split(",") if s.strip()]
+
+
+class WebhookSubscription(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    name = db.Column(db.String(120), nullable=False)
+    url = db.Column(db.String(512), nullable=False)
+    secret = db.Column(db.String(128), nullable=False)
+    statuses = db.Column(db.String(512))  # comma-separated filter; empty means every status
+    active = db.Column(db.Boolean, nullable=False, default=True)
+
+    deliveries = db.relationship("WebhookOutbox", back_populates="subscription", lazy="dynamic")
+
+    def status_list(self):
+        return parse_statuses(self.statuses)
+
+    def __repr__(self):
+        return f"<WebhookSubscription {self.url}>"
+
+
+class WebhookOutbox(db.Model):
+    """One pending, delivered or dead-lettered notification, written with its TrackingEvent."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    subscription_id = db.Column(
+        db.Integer, db.ForeignKey("webhook_subscription.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    # Event ids are unique per shard only; (shard, tracking_event_id) identifies the event.
+    shard = db.Column(db.String(64))
+    tracking_event_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, delivered, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lease_token = db.Column(db.String(32))
+    last_error = db.Column(db.String(512))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime)
+
+    subscription = db.relationship("WebhookSubscription", back_populates="deliveries")
+
+    __table_args__ = (db.Index("ix_webhook_outbox_due", "status", "next_attempt_at"),)
+
+    def __repr__(self):
+        return f"<WebhookOutbox {self.id} {self.status}>"
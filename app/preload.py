@@ -0,0 +1,26 @@
+"""
+Optional warm-up for prefork servers.
+
+Heavy dependencies (fpdf, bcrypt, numpy) and the PDF/CSV code paths are imported on
+first use, so a freshly spawned worker boots fast. A server that loads the app
+once in a master process and forks workers from it should call ``warm_up``
+there instead: modules and compiled templates loaded before the fork are shared
+copy-on-write by every worker, and no worker pays for them on its first request.
+"""
+import importlib
+
+from app import db
+
+HEAVY_MODULES = ("bcrypt", "csv", "fpdf", "numpy", "app.print_utils")
+
+
+def warm_up(app, templates=True):
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+    importlib.import_module("app.print_utils").get_layout()
+    if templates:
+        for name in app.jinja_env.list_templates(extensions=["html"]):
+            app.jinja_env.get_template(name)
+    # Pooled connections must not cross a fork; every worker opens its own.
+    with app.app_context():
+        db.engine.dispose()
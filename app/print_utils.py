@@ -1,12 +1,40 @@
+"""
+PDF snapshots and delivery receipts.
+
+The static parts of a document (fonts and their character widths, margins,
+the label column) are worked out once per process in ``PdfLayout``; documents
+only place the per-shipment values. A value that fits on one line, which is
+nearly every line of a timeline, is measured from the cached widths and
+written with ``FPDF.text`` at the position ``multi_cell`` would use. Longer or
+multi-line values still go through ``multi_cell``, whose line breaking (and
+justification) is what made long timelines slow, so the output is unchanged.
+"""
 from datetime import datetime
 
 from fpdf import FPDF
 
+FONT_FAMILY = "Helvetica"
+# name: (font style, size in points)
+FONTS = {
+    "title": ("B", 16),
+    "section": ("B", 12),
+    "label": ("B", 11),
+    "body": ("", 11),
+    "note": ("I", 10),
+    "small": ("", 10),
+}
+PAGE_BREAK_MARGIN = 15
+LABEL_WIDTH = 42
+# Lines measured this close to the available width go through multi_cell, which decides exactly.
+FIT_TOLERANCE = 0.05
+
 
 def _safe_text(value) -> str:
     if value is None:
         return ""
     text = value if isinstance(value, str) else str(value)
+    if text.isascii():
+        return text
     return text.encode("latin-1", "replace").decode("latin-1")
 
 
@@ -16,117 +44,164 @@ def _fmt_dt(value) -> str:
     return value.strftime("%Y-%m-%d %H:%M")
 
 
-def _output_pdf(pdf: FPDF) -> bytes:
-    return pdf.output(dest="S").encode("latin-1")
-
-
-def _init_pdf(title: str) -> FPDF:
+def _new_pdf() -> FPDF:
     pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.set_auto_page_break(auto=True, margin=PAGE_BREAK_MARGIN)
     pdf.add_page()
-    pdf.set_font("Helvetica", "B", 16)
-    pdf.cell(0, 10, _safe_text(title), ln=True)
-    pdf.set_font("Helvetica", "", 11)
-    timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
-    pdf.cell(0, 7, _safe_text(f"Generated: {timestamp}"), ln=True)
-    pdf.ln(2)
     return pdf
 
 
-def _add_section_title(pdf: FPDF, title: str) -> None:
-    pdf.set_font("Helvetica", "B", 12)
-    pdf.cell(0, 8, _safe_text(title), ln=True)
-    pdf.set_font("Helvetica", "", 11)
-
-
-def _add_key_value(pdf: FPDF, label: str, value: str) -> None:
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(42, 6, _safe_text(f"{label}:"), 0, 0)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.multi_cell(0, 6, _safe_text(value))
+class PdfLayout:
+    """Fonts, character widths and page geometry shared by every document of the process."""
+
+    def __init__(self):
+        pdf = _new_pdf()
+        self.left = pdf.l_margin
+        self.top = pdf.t_margin
+        self.cell_margin = pdf.c_margin
+        self.page_break_at = pdf.page_break_trigger
+        self.text_width = pdf.epw - 2 * pdf.c_margin
+        self.value_x = pdf.l_margin + LABEL_WIDTH
+        self.value_width = pdf.epw - LABEL_WIDTH - 2 * pdf.c_margin
+        self.fonts = {}
+        for name, (style, size) in FONTS.items():
+            pdf.set_font(FONT_FAMILY, style, size)
+            scale = size / 1000 / pdf.k
+            widths = {char: width * scale for char, width in pdf.current_font.cw.items()}
+            self.fonts[name] = (style, size, pdf.font_size, widths)
+
+    def width(self, font, text):
+        return sum(map(self.fonts[font][3].__getitem__, text))
+
+
+_layout = None
+
+
+def get_layout() -> PdfLayout:
+    global _layout
+    if _layout is None:
+        _layout = PdfLayout()
+    return _layout
+
+
+class _Document:
+    def __init__(self, title):
+        self.layout = get_layout()
+        self.pdf = _new_pdf()
+        self.y = self.layout.top
+        self.font = None
+        self.line("title", title, 10)
+        timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
+        self.line("body", f"Generated: {timestamp}", 7)
+        self.space(2)
+
+    def _set_font(self, font):
+        if font != self.font:
+            style, size = FONTS[font]
+            self.pdf.set_font(FONT_FAMILY, style, size)
+            self.font = font
+
+    def _write(self, font, x, text, height):
+        """One line of ``height`` at the current position, breaking the page first if it doesn't fit."""
+        if self.y + height > self.layout.page_break_at:
+            self.pdf.add_page()
+            self.y = self.layout.top
+        self._set_font(font)
+        baseline = self.y + 0.5 * height + 0.3 * self.layout.fonts[font][2]
+        self.pdf.text(x + self.layout.cell_margin, baseline, text)
+
+    def line(self, font, text, height):
+        self._write(font, self.layout.left, _safe_text(text), height)
+        self.y += height
+
+    def paragraph(self, font, text, height, x=None, width=None):
+        """Like ``multi_cell(0, height, text)`` starting at ``x`` (the left margin by default)."""
+        layout = self.layout
+        x = layout.left if x is None else x
+        width = layout.text_width if width is None else width
+        text = _safe_text(text)
+        if "\n" not in text and layout.width(font, text) < width - FIT_TOLERANCE:
+            self._write(font, x, text, height)
+            self.y += height
+            return
+        self._set_font(font)
+        self.pdf.set_xy(x, self.y)
+        self.pdf.multi_cell(0, height, text, new_x="LMARGIN", new_y="NEXT")
+        self.y = self.pdf.get_y()
+
+    def section(self, title):
+        self.line("section", title, 8)
+
+    def key_value(self, label, value):
+        self._write("label", self.layout.left, f"{label}:", 6)
+        self.paragraph("body", value, 6, self.layout.value_x, self.layout.value_width)
+
+    def space(self, height):
+        self.y += height
+
+    def output(self) -> bytes:
+        return bytes(self.pdf.output())
 
 
 def find_latest_delivered_event(shipment):
-    if not shipment or not shipment.tracking_events:
+    if not shipment:
         return None
-    for event in reversed(shipment.tracking_events):
-        if event.status == "Delivered":
-            return event
-    return None
+    return shipment.latest_event(status="Delivered")
 
 
-def build_shipment_pdf(shipment) -> bytes:
-    pdf = _init_pdf("Shipment Summary")
+def _add_parties(document, shipment):
     customer = shipment.customer
     courier = shipment.courier
+    document.key_value("Customer", f"{customer.first_name} {customer.last_name}" if customer else "Unknown")
+    document.key_value("Courier", f"{courier.first_name} {courier.last_name}" if courier else "Unassigned")
+
 
-    _add_section_title(pdf, "Shipment Details")
-    _add_key_value(pdf, "Tracking Number", shipment.tracking_number)
-    _add_key_value(pdf, "Status", shipment.latest_status())
-    _add_key_value(pdf, "Requested", _fmt_dt(shipment.requested_date))
-    _add_key_value(pdf, "Sender Address", shipment.sender_address)
-    _add_key_value(pdf, "Receiver Address", shipment.receiver_address)
-    _add_key_value(pdf, "City", shipment.city or "N/A")
-    _add_key_value(
-        pdf,
-        "Customer",
-        f"{customer.first_name} {customer.last_name}" if customer else "Unknown",
-    )
-    _add_key_value(
-        pdf,
-        "Courier",
-        f"{courier.first_name} {courier.last_name}" if courier else "Unassigned",
-    )
-
-    pdf.ln(2)
-    _add_section_title(pdf, "Tracking Timeline")
-    if not shipment.tracking_events:
-        pdf.cell(0, 6, "No tracking events.", ln=True)
-        return _output_pdf(pdf)
-
-    for event in shipment.tracking_events:
-        line = f"{_fmt_dt(event.created_at)} - {event.status} - {event.location_description}"
-        pdf.multi_cell(0, 6, _safe_text(line))
+def build_shipment_pdf(shipment) -> bytes:
+    document = _Document("Shipment Summary")
+
+    document.section("Shipment Details")
+    document.key_value("Tracking Number", shipment.tracking_number)
+    document.key_value("Status", shipment.latest_status())
+    document.key_value("Requested", _fmt_dt(shipment.requested_date))
+    document.key_value("Sender Address", shipment.sender_address)
+    document.key_value("Receiver Address", shipment.receiver_address)
+    document.key_value("City", shipment.city or "N/A")
+    _add_parties(document, shipment)
+
+    document.space(2)
+    document.section("Tracking Timeline")
+    events = shipment.timeline()
+    if not events:
+        document.line("body", "No tracking events.", 6)
+        return document.output()
+
+    for event in events:
+        document.paragraph("body", f"{_fmt_dt(event.created_at)} - {event.status} - {event.location_description}", 6)
         if event.notes:
-            pdf.set_font("Helvetica", "I", 10)
-            pdf.multi_cell(0, 5, _safe_text(f"Notes: {event.notes}"))
-            pdf.set_font("Helvetica", "", 11)
+            document.paragraph("note", f"Notes: {event.notes}", 5)
         if event.proof_url:
-            pdf.set_font("Helvetica", "", 10)
-            pdf.multi_cell(0, 5, _safe_text(f"Proof: {event.proof_url}"))
-            pdf.set_font("Helvetica", "", 11)
-        pdf.ln(1)
+            document.paragraph("small", f"Proof: {event.proof_url}", 5)
+        document.space(1)
 
-    return _output_pdf(pdf)
+    return document.output()
 
 
 def build_receipt_pdf(shipment, delivered_event) -> bytes:
-    pdf = _init_pdf("Delivery Receipt")
-    customer = shipment.customer
-    courier = shipment.courier
+    document = _Document("Delivery Receipt")
 
-    _add_section_title(pdf, "Receipt Details")
-    _add_key_value(pdf, "Tracking Number", shipment.tracking_number)
-    _add_key_value(pdf, "Status", "Delivered")
-    _add_key_value(pdf, "Delivered At", _fmt_dt(delivered_event.created_at))
-    _add_key_value(pdf, "Receiver Address", shipment.receiver_address)
-    _add_key_value(pdf, "City", shipment.city or "N/A")
-    _add_key_value(
-        pdf,
-        "Customer",
-        f"{customer.first_name} {customer.last_name}" if customer else "Unknown",
-    )
-    _add_key_value(
-        pdf,
-        "Courier",
-        f"{courier.first_name} {courier.last_name}" if courier else "Unassigned",
-    )
+    document.section("Receipt Details")
+    document.key_value("Tracking Number", shipment.tracking_number)
+    document.key_value("Status", "Delivered")
+    document.key_value("Delivered At", _fmt_dt(delivered_event.created_at))
+    document.key_value("Receiver Address", shipment.receiver_address)
+    document.key_value("City", shipment.city or "N/A")
+    _add_parties(document, shipment)
 
     if delivered_event.location_description:
-        _add_key_value(pdf, "Delivery Location", delivered_event.location_description)
+        document.key_value("Delivery Location", delivered_event.location_description)
     if delivered_event.notes:
-        _add_key_value(pdf, "Notes", delivered_event.notes)
+        document.key_value("Notes", delivered_event.notes)
     if delivered_event.proof_url:
-        _add_key_value(pdf, "Proof", delivered_event.proof_url)
+        document.key_value("Proof", delivered_event.proof_url)
 
-    return _output_pdf(pdf)
+    return document.output()
@@ -0,0 +1,244 @@
+"""
+Set-based deletion of shipments and customers.
+
+Shipments and their tracking events are removed with ``DELETE ... WHERE
+shipment_id IN (...)`` statements instead of loading them through the ORM
+cascade. A customer's shipments go shard by shard in batches of
+``PURGE_BATCH_SIZE``, with a commit after each batch, so other writers get the
+SQLite lock in between. Customers with more than ``PURGE_SYNC_LIMIT``
+shipments are purged by a background thread that records its progress in
+``purge_job``; ``flask purge-customer`` runs or resumes the same job. The thread
+dies with its server process, so the job also carries a heartbeat: a pending or
+running job that hasn't moved for ``PURGE_STALE_SECONDS`` is stale, and deleting
+the customer again resumes it.
+
+In single-database mode connections also enable ``PRAGMA foreign_keys`` so the
+``ON DELETE`` rules declared on the models back this up. Shards cannot reference
+tables in the main file, so the pragma stays off when sharding is on.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, event, func, select, update
+
+from app import db
+from app.sharding import ShipmentDirectory, each_shard, is_enabled as sharding_enabled
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_JOB_STATUSES = ("pending", "running")
+
+
+class PurgeJob(db.Model):
+    __tablename__ = "purge_job"
+
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, running, done, failed
+    total = db.Column(db.Integer, nullable=False, default=0)
+    done = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(512))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set when the job is (re)started and after every batch.
+    heartbeat_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    @property
+    def percent(self):
+        return 100 if not self.total else min(100, self.done * 100 // self.total)
+
+    @property
+    def stale(self):
+        """Pending or running, but nobody has worked on it lately (its process is gone)."""
+        cutoff = datetime.utcnow() - timedelta(seconds=current_app.config["PURGE_STALE_SECONDS"])
+        return self.status in ACTIVE_JOB_STATUSES and (self.heartbeat_at or self.created_at) < cutoff
+
+    def __repr__(self):
+        return f"<PurgeJob customer={self.customer_id} {self.status} {self.done}/{self.total}>"
+
+
+def init_app(app):
+    app.cli.add_command(purge_customer_command)
+    if app.config["SQLITE_FOREIGN_KEYS"] and not app.config.get("SHARD_REGIONS"):
+        with app.app_context():
+            engine = db.engine
+
+        @event.listens_for(engine, "connect")
+        def enable_foreign_keys(dbapi_connection, connection_record):
+            dbapi_connection.execute("PRAGMA foreign_keys = ON")
+
+
+def delete_shipments(shipment_ids):
+    """Delete shipments and their events in the routed shard; the caller commits."""
+    from app import archive
+    from app.courier_sync import record_assignments
+    from app.models import Shipment, TrackingEvent
+
+    if not shipment_ids:
+        return 0
+    options = {"synchronize_session": False}
+    assigned = db.session.execute(
+        select(Shipment.id, Shipment.assigned_courier_id).where(
+            Shipment.id.in_(shipment_ids), Shipment.assigned_courier_id.isnot(None)
+        )
+    ).all()
+    record_assignments(db.session.connection(), [(shipment_id, courier_id, None) for shipment_id, courier_id in assigned])
+    db.session.execute(delete(TrackingEvent).where(TrackingEvent.shipment_id.in_(shipment_ids)), execution_options=options)
+    deleted = db.session.execute(delete(Shipment).where(Shipment.id.in_(shipment_ids)), execution_options=options).rowcount
+    if sharding_enabled():
+        db.session.execute(delete(ShipmentDirectory).where(ShipmentDirectory.id.in_(shipment_ids)), execution_options=options)
+    if archive.is_enabled():
+        db.session.execute(
+            archive.archived_events.delete().where(archive.archived_events.c.shipment_id.in_(shipment_ids))
+        )
+    return deleted
+
+
+def count_customer_shipments(customer_id):
+    from app.models import Shipment
+
+    return sum(
+        db.session.execute(select(func.count()).where(Shipment.customer_id == customer_id)).scalar()
+        for _ in each_shard()
+    )
+
+
+def purge_customer(customer_id, batch_size=None, progress=None):
+    """Delete a customer with all shipments and events, committing every ``batch_size`` shipments."""
+    from app import archive
+    from app.models import Customer, Shipment
+
+    batch_size = batch_size or current_app.config["PURGE_BATCH_SIZE"]
+    done = 0
+    for _ in each_shard():
+        while True:
+            ids = db.session.execute(
+                select(Shipment.id).where(Shipment.customer_id == customer_id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            done += delete_shipments(ids)
+            db.session.commit()
+            if progress:
+                progress(done)
+    if archive.is_enabled():
+        archived_ids = select(archive.archived_shipments.c.id).where(archive.archived_shipments.c.customer_id == customer_id)
+        db.session.execute(archive.archived_events.delete().where(archive.archived_events.c.shipment_id.in_(archived_ids)))
+        db.session.execute(archive.archived_shipments.delete().where(archive.archived_shipments.c.customer_id == customer_id))
+    db.session.execute(delete(Customer).where(Customer.id == customer_id), execution_options={"synchronize_session": False})
+    db.session.commit()
+    return done
+
+
+def active_job(customer_id):
+    return PurgeJob.query.filter(
+        PurgeJob.customer_id == customer_id, PurgeJob.status.in_(ACTIVE_JOB_STATUSES)
+    ).first()
+
+
+def start_purge_job(customer_id, total):
+    """Record a purge job and run it on a background thread of this process."""
+    job = PurgeJob(customer_id=customer_id, total=total)
+    db.session.add(job)
+    db.session.commit()
+    _start_thread(job.id)
+    return job
+
+
+def resume_purge_job(job):
+    """Continue a stale job on a background thread of this process; False if someone else took it over first."""
+    if not claim_job(job):
+        return False
+    _start_thread(job.id)
+    return True
+
+
+def claim_job(job):
+    """Refresh the heartbeat read with ``job``, so only one of several concurrent resumers wins."""
+    claimed = db.session.execute(
+        update(PurgeJob)
+        .where(PurgeJob.id == job.id, PurgeJob.heartbeat_at.isnot_distinct_from(job.heartbeat_at))
+        .values(heartbeat_at=datetime.utcnow()),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    db.session.commit()
+    return bool(claimed)
+
+
+def _start_thread(job_id):
+    app = current_app._get_current_object()
+    threading.Thread(target=_run_in_background, args=(app, job_id), name="purge-customer", daemon=True).start()
+
+
+def _run_in_background(app, job_id):
+    with app.app_context():
+        run_job(job_id)
+
+
+def run_job(job_id, batch_size=None, echo=None):
+    job = db.session.get(PurgeJob, job_id)
+    job.status = "running"
+    job.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+    customer_id = job.customer_id
+
+    recorded = 0
+
+    def record(done):
+        nonlocal recorded
+        db.session.execute(
+            update(PurgeJob)
+            .where(PurgeJob.id == job_id)
+            .values(done=PurgeJob.done + done - recorded, heartbeat_at=datetime.utcnow())
+        )
+        db.session.commit()
+        recorded = done
+        if echo:
+            echo(done)
+
+    try:
+        purge_customer(customer_id, batch_size=batch_size, progress=record)
+    except Exception as exc:  # leave the job resumable with the error visible in the admin
+        logger.exception("Purging customer %s failed", customer_id)
+        db.session.rollback()
+        db.session.execute(
+            update(PurgeJob).where(PurgeJob.id == job_id).values(status="failed", error=str(exc)[:500])
+        )
+        db.session.commit()
+        return False
+    db.session.execute(
+        update(PurgeJob).where(PurgeJob.id == job_id).values(status="done", finished_at=datetime.utcnow())
+    )
+    db.session.commit()
+    return True
+
+
+@click.command("purge-customer")
+@click.argument("customer_id", type=int)
+@click.option("--batch-size", type=int, default=None, help="Shipments deleted per transaction.")
+@with_appcontext
+def purge_customer_command(customer_id, batch_size):
+    """Delete a customer and all their shipments in batches (resumes an interrupted job)."""
+    from app.models import Customer
+
+    job = PurgeJob.query.filter(
+        PurgeJob.customer_id == customer_id, PurgeJob.status.in_(ACTIVE_JOB_STATUSES + ("failed",))
+    ).first()
+    if job is None:
+        if db.session.get(Customer, customer_id) is None:
+            raise click.ClickException(f"Customer {customer_id} does not exist.")
+        job = PurgeJob(customer_id=customer_id, total=count_customer_shipments(customer_id))
+        db.session.add(job)
+        db.session.commit()
+    elif job.status in ACTIVE_JOB_STATUSES and not job.stale:
+        raise click.ClickException(f"Customer {customer_id} is being deleted by a server process; try again later.")
+    elif not claim_job(job):
+        raise click.ClickException(f"Customer {customer_id} is being deleted by another process.")
+    total = job.total
+    if not run_job(job.id, batch_size=batch_size, echo=lambda done: print(f"Deleted {done} of {total} shipments...")):
+        raise click.ClickException("Purge failed; run the command again to resume.")
+    print(f"Customer {customer_id} deleted.")
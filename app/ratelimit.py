@@ -0,0 +1,50 @@
+"""
+Per-client token buckets for the public blueprint.
+
+Each client IP gets ``PUBLIC_RATE_LIMIT_BURST`` tokens that refill at
+``PUBLIC_RATE_LIMIT_RATE`` per second; a request spends one and is answered 429
+when the bucket is empty. Buckets live in the worker process, so the effective
+limit scales with the number of workers.
+"""
+import threading
+import time
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key, now=None):
+        """Spend a token for ``key``; returns ``(allowed, seconds until the next token)``."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            if key not in self._buckets and len(self._buckets) >= self.max_clients:
+                self._prune(now)
+            self._buckets[key] = (tokens, now)
+        return allowed, 0 if allowed else (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        """Forget clients whose bucket has refilled completely; they are indistinguishable from new ones."""
+        full_after = self.burst / self.rate
+        self._buckets = {key: state for key, state in self._buckets.items() if now - state[1] < full_after}
+        if len(self._buckets) >= self.max_clients:
+            oldest = sorted(self._buckets.items(), key=lambda item: item[1][1])[: len(self._buckets) // 2]
+            for key, _ in oldest:
+                del self._buckets[key]
+
+
+def init_app(app):
+    rate = app.config["PUBLIC_RATE_LIMIT_RATE"]
+    if rate > 0:
+        app.extensions["public_rate_limiter"] = TokenBucketLimiter(
+            rate, app.config["PUBLIC_RATE_LIMIT_BURST"], app.config["PUBLIC_RATE_LIMIT_MAX_CLIENTS"]
+        )
@@ -0,0 +1,115 @@
+"""
+Column-only read models for the shipment list, report and export views.
+
+Those views show five or six columns per shipment. Loading ``Shipment`` objects
+for them (plus a ``Customer`` and ``Courier`` per row) fills the session's
+identity map with whole rows and their ORM state. ``shipment_rows`` selects only
+the displayed columns, with the names concatenated in SQL, and returns compact
+``ShipmentRow`` records. Statuses and courier names repeat across rows, so each
+distinct value is stored once.
+"""
+from datetime import datetime
+
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import func, or_, select
+
+from app import db
+from app.models import Courier, Customer, Shipment
+from app.sharding import each_shard
+
+
+class ShipmentRow:
+    """One shipment as list, report and export views show it (``courier_name`` is None when unassigned)."""
+
+    __slots__ = ("id", "tracking_number", "customer_name", "courier_name", "status", "requested_date", "created_at")
+
+    def __init__(self, id, tracking_number, customer_name, courier_name, status, requested_date, created_at):
+        self.id = id
+        self.tracking_number = tracking_number
+        self.customer_name = customer_name
+        self.courier_name = courier_name
+        self.status = status
+        self.requested_date = requested_date
+        self.created_at = created_at
+
+    def csv_row(self):
+        return [
+            self.tracking_number,
+            self.customer_name,
+            self.courier_name or "Unassigned",
+            self.status,
+            self.requested_date.strftime("%Y-%m-%d"),
+        ]
+
+
+def shipment_rows_query(*criteria):
+    """SELECT of the ``ShipmentRow`` columns for shipments matching ``criteria`` (unordered)."""
+    return (
+        select(
+            Shipment.id,
+            Shipment.tracking_number,
+            Customer.first_name + " " + Customer.last_name,
+            Courier.first_name + " " + Courier.last_name,
+            Shipment.status,
+            Shipment.requested_date,
+            Shipment.created_at,
+        )
+        .join(Customer, Customer.id == Shipment.customer_id)
+        .outerjoin(Courier, Courier.id == Shipment.assigned_courier_id)
+        .where(*criteria)
+    )
+
+
+def search_filter(search):
+    """Tracking number or customer name containing ``search``, case-insensitively."""
+    pattern = f"%{search}%"
+    return or_(
+        Shipment.tracking_number.ilike(pattern),
+        Customer.first_name.ilike(pattern),
+        Customer.last_name.ilike(pattern),
+    )
+
+
+def to_rows(result, shared=None):
+    """``ShipmentRow`` records from rows of ``shipment_rows_query``."""
+    shared = {} if shared is None else shared
+    rows = []
+    for id, tracking_number, customer_name, courier_name, status, requested_date, created_at in result:
+        rows.append(
+            ShipmentRow(
+                id,
+                tracking_number,
+                customer_name,
+                shared.setdefault(courier_name, courier_name),
+                shared.setdefault(status, status),
+                requested_date,
+                created_at,
+            )
+        )
+    return rows
+
+
+def shipment_rows(*criteria):
+    """Matching shipments of every shard, newest first."""
+    query = shipment_rows_query(*criteria).order_by(Shipment.created_at.desc())
+    shared = {}
+    rows = []
+    for _ in each_shard():
+        rows += to_rows(db.session.execute(query), shared)
+    rows.sort(key=lambda row: row.created_at or datetime.min, reverse=True)
+    return rows
+
+
+class ShipmentRowPagination(Pagination):
+    """A page of ``shipment_rows_query(...)`` as ``ShipmentRow`` records (``db.paginate`` only yields scalars)."""
+
+    def __init__(self, query, **kwargs):
+        super().__init__(query=query, **kwargs)
+
+    def _query_items(self):
+        query = self._query_args["query"]
+        return to_rows(db.session.execute(query.limit(self.per_page).offset(self._query_offset)))
+
+    def _query_count(self):
+        counted = self._query_args["query"].order_by(None).subquery()
+        return db.session.execute(select(func.count()).select_from(counted)).scalar()
@@ -2,16 +2,37 @@ import secrets
 import string
 from datetime import datetime
 
-import csv
 import io
 
-from flask import Blueprint, Response, abort, flash, redirect, render_template, request, send_file, url_for
-from sqlalchemy import func
+from flask import Blueprint, Response, abort, current_app, flash, jsonify, redirect, render_template, request, send_file, stream_with_context, url_for
+from sqlalchemy import and_, func, or_
 
 from app import db
+from app.analytics import QUANTILES, AnalyticsError, delivery_report, parse_range
+from app.archive import tracking_number_exists
+from app.assignment import AssignmentError, auto_assign, reassign_shipments
 from app.auth_utils import hash_password, login_required
 from app.models import Courier, Customer, Shipment, TrackingEvent
-from app.print_utils import build_receipt_pdf, build_shipment_pdf, find_latest_delivered_event
+from app.purge import (
+    PurgeJob,
+    active_job as active_purge_job,
+    count_customer_shipments,
+    delete_shipments,
+    purge_customer,
+    resume_purge_job,
+    start_purge_job,
+)
+from app.read_models import search_filter, shipment_rows
+from app.sharding import (
+    each_shard,
+    follow_courier,
+    rehome_courier_shipments,
+    route_shipment,
+    shard_for_new_shipment,
+    tracking_number_taken,
+    use_shard,
+)
+from app.stuck import report_json, scan
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -21,10 +42,58 @@ def generate_tracking_number():
     while True:
         suffix = "".join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
         tracking = f"{prefix}-{suffix}"
-        if not Shipment.query.filter_by(tracking_number=tracking).first():
+        if (
+            not Shipment.query.filter_by(tracking_number=tracking).first()
+            and not tracking_number_exists(tracking)
+            and not tracking_number_taken(tracking)
+        ):
             return tracking
 
 
+def _get_shipment_or_404(shipment_id):
+    if not route_shipment(shipment_id=shipment_id):
+        abort(404)
+    return Shipment.query.get_or_404(shipment_id)
+
+
+def _prefix(column, text):
+    """``column`` starts with ``text``, as an index range instead of a LIKE."""
+    return and_(column >= text, column < text + "\U0010ffff")
+
+
+def _picker_results(model, label, detail):
+    """Prefix search for the shipment form pickers: ``?q=`` (name or email), ``page``; 20 per page."""
+    text = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = current_app.config["PICKER_PAGE_SIZE"]
+    first_name = model.first_name.collate("NOCASE")
+    last_name = model.last_name.collate("NOCASE")
+    query = model.query.with_entities(model.id, model.first_name, model.last_name, detail)
+    words = text.split()
+    if len(words) >= 2:
+        query = query.filter(_prefix(first_name, words[0]), _prefix(last_name, " ".join(words[1:])))
+    elif words:
+        query = query.filter(
+            or_(_prefix(first_name, text), _prefix(last_name, text), _prefix(model.email, text.lower()))
+        )
+    rows = query.order_by(first_name, last_name, model.id).limit(per_page + 1).offset((page - 1) * per_page).all()
+    return jsonify(
+        {
+            "results": [{"id": row.id, "label": label(row)} for row in rows[:per_page]],
+            "page": page,
+            "has_more": len(rows) > per_page,
+        }
+    )
+
+
+def _customer_label(customer):
+    return f"{customer.first_name} {customer.last_name} ({customer.city})"
+
+
+def _courier_label(courier):
+    return f"{courier.first_name} {courier.last_name} - {courier.region}"
+
+
 def _validate_required(form_data, required_fields):
     missing = [label for field, label in required_fields if not form_data.get(field)]
     if missing:
@@ -36,14 +105,14 @@ def _validate_required(form_data, required_fields):
 @admin_bp.route("/dashboard")
 @login_required(role="admin")
 def dashboard():
-    shipments = Shipment.query.all()
     status_counts = {}
-    for shipment in shipments:
-        status = shipment.latest_status()
-        status_counts[status] = status_counts.get(status, 0) + 1
+    for _ in each_shard():
+        for status, count in db.session.query(Shipment.status, func.count(Shipment.id)).group_by(Shipment.status):
+            status = status or "Created"
+            status_counts[status] = status_counts.get(status, 0) + count
 
     metrics = {
-        "total_shipments": len(shipments),
+        "total_shipments": sum(status_counts.values()),
         "couriers": Courier.query.count(),
         "customers": Customer.query.count(),
         "status_counts": status_counts,
@@ -51,12 +120,29 @@ def dashboard():
     return render_template("admin/dashboard.html", metrics=metrics)
 
 
+# Typeahead pickers
+@admin_bp.route("/lookup/customers")
+@login_required(role="admin")
+def lookup_customers():
+    return _picker_results(Customer, _customer_label, Customer.city)
+
+
+@admin_bp.route("/lookup/couriers")
+@login_required(role="admin")
+def lookup_couriers():
+    return _picker_results(Courier, _courier_label, Courier.region)
+
+
 # Customer Management
 @admin_bp.route("/customers")
 @login_required(role="admin")
 def customers():
     records = Customer.query.order_by(Customer.created_at.desc()).all()
-    return render_template("admin/customers_list.html", customers=records)
+    purge_jobs = {
+        job.customer_id: job
+        for job in PurgeJob.query.filter(PurgeJob.status.in_(("pending", "running", "failed"))).order_by(PurgeJob.id)
+    }
+    return render_template("admin/customers_list.html", customers=records, purge_jobs=purge_jobs)
 
 
 @admin_bp.route("/customers/new")
@@ -142,8 +228,19 @@ def update_customer(customer_id):
 @login_required(role="admin")
 def delete_customer(customer_id):
     customer = Customer.query.get_or_404(customer_id)
-    db.session.delete(customer)
-    db.session.commit()
+    job = active_purge_job(customer.id)
+    if job and job.stale and resume_purge_job(job):
+        flash("Resuming the interrupted deletion of this customer.", "info")
+        return redirect(url_for("admin.customers"))
+    if job:
+        flash("This customer is already being deleted.", "info")
+        return redirect(url_for("admin.customers"))
+    total = count_customer_shipments(customer.id)
+    if total > current_app.config["PURGE_SYNC_LIMIT"]:
+        start_purge_job(customer.id, total)
+        flash(f"Deleting the customer and {total} shipments in the background.", "info")
+        return redirect(url_for("admin.customers"))
+    purge_customer(customer.id)
     flash("Customer deleted.", "info")
     return redirect(url_for("admin.customers"))
 
@@ -226,6 +323,7 @@ def update_courier(courier_id):
     if email != courier.email and Courier.query.filter_by(email=email).first():
         flash("Email already exists for another courier.", "warning")
         return redirect(url_for("admin.edit_courier", courier_id=courier.id))
+    previous_region = courier.region
     courier.first_name = data.get("first_name", "")
     courier.last_name = data.get("last_name", "")
     courier.email = email
@@ -234,6 +332,11 @@ def update_courier(courier_id):
     if data.get("hire_date"):
         courier.hire_date = datetime.strptime(data.get("hire_date"), "%Y-%m-%d").date()
     db.session.commit()
+    if courier.region != previous_region:
+        moved = rehome_courier_shipments(courier)
+        if moved:
+            db.session.commit()
+            flash(f"Moved {moved} shipments to the {courier.region} shard.", "info")
     flash("Courier updated.", "success")
     return redirect(url_for("admin.couriers"))
 
@@ -242,6 +345,9 @@ def update_courier(courier_id):
 @login_required(role="admin")
 def delete_courier(courier_id):
     courier = Courier.query.get_or_404(courier_id)
+    for _ in each_shard():
+        Shipment.query.filter_by(assigned_courier_id=courier.id).update({Shipment.assigned_courier_id: None})
+        TrackingEvent.query.filter_by(courier_id=courier.id).update({TrackingEvent.courier_id: None})
     db.session.delete(courier)
     db.session.commit()
     flash("Courier deleted.", "info")
@@ -249,6 +355,28 @@ def delete_courier(courier_id):
 
 
 # Shipment Management
+CSV_CHUNK_ROWS = 500
+
+
+def _shipments_csv(shipments):
+    """Yield the export CSV_CHUNK_ROWS rows at a time, so it streams (and compresses) as it goes.
+
+    ``shipments`` are ``ShipmentRow`` records: the session is gone by the time the body is read.
+    """
+    import csv
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["Tracking", "Customer", "Courier", "Status", "Requested"])
+    for index, shipment in enumerate(shipments, 1):
+        writer.writerow(shipment.csv_row())
+        if index % CSV_CHUNK_ROWS == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+
 @admin_bp.route("/shipments")
 @login_required(role="admin")
 def shipments():
@@ -256,54 +384,64 @@ def shipments():
     search = request.args.get("q", "").strip()
     export = request.args.get("export")
 
-    query = Shipment.query.join(Customer)
+    criteria = []
     if status_filter:
-        # filter by latest status in Python (simpler for SQLite)
-        shipments = query.order_by(Shipment.created_at.desc()).all()
-        shipments = [s for s in shipments if s.latest_status() == status_filter]
-    else:
-        shipments = query.order_by(Shipment.created_at.desc()).all()
-
+        criteria.append(Shipment.status == status_filter)
     if search:
-        lower = search.lower()
-        shipments = [
-            s
-            for s in shipments
-            if lower in s.tracking_number.lower()
-            or lower in s.customer.first_name.lower()
-            or lower in s.customer.last_name.lower()
-        ]
+        criteria.append(search_filter(search))
+    shipments = shipment_rows(*criteria)
 
     if export == "csv":
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["Tracking", "Customer", "Courier", "Status", "Requested"])
-        for s in shipments:
-            writer.writerow(
-                [
-                    s.tracking_number,
-                    f"{s.customer.first_name} {s.customer.last_name}",
-                    f"{s.courier.first_name} {s.courier.last_name}" if s.courier else "Unassigned",
-                    s.latest_status(),
-                    s.requested_date.strftime("%Y-%m-%d"),
-                ]
-            )
-        output.seek(0)
         return Response(
-            output.read(),
+            stream_with_context(_shipments_csv(shipments)),
             mimetype="text/csv",
             headers={"Content-Disposition": "attachment; filename=shipments.csv"},
         )
 
-    return render_template("admin/shipments_list.html", shipments=shipments, status_filter=status_filter, search=search)
+    couriers = Courier.query.order_by(Courier.first_name).all()
+    return render_template(
+        "admin/shipments_list.html", shipments=shipments, status_filter=status_filter, search=search, couriers=couriers
+    )
+
+
+@admin_bp.route("/shipments/reassign", methods=["POST"])
+@login_required(role="admin")
+def bulk_reassign():
+    """Form post from the shipment list, or JSON: {"courier_ids": [...], "shipment_ids": [...], "from_courier_id": n}."""
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        try:
+            courier_ids = [int(value) for value in data.get("courier_ids") or []]
+            shipment_ids = [int(value) for value in data.get("shipment_ids") or []]
+            from_courier_id = int(data["from_courier_id"]) if data.get("from_courier_id") else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "Ids must be integers."}), 400
+    else:
+        courier_ids = request.form.getlist("courier_ids", type=int)
+        shipment_ids = request.form.getlist("shipment_ids", type=int)
+        from_courier_id = request.form.get("from_courier_id", type=int)
+
+    try:
+        result = reassign_shipments(courier_ids, shipment_ids=shipment_ids, from_courier_id=from_courier_id)
+    except AssignmentError as exc:
+        if request.is_json:
+            return jsonify({"error": str(exc)}), 400
+        flash(str(exc), "warning")
+        return redirect(request.referrer or url_for("admin.shipments"))
+
+    if request.is_json:
+        return jsonify(result)
+    message = f"Reassigned {result['reassigned']} shipments"
+    if result["skipped"]:
+        message += f" ({result['skipped']} skipped: completed or already with that courier)"
+    flash(message + ".", "success" if result["reassigned"] else "info")
+    return redirect(request.referrer or url_for("admin.shipments"))
 
 
 @admin_bp.route("/shipments/new")
 @login_required(role="admin")
 def new_shipment():
-    customers = Customer.query.order_by(Customer.first_name).all()
-    couriers = Courier.query.order_by(Courier.first_name).all()
-    return render_template("admin/shipment_form.html", shipment=None, customers=customers, couriers=couriers)
+    return render_template("admin/shipment_form.html", shipment=None)
 
 
 @admin_bp.route("/shipments", methods=["POST"])
@@ -322,6 +460,8 @@ def create_shipment():
     try:
         customer_id = int(data.get("customer_id"))
     except (TypeError, ValueError):
+        customer_id = None
+    if customer_id is None or db.session.get(Customer, customer_id) is None:
         flash("Invalid customer selection.", "warning")
         return redirect(url_for("admin.new_shipment"))
     try:
@@ -335,6 +475,8 @@ def create_shipment():
         return redirect(url_for("admin.new_shipment"))
     assigned_courier_id = data.get("assigned_courier_id")
     assigned_courier_id = int(assigned_courier_id) if assigned_courier_id else None
+    courier = db.session.get(Courier, assigned_courier_id) if assigned_courier_id else None
+    use_shard(shard_for_new_shipment(data.get("city", ""), courier))
     shipment = Shipment(
         customer_id=customer_id,
         sender_address=data.get("sender_address", ""),
@@ -371,17 +513,47 @@ def create_shipment():
     return redirect(url_for("admin.shipments"))
 
 
+@admin_bp.route("/shipments/auto-assign", methods=["GET", "POST"])
+@login_required(role="admin")
+def auto_assign_shipments():
+    """GET shows a dry run; POST assigns for real."""
+    if request.method == "POST":
+        report = auto_assign()
+        flash(f"Auto-assigned {report['assigned']} shipments.", "success" if report["assigned"] else "info")
+        return redirect(url_for("admin.auto_assign_shipments"))
+    return render_template("admin/auto_assign.html", report=auto_assign(dry_run=True))
+
+
+@admin_bp.route("/shipments/stuck", methods=["GET", "POST"])
+@login_required(role="admin")
+def stuck_shipments():
+    """GET lists stuck shipments; POST also opens support tickets for them."""
+    if request.method == "POST":
+        report = scan(create_tickets=True)
+        flash(f"Opened {report['tickets_opened']} support tickets.", "success" if report["tickets_opened"] else "info")
+        return redirect(url_for("admin.stuck_shipments"))
+    return render_template("admin/stuck_shipments.html", report=scan())
+
+
+@admin_bp.route("/shipments/stuck.json")
+@login_required(role="admin")
+def stuck_shipments_json():
+    return jsonify(report_json(scan()))
+
+
 @admin_bp.route("/shipments/<int:shipment_id>")
 @login_required(role="admin")
 def shipment_detail(shipment_id):
-    shipment = Shipment.query.get_or_404(shipment_id)
+    shipment = _get_shipment_or_404(shipment_id)
     return render_template("admin/shipment_detail.html", shipment=shipment)
 
 
 @admin_bp.route("/shipments/<int:shipment_id>/print")
 @login_required(role="admin")
 def print_shipment(shipment_id):
-    shipment = Shipment.query.get_or_404(shipment_id)
+    shipment = _get_shipment_or_404(shipment_id)
+    from app.print_utils import build_shipment_pdf
+
     pdf_bytes = build_shipment_pdf(shipment)
     filename = f"{shipment.tracking_number}.pdf"
     return send_file(
@@ -395,9 +567,11 @@ def print_shipment(shipment_id):
 @admin_bp.route("/shipments/<int:shipment_id>/receipt")
 @login_required(role="admin")
 def print_receipt(shipment_id):
-    shipment = Shipment.query.get_or_404(shipment_id)
+    shipment = _get_shipment_or_404(shipment_id)
     if shipment.latest_status() != "Delivered":
         abort(404)
+    from app.print_utils import build_receipt_pdf, find_latest_delivered_event
+
     delivered_event = find_latest_delivered_event(shipment)
     if not delivered_event:
         abort(404)
@@ -414,18 +588,19 @@ def print_receipt(shipment_id):
 @admin_bp.route("/shipments/<int:shipment_id>/edit")
 @login_required(role="admin")
 def edit_shipment(shipment_id):
-    shipment = Shipment.query.get_or_404(shipment_id)
-    customers = Customer.query.order_by(Customer.first_name).all()
-    couriers = Courier.query.order_by(Courier.first_name).all()
+    shipment = _get_shipment_or_404(shipment_id)
     return render_template(
-        "admin/shipment_form.html", shipment=shipment, customers=customers, couriers=couriers
+        "admin/shipment_form.html",
+        shipment=shipment,
+        customer_label=_customer_label(shipment.customer) if shipment.customer else "",
+        courier_label=_courier_label(shipment.courier) if shipment.courier else "",
     )
 
 
 @admin_bp.route("/shipments/<int:shipment_id>/update", methods=["POST"])
 @login_required(role="admin")
 def update_shipment(shipment_id):
-    shipment = Shipment.query.get_or_404(shipment_id)
+    shipment = _get_shipment_or_404(shipment_id)
     data = request.form
     if not _validate_required(
         data,
@@ -437,10 +612,13 @@ def update_shipment(shipment_id):
     ):
         return redirect(url_for("admin.edit_shipment", shipment_id=shipment.id))
     try:
-        shipment.customer_id = int(data.get("customer_id"))
+        customer_id = int(data.get("customer_id"))
     except (TypeError, ValueError):
+        customer_id = None
+    if customer_id is None or db.session.get(Customer, customer_id) is None:
         flash("Invalid customer selection.", "warning")
         return redirect(url_for("admin.edit_shipment", shipment_id=shipment.id))
+    shipment.customer_id = customer_id
     try:
         if data.get("requested_date"):
             shipment.requested_date = datetime.fromisoformat(data.get("requested_date"))
@@ -465,6 +643,8 @@ def update_shipment(shipment_id):
         db.session.add(assignment_event)
 
     db.session.commit()
+    if follow_courier(shipment.id, shipment.courier):
+        db.session.commit()
     flash("Shipment updated.", "success")
     return redirect(url_for("admin.shipments"))
 
@@ -472,8 +652,8 @@ def update_shipment(shipment_id):
 @admin_bp.route("/shipments/<int:shipment_id>/delete", methods=["POST"])
 @login_required(role="admin")
 def delete_shipment(shipment_id):
-    shipment = Shipment.query.get_or_404(shipment_id)
-    db.session.delete(shipment)
+    shipment = _get_shipment_or_404(shipment_id)
+    delete_shipments([shipment.id])
     db.session.commit()
     flash("Shipment deleted.", "info")
     return redirect(url_for("admin.shipments"))
@@ -487,47 +667,46 @@ def reports():
     courier_id = request.args.get("courier_id", type=int)
     status_filter = request.args.get("status")
 
-    query = Shipment.query
+    criteria = []
     if start_date:
-        query = query.filter(Shipment.requested_date >= datetime.fromisoformat(start_date))
+        criteria.append(Shipment.requested_date >= datetime.fromisoformat(start_date))
     if end_date:
-        query = query.filter(Shipment.requested_date <= datetime.fromisoformat(end_date))
+        criteria.append(Shipment.requested_date <= datetime.fromisoformat(end_date))
     if courier_id:
-        query = query.filter(Shipment.assigned_courier_id == courier_id)
-    shipments = query.all()
-
-    filtered_shipments = []
-    for shipment in shipments:
-        latest_status = shipment.latest_status()
-        if status_filter and latest_status != status_filter:
-            continue
-        filtered_shipments.append({"shipment": shipment, "latest_status": latest_status})
-
-    shipments_per_day = (
-        db.session.query(func.date(Shipment.requested_date), func.count(Shipment.id))
-        .group_by(func.date(Shipment.requested_date))
-        .order_by(func.date(Shipment.requested_date))
-        .all()
-    )
-
-    shipments_per_courier = (
-        db.session.query(
-            Courier.first_name,
-            Courier.last_name,
-            func.count(Shipment.id),
+        criteria.append(Shipment.assigned_courier_id == courier_id)
+    if status_filter:
+        criteria.append(Shipment.status == status_filter)
+    filtered_shipments = shipment_rows(*criteria)
+
+    per_day = {}
+    per_courier = {}
+    delivered_shipments = 0
+    total_shipments = 0
+    for _ in each_shard():
+        for day, count in db.session.query(func.date(Shipment.requested_date), func.count(Shipment.id)).group_by(
+            func.date(Shipment.requested_date)
+        ):
+            per_day[day] = per_day.get(day, 0) + count
+        for assigned_id, count in (
+            db.session.query(Shipment.assigned_courier_id, func.count(Shipment.id))
+            .filter(Shipment.assigned_courier_id.is_not(None))
+            .group_by(Shipment.assigned_courier_id)
+        ):
+            per_courier[assigned_id] = per_courier.get(assigned_id, 0) + count
+
+        delivered_shipments += (
+            db.session.query(TrackingEvent.shipment_id)
+            .filter(TrackingEvent.status == "Delivered")
+            .distinct()
+            .count()
         )
-        .join(Shipment, Shipment.assigned_courier_id == Courier.id, isouter=True)
-        .group_by(Courier.id)
-        .all()
-    )
+        total_shipments += Shipment.query.count()
 
-    delivered_shipments = (
-        db.session.query(TrackingEvent.shipment_id)
-        .filter(TrackingEvent.status == "Delivered")
-        .distinct()
-        .count()
-    )
-    total_shipments = Shipment.query.count()
+    # Merged across shards.
+    shipments_per_day = sorted(per_day.items())
+    shipments_per_courier = [
+        (c.first_name, c.last_name, per_courier.get(c.id, 0)) for c in Courier.query.order_by(Courier.id)
+    ]
 
     couriers = Courier.query.order_by(Courier.first_name).all()
 
@@ -540,3 +719,25 @@ def reports():
         total_shipments=total_shipments,
         couriers=couriers,
     )
+
+
+@admin_bp.route("/reports/delivery")
+@login_required(role="admin")
+def reports_delivery():
+    try:
+        start, end = parse_range(request.args.get("start_date"), request.args.get("end_date"))
+    except AnalyticsError as exc:
+        flash(str(exc), "warning")
+        return redirect(url_for("admin.reports_delivery"))
+    report = delivery_report(start, end, refresh=request.args.get("refresh") == "1")
+    return render_template("admin/delivery_report.html", report=report, quantiles=QUANTILES)
+
+
+@admin_bp.route("/reports/delivery.json")
+@login_required(role="admin")
+def reports_delivery_json():
+    try:
+        start, end = parse_range(request.args.get("start_date"), request.args.get("end_date"))
+    except AnalyticsError as exc:
+        return jsonify({"error": str(exc)}), 400
+    return jsonify(delivery_report(start, end, refresh=request.args.get("refresh") == "1"))
@@ -0,0 +1,46 @@
+from flask import Blueprint, current_app, flash, redirect, render_template, request, url_for
+
+from app.auth_utils import login_required
+from app.backup import BackupError, database_files, is_running, list_backups, start_backup_job, verify_backup
+
+backups_bp = Blueprint("backups", __name__, url_prefix="/admin/backups")
+
+
+@backups_bp.route("/")
+@login_required(role="admin")
+def index():
+    return render_template(
+        "admin/backups.html",
+        backups=list_backups(),
+        running=is_running(),
+        backup_dir=current_app.config["BACKUP_DIR"],
+        keep=current_app.config["BACKUP_KEEP"],
+    )
+
+
+@backups_bp.route("/", methods=["POST"])
+@login_required(role="admin")
+def create_backup():
+    if is_running():
+        flash("A backup is already running.", "info")
+        return redirect(url_for("backups.index"))
+    try:
+        database_files()
+    except BackupError as exc:
+        flash(str(exc), "danger")
+        return redirect(url_for("backups.index"))
+    vacuum = request.form.get("vacuum") == "1"
+    start_backup_job(vacuum=vacuum)
+    flash("Compacted snapshot started." if vacuum else "Backup started.", "info")
+    return redirect(url_for("backups.index"))
+
+
+@backups_bp.route("/<name>/verify", methods=["POST"])
+@login_required(role="admin")
+def verify(name):
+    problems = verify_backup(name)
+    if problems:
+        flash(f"Backup {name} is damaged: " + " ".join(problems), "danger")
+    else:
+        flash(f"Backup {name} verified: checksums and integrity check passed.", "success")
+    return redirect(url_for("backups.index"))
@@ -1,20 +1,31 @@
 from datetime import datetime
 from io import BytesIO
 
-from flask import Blueprint, abort, flash, g, redirect, render_template, request, send_file, url_for
+from flask import Blueprint, abort, flash, g, jsonify, redirect, render_template, request, send_file, url_for
 
-from app import db
 from app.auth_utils import login_required
-from app.models import Courier, Shipment, TrackingEvent
-from app.print_utils import build_receipt_pdf, build_shipment_pdf, find_latest_delivered_event
+from app.courier_sync import sync
+from app.event_writer import EventWriterError, record_event
+from app.models import ACTIVE_SHIPMENT_FILTER, Courier, Shipment
+from app.read_models import ShipmentRowPagination, search_filter, shipment_rows_query
+from app.sharding import region_shard, use_shard
 
 courier_bp = Blueprint("courier", __name__, url_prefix="/courier")
 
+DASHBOARD_PAGE_SIZE = 25
+DASHBOARD_VIEWS = {
+    "active": ("Today's stops", ACTIVE_SHIPMENT_FILTER),
+    "delivered": ("Delivered", Shipment.status == "Delivered"),
+    "returned": ("Returned", Shipment.status.in_(["Returned to sender", "Failed/Returned"])),
+}
+
 
 def _get_courier():
     courier = Courier.query.get(g.current_user_id)
     if not courier:
         abort(403)
+    # A courier's shipments always live in their region's shard.
+    use_shard(region_shard(courier.region))
     return courier
 
 
@@ -23,11 +34,33 @@ def _get_courier():
 def dashboard():
     courier = _get_courier()
     search = request.args.get("q", "").strip()
-    shipments = Shipment.query.filter_by(assigned_courier_id=courier.id).order_by(Shipment.created_at.desc()).all()
+    view = request.args.get("view", "active")
+    if view not in DASHBOARD_VIEWS:
+        view = "active"
+    page = request.args.get("page", 1, type=int)
+
+    criteria = [Shipment.assigned_courier_id == courier.id, DASHBOARD_VIEWS[view][1]]
     if search:
-        lower = search.lower()
-        shipments = [s for s in shipments if lower in s.tracking_number.lower() or lower in s.customer.first_name.lower() or lower in s.customer.last_name.lower()]
-    return render_template("courier/dashboard.html", courier=courier, shipments=shipments, search=search)
+        criteria.append(search_filter(search))
+    query = shipment_rows_query(*criteria).order_by(Shipment.created_at.desc())
+    pagination = ShipmentRowPagination(query, page=page, per_page=DASHBOARD_PAGE_SIZE, error_out=False)
+    return render_template(
+        "courier/dashboard.html",
+        courier=courier,
+        shipments=pagination.items,
+        pagination=pagination,
+        search=search,
+        view=view,
+        views=DASHBOARD_VIEWS,
+    )
+
+
+@courier_bp.route("/api/sync")
+@login_required(role="courier")
+def api_sync():
+    """Changes to the courier's shipments since ``cursor`` (JSON, for mobile clients)."""
+    courier = _get_courier()
+    return jsonify(sync(courier, request.args.get("cursor"), request.args.get("limit", type=int)))
 
 
 @courier_bp.route("/shipments/<int:shipment_id>")
@@ -43,6 +76,8 @@ def shipment_detail(shipment_id):
 def print_shipment(shipment_id):
     courier = _get_courier()
     shipment = Shipment.query.filter_by(id=shipment_id, assigned_courier_id=courier.id).first_or_404()
+    from app.print_utils import build_shipment_pdf
+
     pdf_bytes = build_shipment_pdf(shipment)
     filename = f"{shipment.tracking_number}.pdf"
     return send_file(
@@ -60,6 +95,8 @@ def print_receipt(shipment_id):
     shipment = Shipment.query.filter_by(id=shipment_id, assigned_courier_id=courier.id).first_or_404()
     if shipment.latest_status() != "Delivered":
         abort(404)
+    from app.print_utils import build_receipt_pdf, find_latest_delivered_event
+
     delivered_event = find_latest_delivered_event(shipment)
     if not delivered_event:
         abort(404)
@@ -87,17 +124,19 @@ def track_shipment(shipment_id):
         if not status or not location_description:
             flash("Status and location are required.", "warning")
             return redirect(url_for("courier.track_shipment", shipment_id=shipment.id))
-        event = TrackingEvent(
-            shipment_id=shipment.id,
-            courier_id=courier.id,
-            status=status,
-            location_description=location_description or "Unknown",
-            notes=notes,
-            proof_url=proof_url or None,
-            created_at=datetime.utcnow(),
-        )
-        db.session.add(event)
-        db.session.commit()
+        try:
+            record_event(
+                shipment_id=shipment.id,
+                courier_id=courier.id,
+                status=status,
+                location_description=location_description or "Unknown",
+                notes=notes,
+                proof_url=proof_url or None,
+                created_at=datetime.utcnow(),
+            )
+        except EventWriterError as exc:
+            flash(str(exc), "warning")
+            return redirect(url_for("courier.track_shipment", shipment_id=shipment.id))
         flash("Tracking event recorded.", "success")
         return redirect(url_for("courier.shipment_detail", shipment_id=shipment.id))
 
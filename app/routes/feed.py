@@ -0,0 +1,45 @@
+import hmac
+import json
+
+from flask import Blueprint, Response, current_app, jsonify, request, session, stream_with_context
+
+from app.changefeed import CursorError, page_size, read_feed
+
+feed_bp = Blueprint("feed", __name__, url_prefix="/feed")
+
+
+@feed_bp.before_request
+def _authenticate():
+    """Admins (session) or consumers presenting ``CHANGE_FEED_TOKEN`` as a bearer token."""
+    if session.get("role") == "admin":
+        return None
+    token = current_app.config["CHANGE_FEED_TOKEN"]
+    scheme, _, presented = request.headers.get("Authorization", "").partition(" ")
+    if token and scheme.lower() == "bearer" and hmac.compare_digest(presented.strip(), token):
+        return None
+    response = jsonify({"error": "Authentication required."})
+    response.status_code = 401
+    response.headers["WWW-Authenticate"] = "Bearer"
+    return response
+
+
+@feed_bp.route("/events")
+def events():
+    """Tracking events after ``after`` as NDJSON; ``wait`` long-polls when there are none yet."""
+    limit = page_size(request.args.get("limit", type=int))
+    wait = max(0.0, min(request.args.get("wait", 0, type=float), current_app.config["CHANGE_FEED_MAX_WAIT"]))
+    try:
+        records, cursor, has_more = read_feed(
+            request.args.get("after", ""), limit, wait=wait, client_id=request.remote_addr
+        )
+    except CursorError as exc:
+        return jsonify({"error": str(exc)}), 400
+    return Response(
+        stream_with_context(json.dumps(record) + "\n" for record in records),
+        mimetype="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-store",
+            "X-Feed-Cursor": cursor,
+            "X-Feed-Has-More": "true" if has_more else "false",
+        },
+    )
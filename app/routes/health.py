@@ -0,0 +1,55 @@
+import time
+
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+
+health_bp = Blueprint("health", __name__, url_prefix="/health")
+
+
+def start_draining(app):
+    """Fail readiness and end live streams so a stopping worker empties quickly."""
+    app.extensions["draining"] = True
+    hub = app.extensions.get("live_updates")
+    if hub:
+        hub.shutdown()
+
+
+def _probe(statement):
+    """Run ``statement`` and return (latency in ms, error or None)."""
+    started = time.perf_counter()
+    try:
+        db.session.execute(text(statement)).first()
+        error = None
+    except SQLAlchemyError as exc:
+        db.session.rollback()
+        error = str(exc.__cause__ or exc).splitlines()[0][:200]
+    return round((time.perf_counter() - started) * 1000, 2), error
+
+
+def _report(ok, latency_ms, error, **extra):
+    payload = {"status": "ok" if ok else "fail", "db_ms": latency_ms, **extra}
+    if error:
+        payload["error"] = error
+    response = jsonify(payload)
+    response.status_code = 200 if ok else 503
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@health_bp.route("/live")
+def live():
+    latency_ms, error = _probe("SELECT 1")
+    ok = error is None and latency_ms <= current_app.config["HEALTH_LIVE_MAX_DB_MS"]
+    return _report(ok, latency_ms, error)
+
+
+@health_bp.route("/ready")
+def ready():
+    if current_app.extensions.get("draining"):
+        return _report(False, None, None, draining=True)
+    latency_ms, error = _probe("SELECT id FROM shipment ORDER BY id DESC LIMIT 1")
+    ok = error is None and latency_ms <= current_app.config["HEALTH_READY_MAX_DB_MS"]
+    return _report(ok, latency_ms, error)
@@ -1,13 +1,47 @@
+import math
 from io import BytesIO
 
-from flask import Blueprint, abort, render_template, request, send_file
+from flask import Blueprint, Response, abort, current_app, jsonify, render_template, request, send_file, stream_with_context
 
-from app.models import Shipment
-from app.print_utils import build_receipt_pdf, build_shipment_pdf, find_latest_delivered_event
+from app import TERMINAL_STATUSES
+from app.archive import find_archived_shipment
+from app.sharding import route_shipment
+from app.live import event_payload, get_hub, stream_shipment_events
+from app.models import Shipment, TrackingEvent
+from app.tracking_filter import might_exist
 
 public_bp = Blueprint("public", __name__)
 
 
+@public_bp.before_request
+def _rate_limit():
+    limiter = current_app.extensions.get("public_rate_limiter")
+    if limiter is None:
+        return None
+    allowed, retry_after = limiter.allow(request.remote_addr or "")
+    if not allowed:
+        return Response("Too many requests.", status=429, headers={"Retry-After": str(math.ceil(retry_after))})
+    return None
+
+
+def _find_shipment(tracking_number):
+    if not might_exist(tracking_number):
+        return None
+    shipment = None
+    if route_shipment(tracking_number=tracking_number):
+        shipment = Shipment.query.filter_by(tracking_number=tracking_number).first()
+    if shipment is None:
+        shipment = find_archived_shipment(tracking_number)
+    return shipment
+
+
+def _find_shipment_or_404(tracking_number):
+    shipment = _find_shipment(tracking_number)
+    if shipment is None:
+        abort(404)
+    return shipment
+
+
 @public_bp.route("/")
 def home():
     return render_template("public/home.html")
@@ -23,17 +57,38 @@ def track():
         tracking_number = request.args.get("tracking_number", "").strip()
 
     if tracking_number:
-        shipment = Shipment.query.filter_by(tracking_number=tracking_number).first()
+        shipment = _find_shipment(tracking_number)
 
     return render_template("public/track.html", shipment=shipment, tracking_number=tracking_number)
 
 
+@public_bp.route("/track/events")
+def track_events():
+    """Older timeline entries as JSON: events before ``before_id``, oldest first."""
+    tracking_number = request.args.get("tracking_number", "").strip()
+    if not tracking_number:
+        abort(404)
+    shipment = _find_shipment_or_404(tracking_number)
+    limit = request.args.get("limit", current_app.config["TIMELINE_WINDOW"], type=int)
+    limit = max(1, min(limit, current_app.config["TIMELINE_PAGE_MAX"]))
+    events, has_earlier = shipment.recent_events(limit, before_id=request.args.get("before_id", type=int))
+    return jsonify(
+        {
+            "events": [event_payload(tracking_event) for tracking_event in events],
+            "has_earlier": has_earlier,
+            "before_id": events[0].id if events else None,
+        }
+    )
+
+
 @public_bp.route("/track/print")
 def print_shipment():
     tracking_number = request.args.get("tracking_number", "").strip()
     if not tracking_number:
         abort(404)
-    shipment = Shipment.query.filter_by(tracking_number=tracking_number).first_or_404()
+    shipment = _find_shipment_or_404(tracking_number)
+    from app.print_utils import build_shipment_pdf
+
     pdf_bytes = build_shipment_pdf(shipment)
     filename = f"{shipment.tracking_number}.pdf"
     return send_file(
@@ -49,9 +104,11 @@ def print_receipt():
     tracking_number = request.args.get("tracking_number", "").strip()
     if not tracking_number:
         abort(404)
-    shipment = Shipment.query.filter_by(tracking_number=tracking_number).first_or_404()
+    shipment = _find_shipment_or_404(tracking_number)
     if shipment.latest_status() != "Delivered":
         abort(404)
+    from app.print_utils import build_receipt_pdf, find_latest_delivered_event
+
     delivered_event = find_latest_delivered_event(shipment)
     if not delivered_event:
         abort(404)
@@ -63,3 +120,40 @@ def print_receipt():
         as_attachment=False,
         download_name=filename,
     )
+
+
+@public_bp.route("/track/stream")
+def track_stream():
+    if not current_app.config["LIVE_UPDATES_ENABLED"]:
+        abort(404)
+    tracking_number = request.args.get("tracking_number", "").strip()
+    if not tracking_number or not might_exist(tracking_number) or not route_shipment(tracking_number=tracking_number):
+        abort(404)
+    shipment = Shipment.query.filter_by(tracking_number=tracking_number).first_or_404()
+    if shipment.latest_status() in TERMINAL_STATUSES:
+        return Response(status=204)
+
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    if last_id is None:
+        last_id = request.args.get("last_event_id", type=int)
+    if last_id is None:
+        last_id = (
+            TrackingEvent.query.with_entities(TrackingEvent.id)
+            .filter_by(shipment_id=shipment.id)
+            .order_by(TrackingEvent.id.desc())
+            .limit(1)
+            .scalar()
+            or 0
+        )
+
+    hub = get_hub()
+    subscription = hub.subscribe(shipment.id, request.remote_addr)
+    if subscription is None:
+        return Response("Too many live connections.", status=503, headers={"Retry-After": "30"})
+    response = Response(
+        stream_with_context(stream_shipment_events(subscription, last_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(lambda: hub.unsubscribe(subscription))
+    return response
@@ -1,11 +1,30 @@
+from datetime import datetime
+
 from flask import Blueprint, flash, redirect, render_template, request, url_for
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import selectinload
 
 from app import db
 from app.auth_utils import login_required
-from app.models_support import SupportComment, SupportTicket
+from app.models_support import TICKET_STATUSES, SupportComment, SupportTicket, search_ticket_ids
+from app.sharding import route_shipment, shipment_ids_by_tracking_number
 
 support_bp = Blueprint("support", __name__, url_prefix="/support")
 
+TICKETS_PAGE_SIZE = 50
+
+
+def _encode_cursor(ticket):
+    return f"{ticket.updated_at.isoformat()}_{ticket.id}"
+
+
+def _decode_cursor(value):
+    try:
+        updated_at, ticket_id = value.rsplit("_", 1)
+        return datetime.fromisoformat(updated_at), int(ticket_id)
+    except (AttributeError, ValueError):
+        return None
+
 
 @support_bp.route("/new", methods=["GET", "POST"])
 def new_ticket():
@@ -21,7 +40,7 @@ def new_ticket():
             name=data.get("name"),
             email=data.get("email"),
             role=data.get("role"),
-            tracking_number=data.get("tracking_number", "").strip(),
+            tracking_number=data.get("tracking_number", "").strip() or None,
             subject=data.get("subject"),
             description=data.get("description"),
             status="Open",
@@ -38,17 +57,46 @@ def new_ticket():
 @login_required(role="admin")
 def admin_tickets():
     status = request.args.get("status")
-    query = SupportTicket.query.order_by(SupportTicket.updated_at.desc())
+    search = request.args.get("q", "").strip()
+    cursor = _decode_cursor(request.args.get("after"))
+
+    query = SupportTicket.query
     if status:
-        query = query.filter_by(status=status)
-    tickets = query.all()
-    return render_template("support/admin_tickets.html", tickets=tickets)
+        query = query.filter(SupportTicket.status == status)
+    if search:
+        query = query.filter(SupportTicket.id.in_(search_ticket_ids(search)))
+    if cursor:
+        query = query.filter(tuple_(SupportTicket.updated_at, SupportTicket.id) < cursor)
+    rows = (
+        query.order_by(SupportTicket.updated_at.desc(), SupportTicket.id.desc()).limit(TICKETS_PAGE_SIZE + 1).all()
+    )
+    tickets = rows[:TICKETS_PAGE_SIZE]
+    next_cursor = _encode_cursor(tickets[-1]) if len(rows) > TICKETS_PAGE_SIZE else None
+
+    shipment_ids = shipment_ids_by_tracking_number(t.tracking_number for t in tickets)
+
+    status_counts = dict(
+        db.session.query(SupportTicket.status, func.count(SupportTicket.id)).group_by(SupportTicket.status).all()
+    )
+    return render_template(
+        "support/admin_tickets.html",
+        tickets=tickets,
+        shipment_ids=shipment_ids,
+        statuses=TICKET_STATUSES,
+        status_counts=status_counts,
+        status=status,
+        search=search,
+        next_cursor=next_cursor,
+        paged=cursor is not None,
+    )
 
 
 @support_bp.route("/admin/<int:ticket_id>", methods=["GET", "POST"])
 @login_required(role="admin")
 def admin_ticket_detail(ticket_id):
-    ticket = SupportTicket.query.get_or_404(ticket_id)
+    ticket = SupportTicket.query.options(selectinload(SupportTicket.comments)).get_or_404(ticket_id)
+    if ticket.tracking_number:
+        route_shipment(tracking_number=ticket.tracking_number)
     if request.method == "POST":
         action = request.form.get("action")
         if action == "comment":
@@ -64,5 +112,4 @@ def admin_ticket_detail(ticket_id):
         flash("Ticket updated.", "success")
         return redirect(url_for("support.admin_ticket_detail", ticket_id=ticket.id))
 
-    statuses = ["Open", "In Progress", "Resolved", "Closed"]
-    return render_template("support/admin_ticket_detail.html", ticket=ticket, statuses=statuses)
+    return render_template("support/admin_ticket_detail.html", ticket=ticket, statuses=TICKET_STATUSES)
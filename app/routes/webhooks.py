@@ -0,0 +1,83 @@
+import secrets
+
+from flask import Blueprint, flash, redirect, render_template, request, url_for
+from sqlalchemy import func
+
+from app import db
+from app.auth_utils import login_required
+from app.models_webhooks import WebhookOutbox, WebhookSubscription, parse_statuses
+from app.webhooks import retry_dead
+
+webhooks_bp = Blueprint("webhooks", __name__, url_prefix="/admin/webhooks")
+
+
+@webhooks_bp.route("/")
+@login_required(role="admin")
+def subscriptions():
+    records = WebhookSubscription.query.order_by(WebhookSubscription.created_at.desc()).all()
+    counts = {}
+    for subscription_id, status, count in (
+        db.session.query(WebhookOutbox.subscription_id, WebhookOutbox.status, func.count(WebhookOutbox.id))
+        .group_by(WebhookOutbox.subscription_id, WebhookOutbox.status)
+        .all()
+    ):
+        counts.setdefault(subscription_id, {})[status] = count
+    dead = (
+        WebhookOutbox.query.filter_by(status="dead").order_by(WebhookOutbox.id.desc()).limit(20).all()
+    )
+    return render_template("admin/webhooks_list.html", subscriptions=records, counts=counts, dead=dead)
+
+
+@webhooks_bp.route("/", methods=["POST"])
+@login_required(role="admin")
+def create_subscription():
+    data = request.form
+    name = data.get("name", "").strip()
+    url = data.get("url", "").strip()
+    if not name or not url:
+        flash("Missing required fields: Name, URL.", "warning")
+        return redirect(url_for("webhooks.subscriptions"))
+    if not url.startswith(("http://", "https://")):
+        flash("Webhook URL must start with http:// or https://.", "warning")
+        return redirect(url_for("webhooks.subscriptions"))
+    secret = secrets.token_hex(24)
+    subscription = WebhookSubscription(
+        name=name,
+        url=url,
+        secret=secret,
+        statuses=", ".join(parse_statuses(",".join(data.getlist("statuses")))) or None,
+    )
+    db.session.add(subscription)
+    db.session.commit()
+    flash(f"Webhook created. Signing secret: {secret}", "success")
+    return redirect(url_for("webhooks.subscriptions"))
+
+
+@webhooks_bp.route("/<int:subscription_id>/toggle", methods=["POST"])
+@login_required(role="admin")
+def toggle_subscription(subscription_id):
+    subscription = WebhookSubscription.query.get_or_404(subscription_id)
+    subscription.active = not subscription.active
+    db.session.commit()
+    flash("Webhook enabled." if subscription.active else "Webhook paused; notifications are held until it is enabled.", "info")
+    return redirect(url_for("webhooks.subscriptions"))
+
+
+@webhooks_bp.route("/<int:subscription_id>/retry", methods=["POST"])
+@login_required(role="admin")
+def retry_subscription(subscription_id):
+    WebhookSubscription.query.get_or_404(subscription_id)
+    count = retry_dead(subscription_id)
+    flash(f"Re-queued {count} dead-lettered notifications.", "info")
+    return redirect(url_for("webhooks.subscriptions"))
+
+
+@webhooks_bp.route("/<int:subscription_id>/delete", methods=["POST"])
+@login_required(role="admin")
+def delete_subscription(subscription_id):
+    subscription = WebhookSubscription.query.get_or_404(subscription_id)
+    WebhookOutbox.query.filter_by(subscription_id=subscription.id).delete(synchronize_session=False)
+    db.session.delete(subscription)
+    db.session.commit()
+    flash("Webhook deleted.", "info")
+    return redirect(url_for("webhooks.subscriptions"))
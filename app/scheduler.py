@@ -0,0 +1,102 @@
+"""
+In-process schedules: the webhook dispatcher, auto-assignment and the
+stuck-shipment scan, when their intervals are configured.
+
+``create_app`` only registers them. Their threads start with the first request
+a process serves, so a server that loads the app and then forks workers
+(``gunicorn.conf.py`` preloads it) never runs them in the master, where they
+would keep SQLite connections open across every fork. CLI commands never start
+them either.
+
+Every serving process runs the threads, but a schedule only does work while its
+process holds an exclusive ``flock`` on ``<instance>/<name>.lock``: one process
+per deployment runs it. The kernel drops the lock when that process exits (a
+recycled worker, say), and another process's thread takes over on its next
+tick. Without ``fcntl`` (Windows) there is only the development server, and the
+lock is skipped.
+"""
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def init_app(app):
+    app.extensions["scheduler"] = Scheduler(app)
+    app.before_request(_ensure_running)
+
+
+def schedule(app, name, target, interval):
+    """Call ``target()`` in an app context every ``interval`` seconds, in one process of the deployment.
+
+    A truthy return value means there is more to do, and the next call follows at once.
+    """
+    if interval and not app.config.get("TESTING"):
+        app.extensions["scheduler"].jobs.append((name, target, interval))
+
+
+def _ensure_running():
+    current_app.extensions["scheduler"].ensure_running()
+
+
+class Scheduler:
+    def __init__(self, app):
+        self.app = app
+        self.jobs = []
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_running(self):
+        if not self.jobs or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                for name, target, interval in self.jobs:
+                    threading.Thread(target=self._run, args=(name, target, interval), name=name, daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self, name, target, interval):
+        lock = ProcessLock(os.path.join(self.app.instance_path, f"{name}.lock"))
+        while True:
+            more = False
+            if lock.acquire():
+                try:
+                    with self.app.app_context():
+                        more = target()
+                except Exception:  # keep the schedule alive across transient DB errors
+                    logger.exception("Scheduled %s run failed", name)
+            if not more:
+                time.sleep(interval)
+
+
+class ProcessLock:
+    """Exclusive lock held by this process until it exits; ``acquire`` never blocks."""
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+
+    def acquire(self):
+        if self._handle is not None or fcntl is None:
+            return True
+        handle = open(self.path, "a+")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        # The pid is for people looking at the file; the lock itself is what counts.
+        handle.truncate(0)
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._handle = handle
+        return True
@@ -0,0 +1,322 @@
+"""
+Optional region-sharded storage for multi-depot deployments.
+
+With ``SHARD_REGIONS`` configured, shipments and tracking events are stored in one
+SQLite file per region (``SHARD_DIR/<region>.db``), ATTACHed to every connection
+as ``shard_<region>``. Customers, couriers, admins, support tickets and webhooks
+stay in the main database. ``Shipment`` and ``TrackingEvent`` are declared in the
+placeholder schema ``shard``, which every session transaction translates to the
+shard it is routed to (or to the main database when sharding is off). SQLite
+locks per file, so courier writes in different regions no longer serialize.
+
+``shipment_directory`` in the main database maps each shipment id and tracking
+number to its shard and hands out shipment ids, so they stay unique across
+shards. Routing: public pages by tracking number, courier pages by the courier's
+region, admin pages by shipment id; admin lists and reports visit every shard
+through ``each_shard()`` and merge the results.
+"""
+import os
+import re
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app import db
+
+SHARD_SCHEMA = "shard"
+SHARD_PREFIX = "shard_"
+
+
+class ShipmentDirectory(db.Model):
+    __tablename__ = "shipment_directory"
+
+    id = db.Column(db.Integer, primary_key=True)
+    tracking_number = db.Column(db.String(64), unique=True, nullable=False)
+    shard = db.Column(db.String(64), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ShipmentDirectory {self.tracking_number} {self.shard}>"
+
+
+def shard_schema(region):
+    return SHARD_PREFIX + re.sub(r"[^a-z0-9]+", "_", region.strip().lower()).strip("_")
+
+
+def shard_name(schema):
+    """The name clients see for a shard schema (``shard_east`` -> ``east``)."""
+    return schema[len(SHARD_PREFIX) :]
+
+
+def init_app(app):
+    """Translate the ``shard`` schema, attach region files and register routing hooks."""
+    from app.models import Shipment, TrackingEvent
+
+    app.cli.add_command(migrate_command)
+    with app.app_context():
+        engine = db.engine
+    engine.update_execution_options(schema_translate_map={SHARD_SCHEMA: None})
+    _register_session_hooks()
+
+    regions = app.config.get("SHARD_REGIONS") or []
+    if not regions:
+        return
+    shard_dir = app.config["SHARD_DIR"]
+    os.makedirs(shard_dir, exist_ok=True)
+    schemas = {}
+    for region in regions:
+        schemas.setdefault(region.strip().casefold(), shard_schema(region))
+    paths = {schema: os.path.join(shard_dir, f"{schema[len('shard_'):]}.db") for schema in schemas.values()}
+    app.extensions["shards"] = {
+        "regions": schemas,
+        "paths": paths,
+        "default": next(iter(paths)),
+    }
+
+    tables = [Shipment.__table__, TrackingEvent.__table__]
+    ddl = []
+    for schema in paths:
+        options = {"schema_translate_map": {SHARD_SCHEMA: schema}, "render_schema_translate": True}
+        ddl += [str(CreateTable(table, if_not_exists=True).compile(dialect=engine.dialect, **options)) for table in tables]
+        ddl += [
+            str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect, **options))
+            for table in tables
+            for index in table.indexes
+        ]
+
+    @event.listens_for(engine, "connect")
+    def attach_shards(dbapi_connection, connection_record):
+        for schema, path in paths.items():
+            dbapi_connection.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        for statement in ddl:
+            dbapi_connection.execute(statement)
+
+
+def is_enabled():
+    return "shards" in current_app.extensions
+
+
+def _config():
+    return current_app.extensions["shards"]
+
+
+def all_shards():
+    """Every shard schema, or ``[None]`` (the main database) when sharding is off."""
+    return list(_config()["paths"]) if is_enabled() else [None]
+
+
+def region_shard(region):
+    """Shard holding a region's shipments; unknown regions use the first configured one."""
+    if not is_enabled():
+        return None
+    config = _config()
+    return config["regions"].get((region or "").strip().casefold(), config["default"])
+
+
+def shard_for_new_shipment(city, courier=None):
+    """New shipments live with their courier's region, else with a region named like their city."""
+    return region_shard(courier.region if courier else city)
+
+
+def current_shard(session=None):
+    session = session or db.session
+    return session.info.get("shard") or (_config()["default"] if is_enabled() else None)
+
+
+def use_shard(schema):
+    """Route the current session (including its open transaction) to ``schema``."""
+    session = db.session()
+    session.info["shard"] = schema
+    if is_enabled() and session.in_transaction():
+        session.connection().execution_options(schema_translate_map={SHARD_SCHEMA: current_shard()})
+
+
+def each_shard():
+    """Route the session to every shard in turn, restoring the previous route afterwards."""
+    previous = db.session.info.get("shard")
+    try:
+        for schema in all_shards():
+            use_shard(schema)
+            yield schema
+    finally:
+        use_shard(previous)
+
+
+def locate(shipment_id=None, tracking_number=None):
+    directory = ShipmentDirectory.__table__
+    query = select(directory.c.shard)
+    if shipment_id is not None:
+        query = query.where(directory.c.id == shipment_id)
+    else:
+        query = query.where(directory.c.tracking_number == tracking_number)
+    return db.session.execute(query).scalar()
+
+
+def route_shipment(shipment_id=None, tracking_number=None):
+    """Route to the shard of one shipment; False when the directory doesn't know it."""
+    if not is_enabled():
+        return True
+    schema = locate(shipment_id=shipment_id, tracking_number=tracking_number)
+    if schema is None:
+        return False
+    use_shard(schema)
+    return True
+
+
+def tracking_number_taken(tracking_number):
+    return is_enabled() and locate(tracking_number=tracking_number) is not None
+
+
+def shipment_ids_by_tracking_number(tracking_numbers):
+    """{tracking number: shipment id} for the given numbers, wherever the shipments live."""
+    from app.models import Shipment
+
+    numbers = [number for number in set(tracking_numbers) if number]
+    if not numbers:
+        return {}
+    if is_enabled():
+        directory = ShipmentDirectory.__table__
+        query = select(directory.c.tracking_number, directory.c.id).where(directory.c.tracking_number.in_(numbers))
+    else:
+        query = select(Shipment.tracking_number, Shipment.id).where(Shipment.tracking_number.in_(numbers))
+    return dict(db.session.execute(query).all())
+
+
+def relocate_shipment(shipment_id, target):
+    """Move a shipment and its events to another shard; the caller commits.
+
+    Events get new ids in the target shard. Objects already loaded for the
+    shipment are stale afterwards.
+    """
+    from app.models import Shipment, TrackingEvent
+
+    source = locate(shipment_id=shipment_id)
+    if source is None or target is None or source == target:
+        return False
+    shipment_columns = ", ".join(column.name for column in Shipment.__table__.columns)
+    event_columns = ", ".join(column.name for column in TrackingEvent.__table__.columns if column.name != "id")
+    db.session.flush()
+    conn = db.session.connection()
+    conn.exec_driver_sql(
+        f"INSERT INTO {target}.shipment ({shipment_columns}) "
+        f"SELECT {shipment_columns} FROM {source}.shipment WHERE id = ?",
+        (shipment_id,),
+    )
+    conn.exec_driver_sql(
+        f"INSERT INTO {target}.tracking_event ({event_columns}) "
+        f"SELECT {event_columns} FROM {source}.tracking_event WHERE shipment_id = ? ORDER BY id",
+        (shipment_id,),
+    )
+    conn.exec_driver_sql(f"DELETE FROM {source}.tracking_event WHERE shipment_id = ?", (shipment_id,))
+    conn.exec_driver_sql(f"DELETE FROM {source}.shipment WHERE id = ?", (shipment_id,))
+    directory = ShipmentDirectory.__table__
+    conn.execute(directory.update().where(directory.c.id == shipment_id).values(shard=target))
+    return True
+
+
+def follow_courier(shipment_id, courier):
+    """Keep a shipment in its assigned courier's region shard; True when it moved."""
+    if not is_enabled() or courier is None:
+        return False
+    return relocate_shipment(shipment_id, region_shard(courier.region))
+
+
+def rehome_courier_shipments(courier):
+    """After a courier changes region, move their shipments into the new region's shard."""
+    from app.models import Shipment
+
+    if not is_enabled():
+        return 0
+    target = region_shard(courier.region)
+    moved = 0
+    for schema in each_shard():
+        if schema == target:
+            continue
+        ids = db.session.execute(select(Shipment.id).where(Shipment.assigned_courier_id == courier.id)).scalars().all()
+        moved += sum(relocate_shipment(shipment_id, target) for shipment_id in ids)
+    return moved
+
+
+_hooks_registered = False
+
+
+def _register_session_hooks():
+    global _hooks_registered
+    if _hooks_registered:
+        return
+    _hooks_registered = True
+    event.listen(Session, "after_begin", _apply_route)
+    event.listen(Session, "before_flush", _sync_directory)
+
+
+def _apply_route(session, transaction, connection):
+    if is_enabled():
+        connection.execution_options(schema_translate_map={SHARD_SCHEMA: current_shard(session)})
+
+
+def _sync_directory(session, flush_context, instances):
+    """Give new shipments a directory id in their shard and drop deleted ones from it."""
+    if not is_enabled():
+        return
+    from app.models import Shipment
+
+    new = [obj for obj in session.new if isinstance(obj, Shipment)]
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Shipment)]
+    if not new and not deleted:
+        return
+    directory = ShipmentDirectory.__table__
+    connection = session.connection()
+    shard = current_shard(session)
+    for shipment in new:
+        if shipment.id is None:
+            result = connection.execute(
+                directory.insert().values(
+                    tracking_number=shipment.tracking_number, shard=shard, created_at=datetime.utcnow()
+                )
+            )
+            shipment.id = result.inserted_primary_key[0]
+    if deleted:
+        connection.execute(directory.delete().where(directory.c.id.in_(deleted)))
+
+
+def migrate_main_database(batch_size=500, progress=None):
+    """Move shipments stored in the main database into their region shards."""
+    moved = 0
+    directory = ShipmentDirectory.__table__
+    while True:
+        conn = db.session.connection()
+        rows = conn.exec_driver_sql(
+            "SELECT s.id, s.tracking_number, s.city, c.region FROM main.shipment s "
+            "LEFT JOIN main.courier c ON c.id = s.assigned_courier_id ORDER BY s.id LIMIT ?",
+            (batch_size,),
+        ).all()
+        if not rows:
+            break
+        for shipment_id, tracking_number, city, region in rows:
+            conn.execute(
+                directory.insert().values(
+                    id=shipment_id, tracking_number=tracking_number, shard="main", created_at=datetime.utcnow()
+                )
+            )
+            relocate_shipment(shipment_id, region_shard(region or city))
+        db.session.commit()
+        moved += len(rows)
+        if progress:
+            progress(moved)
+    return moved
+
+
+@click.command("shard-migrate")
+@click.option("--batch-size", type=int, default=500, help="Shipments moved per transaction.")
+@with_appcontext
+def migrate_command(batch_size):
+    """Move shipments from the main database into their SHARD_REGIONS files."""
+    if not is_enabled():
+        raise click.ClickException("SHARD_REGIONS is not configured.")
+    moved = migrate_main_database(batch_size, progress=lambda n: print(f"Moved {n} shipments..."))
+    print(f"Migration complete: {moved} shipments.")
@@ -0,0 +1,212 @@
+"""
+Stuck-shipment detection.
+
+A shipment is stuck when it has stayed in a non-terminal status without a new
+tracking event for longer than that status's limit in ``STUCK_THRESHOLDS``
+(hours). ``Shipment.status`` and ``Shipment.last_event_at`` are kept in sync
+with the newest event, so each configured status is one range scan of the
+(status, last_event_at) index per shard: the scan reads only stuck rows, never
+the tracking events, however long the history grows. Shipments without any
+event (``last_event_at`` is NULL) are measured from their creation time
+through the same index.
+
+``scan`` can open a ``SupportTicket`` for every stuck shipment that has no
+ticket in progress and none filed since it got stuck, so a scheduled scan
+(``flask stuck-scan --every``, or ``STUCK_SCAN_INTERVAL`` in-process) opens
+one ticket per episode rather than one per run. The episode is also the key of
+a unique index, ``(tracking_number, stuck_since)``, and tickets are inserted with
+``ON CONFLICT DO NOTHING``: scans that race past the lookup (the CLI loop and a
+request, say) still open one ticket. The scheduled scan itself runs in one
+process at a time, in-process or ``--every``, under ``<instance>/stuck-scan.lock``.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, select, union_all
+from sqlalchemy.dialects.sqlite import insert
+
+from app import TERMINAL_STATUSES, db, scheduler
+from app.models import Courier, Customer, Shipment
+from app.models_support import SupportTicket
+from app.sharding import each_shard
+
+logger = logging.getLogger(__name__)
+
+TICKET_ROLE = "system"
+TICKET_NAME = "Stuck shipment monitor"
+# Tickets in these statuses mean someone is already on it.
+OPEN_TICKET_STATUSES = ("Open", "In Progress")
+LOOKUP_BATCH_SIZE = 500
+
+
+def init_app(app):
+    app.cli.add_command(stuck_scan_command)
+    scheduler.schedule(app, "stuck-scan", _scheduled_scan, app.config["STUCK_SCAN_INTERVAL"])
+
+
+def thresholds():
+    """{status: hours} from ``STUCK_THRESHOLDS``; terminal statuses never count as stuck."""
+    configured = current_app.config["STUCK_THRESHOLDS"]
+    return {status: hours for status, hours in configured.items() if hours and status not in TERMINAL_STATUSES}
+
+
+def _stuck_select(status, *criteria):
+    return (
+        select(
+            Shipment.id,
+            Shipment.tracking_number,
+            Shipment.status,
+            Shipment.city,
+            func.coalesce(Shipment.last_event_at, Shipment.created_at),
+            Customer.first_name + " " + Customer.last_name,
+            Courier.first_name + " " + Courier.last_name,
+        )
+        .join(Customer, Customer.id == Shipment.customer_id)
+        .outerjoin(Courier, Courier.id == Shipment.assigned_courier_id)
+        .where(Shipment.status == status, *criteria)
+    )
+
+
+def stuck_query(limits, now):
+    """Shipments past their status's limit: two index range scans per status, no ordering."""
+    parts = []
+    for status, hours in limits.items():
+        cutoff = now - timedelta(hours=hours)
+        parts.append(_stuck_select(status, Shipment.last_event_at < cutoff))
+        parts.append(_stuck_select(status, Shipment.last_event_at.is_(None), Shipment.created_at < cutoff))
+    return union_all(*parts)
+
+
+def find_stuck(now=None):
+    """Stuck shipments of every shard as alert dicts, longest stuck first."""
+    now = now or datetime.utcnow()
+    limits = thresholds()
+    if not limits:
+        return []
+    query = stuck_query(limits, now)
+    alerts = []
+    for _ in each_shard():
+        for id, tracking_number, status, city, since, customer, courier in db.session.execute(query):
+            alerts.append(
+                {
+                    "shipment_id": id,
+                    "tracking_number": tracking_number,
+                    "status": status,
+                    "city": city,
+                    "customer": customer,
+                    "courier": courier,
+                    "since": since,
+                    "hours": round((now - since).total_seconds() / 3600, 1),
+                    "threshold_hours": limits[status],
+                    "ticket_id": None,
+                }
+            )
+    alerts.sort(key=lambda alert: alert["since"])
+    return alerts
+
+
+def attach_tickets(alerts):
+    """Set ``ticket_id`` on alerts already covered by a ticket: one in progress, or one filed since the shipment got stuck."""
+    for start in range(0, len(alerts), LOOKUP_BATCH_SIZE):
+        batch = {alert["tracking_number"]: alert for alert in alerts[start : start + LOOKUP_BATCH_SIZE]}
+        tickets = db.session.execute(
+            select(SupportTicket.id, SupportTicket.tracking_number, SupportTicket.status, SupportTicket.created_at)
+            .where(SupportTicket.tracking_number.in_(list(batch)))
+            .order_by(SupportTicket.id)
+        )
+        for ticket_id, tracking_number, status, created_at in tickets:
+            alert = batch[tracking_number]
+            if status in OPEN_TICKET_STATUSES or (created_at and created_at >= alert["since"]):
+                alert["ticket_id"] = ticket_id
+
+
+def open_tickets(alerts):
+    """Open a support ticket for each alert without one; returns how many were opened.
+
+    A ticket another scan opened for the same episode in the meantime is kept, not duplicated.
+    """
+    email = current_app.config["STUCK_TICKET_EMAIL"]
+    pending = [alert for alert in alerts if not alert["ticket_id"]]
+    if not pending:
+        return 0
+    rows = [
+        {
+            "name": TICKET_NAME,
+            "email": email,
+            "role": TICKET_ROLE,
+            "status": "Open",
+            "tracking_number": alert["tracking_number"],
+            "stuck_since": alert["since"],
+            "subject": f"Stuck shipment {alert['tracking_number']}: {alert['status']} for {alert['hours']:g}h",
+            "description": (
+                f"No tracking event for {alert['hours']:g} hours (limit {alert['threshold_hours']:g}h for "
+                f"\"{alert['status']}\") since {alert['since']:%Y-%m-%d %H:%M} UTC.\n"
+                f"Customer: {alert['customer']}\n"
+                f"Courier: {alert['courier'] or 'Unassigned'}\n"
+                f"City: {alert['city'] or 'N/A'}"
+            ),
+        }
+        for alert in pending
+    ]
+    opened = db.session.execute(
+        insert(SupportTicket).on_conflict_do_nothing().returning(SupportTicket.id), rows
+    ).scalars().all()
+    db.session.commit()
+    attach_tickets(pending)
+    return len(opened)
+
+
+def scan(create_tickets=False, now=None):
+    started = time.perf_counter()
+    alerts = find_stuck(now)
+    attach_tickets(alerts)
+    opened = open_tickets(alerts) if create_tickets else 0
+    return {
+        "thresholds": thresholds(),
+        "alerts": alerts,
+        "tickets_opened": opened,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def report_json(report):
+    return {
+        **report,
+        "alerts": [{**alert, "since": alert["since"].isoformat(timespec="seconds") + "Z"} for alert in report["alerts"]],
+    }
+
+
+def _scheduled_scan():
+    report = scan(create_tickets=current_app.config["STUCK_AUTO_TICKETS"])
+    if report["tickets_opened"]:
+        logger.info("Opened %s tickets for stuck shipments", report["tickets_opened"])
+
+
+def print_report(report):
+    print(f"{len(report['alerts'])} stuck shipments, {report['tickets_opened']} tickets opened in {report['elapsed_ms']}ms.")
+    for alert in report["alerts"]:
+        ticket = f"ticket #{alert['ticket_id']}" if alert["ticket_id"] else "no ticket"
+        print(f"  {alert['tracking_number']:<18} {alert['status']:<22} {alert['hours']:>7g}h  (limit {alert['threshold_hours']:g}h)  {ticket}")
+
+
+@click.command("stuck-scan")
+@click.option("--open-tickets", "create_tickets", is_flag=True, help="Open a support ticket per new stuck shipment.")
+@click.option("--every", type=int, default=None, metavar="SECONDS", help="Keep running on this interval.")
+@with_appcontext
+def stuck_scan_command(create_tickets, every):
+    """List shipments with no tracking event for longer than their status allows."""
+    lock = scheduler.ProcessLock(os.path.join(current_app.instance_path, "stuck-scan.lock"))
+    while True:
+        if not every or lock.acquire():
+            print_report(scan(create_tickets=create_tickets))
+        else:
+            print("Another process runs the scheduled stuck scan; waiting for it to stop.")
+        if not every:
+            return
+        db.session.remove()
+        time.sleep(every)
@@ -0,0 +1,198 @@
+"""
+Negative cache for public tracking lookups.
+
+A Bloom filter of every known tracking number answers "no such shipment" from
+memory, so mistyped and scraped numbers never reach SQLite. Each process builds
+it in a background thread on first use (so prefork workers build their own after
+the fork) and lookups go to the database until it is ready. Numbers committed
+in this process are added right away; shipments created by other processes are
+picked up by reading ids above the filter's high-water mark, at most once every
+``BLOOM_REFRESH_SECONDS`` and only when a number misses.
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Re-read this many ids below the high-water mark: SQLite may hand out the id of a
+# deleted newest row again.
+REFRESH_OVERLAP = 64
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (blake2b double hashing into a bytearray)."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class TrackingNumberFilter:
+    def __init__(self, app):
+        self.app = app
+        self.capacity = app.config["BLOOM_CAPACITY"]
+        self.error_rate = app.config["BLOOM_ERROR_RATE"]
+        self.refresh_seconds = app.config["BLOOM_REFRESH_SECONDS"]
+        self._bloom = None
+        self._high_water = 0
+        self._next_refresh = 0.0
+        self._builder_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._bloom is not None
+
+    def might_exist(self, tracking_number):
+        """False only when ``tracking_number`` is certainly not a shipment; True means "ask the database"."""
+        bloom = self._bloom
+        if bloom is None:
+            self.start_build()
+            return True
+        if tracking_number in bloom:
+            return True
+        if time.monotonic() >= self._next_refresh and self.refresh():
+            return tracking_number in self._bloom
+        return False
+
+    def add(self, tracking_numbers):
+        bloom = self._bloom
+        if bloom is not None:
+            for tracking_number in tracking_numbers:
+                bloom.add(tracking_number)
+
+    def start_build(self):
+        with self._lock:
+            if self._builder_pid == os.getpid():
+                return
+            self._builder_pid = os.getpid()
+        threading.Thread(target=self._build, name="tracking-filter", daemon=True).start()
+
+    def _build(self):
+        try:
+            with self.app.app_context():
+                numbers, high_water = _known_tracking_numbers(include_archive=True)
+                db.session.remove()
+        except Exception:
+            logger.exception("Building the tracking number filter failed")
+            with self._lock:
+                self._builder_pid = None
+            return
+        bloom = BloomFilter(max(self.capacity, len(numbers) * 2), self.error_rate)
+        for tracking_number in numbers:
+            bloom.add(tracking_number)
+        with self._lock:
+            self._bloom = bloom
+            self._high_water = max(self._high_water, high_water)
+            self._next_refresh = time.monotonic() + self.refresh_seconds
+            self._builder_pid = None
+        logger.info("Tracking number filter ready: %s numbers, %s KiB", bloom.count, len(bloom.bits) // 1024)
+
+    def refresh(self):
+        """Add shipments created since the last build/refresh; False when another thread is already at it."""
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            numbers, high_water = _known_tracking_numbers(after_id=self._high_water - REFRESH_OVERLAP)
+            self.add(numbers)
+            self._high_water = max(self._high_water, high_water)
+            self._next_refresh = time.monotonic() + self.refresh_seconds
+            if self._bloom.count > self._bloom.capacity and self._builder_pid is None:
+                self._builder_pid = os.getpid()
+                threading.Thread(target=self._build, name="tracking-filter", daemon=True).start()
+        finally:
+            self._lock.release()
+        return True
+
+
+def _known_tracking_numbers(after_id=0, include_archive=False):
+    """Tracking numbers with ids above ``after_id``, plus the highest id seen."""
+    from app.models import Shipment
+    from app.sharding import ShipmentDirectory, is_enabled
+
+    table = ShipmentDirectory if is_enabled() else Shipment
+    rows = db.session.execute(
+        select(table.id, table.tracking_number).where(table.id > after_id).execution_options(yield_per=10000)
+    )
+    numbers = []
+    high_water = after_id
+    for row_id, tracking_number in rows:
+        numbers.append(tracking_number)
+        high_water = max(high_water, row_id)
+    if include_archive:
+        from app import archive
+
+        if archive.is_enabled():
+            numbers += db.session.execute(select(archive.archived_shipments.c.tracking_number)).scalars().all()
+    return numbers, high_water
+
+
+def init_app(app):
+    if app.config["BLOOM_FILTER_ENABLED"]:
+        app.extensions["tracking_filter"] = TrackingNumberFilter(app)
+        _register_session_hooks()
+
+
+def might_exist(tracking_number):
+    tracking_filter = current_app.extensions.get("tracking_filter")
+    return tracking_filter is None or tracking_filter.might_exist(tracking_number)
+
+
+_hooks_registered = False
+
+
+def _register_session_hooks():
+    global _hooks_registered
+    if _hooks_registered:
+        return
+    _hooks_registered = True
+    event.listen(Session, "after_flush", _collect_new_numbers)
+    event.listen(Session, "after_commit", _add_new_numbers)
+    event.listen(Session, "after_rollback", _discard_new_numbers)
+
+
+def _collect_new_numbers(session, flush_context):
+    from app.models import Shipment
+
+    numbers = [obj.tracking_number for obj in session.new if isinstance(obj, Shipment)]
+    if numbers:
+        session.info.setdefault("new_tracking_numbers", []).extend(numbers)
+
+
+def _add_new_numbers(session):
+    numbers = session.info.pop("new_tracking_numbers", None)
+    if numbers and current_app:
+        tracking_filter = current_app.extensions.get("tracking_filter")
+        if tracking_filter:
+            tracking_filter.add(numbers)
+
+
+def _discard_new_numbers(session):
+    session.info.pop("new_tracking_numbers", None)
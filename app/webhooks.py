@@ -0,0 +1,332 @@
+"""
+Status-change webhooks delivered through a transactional outbox.
+
+When a flush inserts ``TrackingEvent`` rows, matching ``WebhookOutbox`` rows are
+inserted on the same connection, so they commit or roll back together with the
+event and no HTTP happens inside the request. ``WebhookDispatcher`` claims due
+rows with a lease, posts one batch per subscription per round on a bounded
+thread pool, and reschedules failures with exponential backoff until they are
+dead-lettered. Once a batch to an endpoint fails, the rest of that endpoint's
+round is not sent: those rows go back to their previous schedule without
+counting an attempt.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from app import db, scheduler
+from app.sharding import current_shard, shard_name
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-ShipTrack-Signature"
+
+
+def init_app(app):
+    app.cli.add_command(dispatch_command)
+    _register_session_hooks()
+    if app.config["WEBHOOK_DISPATCHER_ENABLED"]:
+        scheduler.schedule(app, "webhook-dispatcher", _dispatch_round, app.config["WEBHOOK_POLL_INTERVAL"])
+
+
+def _dispatch_round():
+    """One round of this process's dispatcher (created after any fork); True when it sent something."""
+    app = current_app._get_current_object()
+    dispatcher = app.extensions.get("webhook_dispatcher")
+    if dispatcher is None:
+        dispatcher = app.extensions["webhook_dispatcher"] = WebhookDispatcher(app)
+    return dispatcher.run_once()
+
+
+_hooks_registered = False
+
+
+def _register_session_hooks():
+    global _hooks_registered
+    if _hooks_registered:
+        return
+    _hooks_registered = True
+    event.listen(Session, "after_flush", _enqueue_new_events)
+
+
+def _enqueue_new_events(session, flush_context):
+    from app.models import TrackingEvent
+
+    new_events = [obj for obj in session.new if isinstance(obj, TrackingEvent)]
+    if new_events:
+        enqueue_events(session.connection(), new_events, current_shard(session))
+
+
+def enqueue_events(connection, new_events, shard=None):
+    """Write outbox rows for already inserted events (ORM objects or rows with the same columns) of ``shard``.
+
+    Flushes are covered by the session hook; bulk inserts that bypass the ORM call this directly.
+    """
+    from app.models import Shipment
+    from app.models_webhooks import WebhookOutbox, WebhookSubscription, parse_statuses
+
+    # Paused subscriptions get rows too; they are held until the subscription is enabled again.
+    subscriptions = connection.execute(select(WebhookSubscription.id, WebhookSubscription.statuses)).all()
+    if not subscriptions:
+        return
+    shipment_ids = {e.shipment_id for e in new_events}
+    shipments = {
+        row.id: row
+        for row in connection.execute(
+            select(Shipment.id, Shipment.tracking_number, Shipment.customer_id, Shipment.assigned_courier_id).where(
+                Shipment.id.in_(shipment_ids)
+            )
+        )
+    }
+    now = datetime.utcnow()
+    shard = shard_name(shard) if shard else None
+    rows = []
+    for tracking_event in new_events:
+        shipment = shipments.get(tracking_event.shipment_id)
+        if shipment is None:
+            continue
+        payload = json.dumps(build_payload(tracking_event, shipment, shard))
+        for subscription_id, statuses in subscriptions:
+            wanted = parse_statuses(statuses)
+            if wanted and tracking_event.status not in wanted:
+                continue
+            rows.append(
+                {
+                    "subscription_id": subscription_id,
+                    "shard": shard,
+                    "tracking_event_id": tracking_event.id,
+                    "payload": payload,
+                    "status": "pending",
+                    "attempts": 0,
+                    "next_attempt_at": now,
+                    "created_at": now,
+                }
+            )
+    if rows:
+        connection.execute(WebhookOutbox.__table__.insert(), rows)
+
+
+def build_payload(tracking_event, shipment, shard=None):
+    """One event of a delivery; sharded deployments add ``shard``, since event ids repeat across shards."""
+    payload = {
+        "type": "shipment.status_changed",
+        "event_id": tracking_event.id,
+        "tracking_number": shipment.tracking_number,
+        "shipment_id": shipment.id,
+        "customer_id": shipment.customer_id,
+        "courier_id": tracking_event.courier_id or shipment.assigned_courier_id,
+        "status": tracking_event.status,
+        "location_description": tracking_event.location_description,
+        "notes": tracking_event.notes,
+        "proof_url": tracking_event.proof_url,
+        "occurred_at": (tracking_event.created_at or datetime.utcnow()).isoformat() + "Z",
+    }
+    if shard:
+        payload["shard"] = shard
+    return payload
+
+
+def sign(secret, body):
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def backoff_delay(attempts, base, maximum):
+    """Exponential backoff with full jitter on the upper half: base * 2**(attempts-1), capped."""
+    delay = min(maximum, base * (2 ** max(0, attempts - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def post_batch(url, secret, payloads, timeout):
+    """POST a batch to one endpoint; returns None on success or an error string."""
+    body = json.dumps({"delivery_id": uuid.uuid4().hex, "events": payloads}).encode("utf-8")
+    request = urllib.request.Request(
+        url,
+        data=body,
+        method="POST",
+        headers={"Content-Type": "application/json", "User-Agent": "ShipTrack-Webhooks", SIGNATURE_HEADER: sign(secret, body)},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            if 200 <= response.status < 300:
+                return None
+            return f"HTTP {response.status}"
+    except urllib.error.HTTPError as exc:
+        return f"HTTP {exc.code}"
+    except (urllib.error.URLError, OSError, ValueError) as exc:
+        return str(getattr(exc, "reason", exc))[:500]
+
+
+class WebhookDispatcher:
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.batch_size = config["WEBHOOK_BATCH_SIZE"]
+        self.claim_limit = config["WEBHOOK_BATCH_SIZE"] * config["WEBHOOK_MAX_CONCURRENCY"] * 4
+        self.max_concurrency = config["WEBHOOK_MAX_CONCURRENCY"]
+        self.max_attempts = config["WEBHOOK_MAX_ATTEMPTS"]
+        self.backoff_base = config["WEBHOOK_BACKOFF_BASE"]
+        self.backoff_max = config["WEBHOOK_BACKOFF_MAX"]
+        self.timeout = config["WEBHOOK_TIMEOUT"]
+        self.lease_seconds = config["WEBHOOK_TIMEOUT"] * 3 + 30
+        self.poll_interval = config["WEBHOOK_POLL_INTERVAL"]
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="webhook")
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    delivered = self.run_once()
+            except Exception:  # keep the dispatcher alive across transient DB errors
+                logger.exception("Webhook dispatch round failed")
+                delivered = 0
+            if not delivered:
+                self._stop.wait(self.poll_interval)
+
+    def claim(self):
+        """Lease due rows to this round so concurrent dispatchers never send the same row.
+
+        Rows of paused subscriptions are left alone: they keep their attempts and go out once it is enabled.
+        Returns the leased rows and ``{row id: next_attempt_at before the lease}``.
+        """
+        from app.models_webhooks import WebhookOutbox, WebhookSubscription
+
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        scheduled = dict(
+            db.session.execute(
+                select(WebhookOutbox.id, WebhookOutbox.next_attempt_at)
+                .join(WebhookSubscription, WebhookSubscription.id == WebhookOutbox.subscription_id)
+                .where(
+                    WebhookOutbox.status == "pending",
+                    WebhookOutbox.next_attempt_at <= now,
+                    WebhookSubscription.active.is_(True),
+                )
+                .order_by(WebhookOutbox.next_attempt_at, WebhookOutbox.id)
+                .limit(self.claim_limit)
+            ).all()
+        )
+        db.session.commit()
+        if not scheduled:
+            return [], {}
+        # A row another dispatcher leased in the meantime is no longer due and is skipped here.
+        db.session.execute(
+            update(WebhookOutbox)
+            .where(
+                WebhookOutbox.id.in_(list(scheduled)),
+                WebhookOutbox.status == "pending",
+                WebhookOutbox.next_attempt_at <= now,
+            )
+            .values(lease_token=token, next_attempt_at=now + timedelta(seconds=self.lease_seconds)),
+            execution_options={"synchronize_session": False},
+        )
+        db.session.commit()
+        return WebhookOutbox.query.filter_by(lease_token=token).order_by(WebhookOutbox.id).all(), scheduled
+
+    def run_once(self):
+        """Deliver one round of due notifications; returns how many rows were claimed."""
+        rows, scheduled = self.claim()
+        if not rows:
+            return 0
+        batches = []
+        by_subscription = {}
+        for row in rows:
+            by_subscription.setdefault(row.subscription_id, []).append(row)
+        for subscription_rows in by_subscription.values():
+            subscription = subscription_rows[0].subscription
+            for start in range(0, len(subscription_rows), self.batch_size):
+                batches.append((subscription, subscription_rows[start : start + self.batch_size]))
+
+        # Batches for the same endpoint go out one after another; endpoints run in parallel.
+        jobs = {}
+        for subscription, batch in batches:
+            jobs.setdefault(subscription.id, []).append(
+                (subscription.url, subscription.secret, batch, [json.loads(r.payload) for r in batch])
+            )
+        futures = [self._executor.submit(self._deliver_endpoint, endpoint_jobs) for endpoint_jobs in jobs.values()]
+
+        now = datetime.utcnow()
+        for future in futures:
+            results, skipped = future.result()
+            for batch in skipped:
+                for row in batch:
+                    row.lease_token = None
+                    row.next_attempt_at = scheduled[row.id]
+            for batch, error in results:
+                for row in batch:
+                    row.lease_token = None
+                    row.attempts += 1
+                    if error is None:
+                        row.status = "delivered"
+                        row.delivered_at = now
+                        row.last_error = None
+                    elif row.attempts >= self.max_attempts:
+                        row.status = "dead"
+                        row.last_error = error
+                    else:
+                        row.last_error = error
+                        row.next_attempt_at = now + timedelta(
+                            seconds=backoff_delay(row.attempts, self.backoff_base, self.backoff_max)
+                        )
+        db.session.commit()
+        return len(rows)
+
+    def _deliver_endpoint(self, endpoint_jobs):
+        """Post an endpoint's batches in order; returns ``([(batch, error), ...], [unsent batch, ...])``."""
+        results = []
+        for index, (url, secret, batch, payloads) in enumerate(endpoint_jobs):
+            error = post_batch(url, secret, payloads, self.timeout)
+            results.append((batch, error))
+            if error is not None:
+                # Endpoint is failing: don't hammer it with the rest of this round.
+                return results, [later[2] for later in endpoint_jobs[index + 1 :]]
+        return results, []
+
+
+def retry_dead(subscription_id=None):
+    """Move dead-lettered rows back to pending for another full round of attempts."""
+    from app.models_webhooks import WebhookOutbox
+
+    query = update(WebhookOutbox).where(WebhookOutbox.status == "dead")
+    if subscription_id:
+        query = query.where(WebhookOutbox.subscription_id == subscription_id)
+    result = db.session.execute(
+        query.values(status="pending", attempts=0, next_attempt_at=datetime.utcnow(), last_error=None),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+@click.command("webhooks-dispatch")
+@click.option("--once", is_flag=True, help="Deliver a single round and exit.")
+@with_appcontext
+def dispatch_command(once):
+    """Deliver pending webhook notifications from the outbox."""
+    dispatcher = WebhookDispatcher(current_app._get_current_object())
+    if once:
+        print(f"Attempted {dispatcher.run_once()} notifications.")
+        return
+    print("Dispatching webhooks; press Ctrl+C to stop.")
+    try:
+        dispatcher.run_forever()
+    except KeyboardInterrupt:
+        dispatcher.stop()
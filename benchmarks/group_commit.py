@@ -0,0 +1,171 @@
+"""
+Group-commit benchmark: courier tracking events committed per second with
+per-request commits versus the group-commit writer (``app.event_writer``).
+
+Example:
+    python -m benchmarks.group_commit --submitters 1,10,100 --runs 3 --seconds 3
+    python -m benchmarks.group_commit --dir /var/tmp   # put the scratch database on a real disk
+
+A scratch database gets 20 couriers with 50 shipments each. Each submitter is
+a thread standing in for a server thread: it records events for its courier's
+shipments back to back, each in its own app context like a request, through
+``record_event`` (the code path of ``courier.track_shipment``). ``direct``
+commits every event in the request's session; ``group`` hands it to the writer
+and waits for the batch commit. Every thread has its own pooled connection.
+Commit cost is dominated by fsync, so use ``--dir`` to measure on the disk the
+database will live on (a tmpfs makes commits nearly free).
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COURIERS = 20
+SHIPMENTS_PER_COURIER = 50
+MODES = ("direct", "group")
+
+
+def _app(workdir, mode, pool_size, window_ms=None):
+    from app import create_app
+    from config import Config
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        SQLALCHEMY_ENGINE_OPTIONS = {"pool_size": pool_size, "max_overflow": 0}
+        ARCHIVE_DB_PATH = os.path.join(workdir, "bench_archive.db")
+        EVENT_GROUP_COMMIT = mode == "group"
+        EVENT_GROUP_COMMIT_WINDOW_MS = Config.EVENT_GROUP_COMMIT_WINDOW_MS if window_ms is None else window_ms
+
+    return create_app(BenchConfig)
+
+
+def _seed(app):
+    from app import db
+    from app.models import Courier, Customer, Shipment
+
+    with app.app_context():
+        db.create_all()
+        customer = Customer(first_name="Jane", last_name="Doe", email="jane@example.com", phone="555-0100", address="1 Main St", city="Springfield")
+        couriers = [
+            Courier(first_name=f"Courier{i}", last_name="Driver", email=f"courier{i}@example.com", phone="555-0101", region="Springfield", hire_date=date(2020, 1, 1), password_hash="x")
+            for i in range(COURIERS)
+        ]
+        db.session.add_all([customer, *couriers])
+        db.session.flush()
+        shipments = {}
+        for courier in couriers:
+            for i in range(SHIPMENTS_PER_COURIER):
+                shipment = Shipment(
+                    customer_id=customer.id,
+                    sender_address="12 Warehouse Road",
+                    receiver_address=f"{i} Elm Street",
+                    city="Springfield",
+                    requested_date=datetime.utcnow(),
+                    tracking_number=f"TRK-GC{courier.id:03d}{i:04d}",
+                    assigned_courier_id=courier.id,
+                )
+                db.session.add(shipment)
+                shipments.setdefault(courier.id, []).append(shipment)
+        db.session.commit()
+        return {courier_id: [shipment.id for shipment in rows] for courier_id, rows in shipments.items()}
+
+
+def _submitter(app, courier_id, shipment_ids, start, stop_at, results):
+    from app.event_writer import record_event
+
+    rng = random.Random(courier_id)
+    latencies, errors = [], 0
+    start.wait()
+    while time.perf_counter() < stop_at[0]:
+        started = time.perf_counter()
+        try:
+            with app.app_context():
+                record_event(
+                    shipment_id=rng.choice(shipment_ids),
+                    courier_id=courier_id,
+                    status="Out for delivery",
+                    location_description="Springfield depot",
+                    created_at=datetime.utcnow(),
+                )
+        except Exception:  # "database is locked" and friends count as failed submissions
+            errors += 1
+        else:
+            latencies.append(time.perf_counter() - started)
+    results.append((latencies, errors))
+
+
+def run_once(app, shipments, submitters, seconds):
+    couriers = list(shipments)
+    start = threading.Barrier(submitters + 1)
+    stop_at = [0.0]
+    results = []
+    threads = [
+        threading.Thread(target=_submitter, args=(app, couriers[i % len(couriers)], shipments[couriers[i % len(couriers)]], start, stop_at, results))
+        for i in range(submitters)
+    ]
+    for thread in threads:
+        thread.start()
+    writer = app.extensions.get("event_writer")
+    batches_before, events_before = (writer.batches, writer.events) if writer else (0, 0)
+    stop_at[0] = time.perf_counter() + seconds
+    started = time.perf_counter()
+    start.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for thread_latencies, _ in results for latency in thread_latencies)
+    batches = writer.batches - batches_before if writer else len(latencies)
+    return {
+        "events_per_second": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        "errors": sum(errors for _, errors in results),
+        "batch": (writer.events - events_before) / max(batches, 1) if writer else 1.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-request commits and group commit for courier events.")
+    parser.add_argument("--submitters", default="1,10,100", help="Comma-separated numbers of concurrent submitters.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=3.0, help="Length of each run.")
+    parser.add_argument("--window-ms", type=float, default=None, help="Override EVENT_GROUP_COMMIT_WINDOW_MS.")
+    parser.add_argument("--dir", default=None, help="Directory for the scratch database (default: the system temp dir).")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.submitters.split(",")]
+
+    sys.path.insert(0, ROOT)
+    workdir = tempfile.mkdtemp(prefix="shiptrack-group-commit-", dir=args.dir)
+    pool_size = max(levels) + 5
+    try:
+        shipments = _seed(_app(workdir, "direct", pool_size))
+        apps = {mode: _app(workdir, mode, pool_size, args.window_ms) for mode in MODES}
+        print(f"{args.runs} runs of {args.seconds:g}s per level (median events/s; latency and batch size of the median run)")
+        print(f"  {'submitters':>10} {'mode':<7} {'events/s':>9} {'min':>8} {'p50 ms':>8} {'p99 ms':>8} {'batch':>6} {'errors':>7}")
+        for submitters in levels:
+            medians = {}
+            for mode, app in apps.items():
+                runs = sorted(
+                    (run_once(app, shipments, submitters, args.seconds) for _ in range(args.runs)),
+                    key=lambda run: run["events_per_second"],
+                )
+                median = runs[len(runs) // 2]
+                medians[mode] = statistics.median(run["events_per_second"] for run in runs)
+                print(
+                    f"  {submitters:>10} {mode:<7} {medians[mode]:9.0f} {runs[0]['events_per_second']:8.0f}"
+                    f" {median['p50_ms']:8.2f} {median['p99_ms']:8.2f} {median['batch']:6.1f} {sum(run['errors'] for run in runs):7}"
+                )
+            print(f"  {'':>10} group commit: {medians['group'] / max(medians['direct'], 1e-9):.2f}x the throughput")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+PDF benchmark: shipment snapshots rendered per second on one core.
+
+Example:
+    python -m benchmarks.pdf --runs 5 --seconds 2
+    python -m benchmarks.pdf --events 10,200,1000 --min-docs 50   # exit 1 below 50 docs/s
+
+A scratch database gets one shipment per ``--events`` size, with a note on every
+third event and a proof link on every fifth. Each shipment and its timeline are
+loaded once, so the runs measure ``build_shipment_pdf`` itself: each run
+renders the document repeatedly for ``--seconds`` in this single process.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _seed(app, sizes):
+    from app import db
+    from app.models import Courier, Customer, Shipment, TrackingEvent
+
+    with app.app_context():
+        db.create_all()
+        customer = Customer(first_name="Jane", last_name="Doe", email="jane@example.com", phone="555-0100", address="1 Main St", city="Springfield")
+        courier = Courier(first_name="Bob", last_name="Driver", email="bob@example.com", phone="555-0101", region="Springfield", hire_date=date(2020, 1, 1), password_hash="x")
+        db.session.add_all([customer, courier])
+        db.session.flush()
+        started = datetime(2025, 1, 1, 8, 0)
+        ids = {}
+        for size in sizes:
+            shipment = Shipment(
+                customer_id=customer.id,
+                sender_address="12 Warehouse Road, Springfield",
+                receiver_address="48 Elm Street, Apt 3, Springfield",
+                city="Springfield",
+                requested_date=started,
+                tracking_number=f"TRK-BENCH{size:06d}",
+                assigned_courier_id=courier.id,
+            )
+            db.session.add(shipment)
+            db.session.flush()
+            for i in range(size):
+                db.session.add(
+                    TrackingEvent(
+                        shipment_id=shipment.id,
+                        courier_id=courier.id,
+                        status="In transit",
+                        location_description=f"Sorting hub {i % 12}, Springfield",
+                        notes="Handed over at the loading dock." if i % 3 == 0 else None,
+                        proof_url=f"https://example.com/proof/{shipment.id}/{i}.jpg" if i % 5 == 0 else None,
+                        created_at=started + timedelta(minutes=15 * i),
+                    )
+                )
+            ids[size] = shipment.id
+        db.session.commit()
+    return ids
+
+
+def docs_per_second(build, shipment, seconds):
+    count = 0
+    started = time.perf_counter()
+    while True:
+        build(shipment)
+        count += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure PDF snapshot rendering throughput.")
+    parser.add_argument("--events", default="10,200", help="Comma-separated timeline sizes.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seconds", type=float, default=2.0, help="Length of each run.")
+    parser.add_argument("--min-docs", type=float, default=None, help="Fail if any size renders fewer docs/s (median).")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.events.split(",")]
+
+    sys.path.insert(0, ROOT)
+    from app import create_app, db
+    from app.models import Shipment
+    from config import Config
+
+    workdir = tempfile.mkdtemp(prefix="shiptrack-pdf-")
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        ARCHIVE_DB_PATH = os.path.join(workdir, "bench_archive.db")
+
+    try:
+        app = create_app(BenchConfig)
+        ids = _seed(app, sizes)
+        from app.print_utils import build_shipment_pdf
+
+        print(f"{args.runs} runs of {args.seconds:g}s per size, one core (median / min docs/s)")
+        failures = []
+        with app.app_context():
+            for size in sizes:
+                shipment = db.session.get(Shipment, ids[size])
+                shipment.timeline(), shipment.customer, shipment.courier  # load once, outside the timing
+                pdf_bytes = len(build_shipment_pdf(shipment))
+                rates = [docs_per_second(build_shipment_pdf, shipment, args.seconds) for _ in range(args.runs)]
+                median = statistics.median(rates)
+                print(f"  {size:>5} events  {median:8.1f} {min(rates):8.1f}   {1000 / median:7.2f} ms/doc  {pdf_bytes} bytes")
+                if args.min_docs is not None and median < args.min_docs:
+                    failures.append(f"{size} events: {median:.1f} docs/s is below {args.min_docs:g}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Read-model benchmark: memory and time to load the admin shipment list as ORM
+objects versus ``ShipmentRow`` projections.
+
+Example:
+    python -m benchmarks.read_models --rows 100000 --runs 3
+
+A scratch database is seeded once with ``--rows`` shipments spread over 2,000
+customers and 50 couriers (a quarter unassigned). Every measurement runs in a
+fresh interpreter. ``orm`` loads the list the way the views did before read
+models: ``Shipment`` objects joined to their customer, touching the customer,
+courier and status of each row. ``rows`` calls ``app.read_models.shipment_rows``.
+Memory is what tracemalloc still holds once the list is built (and the peak
+while building it), scaled to 100k rows; time is measured in a separate run
+without tracemalloc, which slows allocation-heavy code considerably.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CUSTOMERS = 2000
+COURIERS = 50
+STATUSES = ("Created", "Assigned", "Picked up", "In transit", "Out for delivery", "Delivered")
+MODES = ("orm", "rows")
+
+
+def _app(workdir):
+    from app import create_app
+    from config import Config
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        ARCHIVE_DB_PATH = os.path.join(workdir, "bench_archive.db")
+        COMPRESS_ENABLED = False
+
+    return create_app(BenchConfig)
+
+
+def _seed(workdir, rows):
+    from sqlalchemy import insert
+
+    from app import db
+    from app.models import Courier, Customer, Shipment
+
+    app = _app(workdir)
+    now = datetime.utcnow()
+    with app.app_context():
+        db.create_all()
+        db.session.execute(
+            insert(Customer),
+            [
+                {
+                    "first_name": f"First{i}",
+                    "last_name": f"Last{i}",
+                    "email": f"customer{i}@example.com",
+                    "phone": "555-0100",
+                    "address": f"{i} Main St",
+                    "city": "Springfield",
+                }
+                for i in range(1, CUSTOMERS + 1)
+            ],
+        )
+        db.session.execute(
+            insert(Courier),
+            [
+                {
+                    "first_name": f"Courier{i}",
+                    "last_name": "Driver",
+                    "email": f"courier{i}@example.com",
+                    "phone": "555-0101",
+                    "region": "Springfield",
+                    "hire_date": date(2020, 1, 1),
+                    "password_hash": "x",
+                }
+                for i in range(1, COURIERS + 1)
+            ],
+        )
+        db.session.execute(
+            insert(Shipment),
+            [
+                {
+                    "customer_id": i % CUSTOMERS + 1,
+                    "sender_address": f"{i} Sender Rd",
+                    "receiver_address": f"{i} Receiver Ave",
+                    "city": "Springfield",
+                    "requested_date": now - timedelta(minutes=i),
+                    "tracking_number": f"TRK-{i:09d}",
+                    "assigned_courier_id": None if i % 4 == 0 else i % COURIERS + 1,
+                    "status": STATUSES[i % len(STATUSES)],
+                    "created_at": now - timedelta(minutes=i),
+                    "updated_at": now - timedelta(minutes=i),
+                }
+                for i in range(rows)
+            ],
+        )
+        db.session.commit()
+
+
+def _load_orm():
+    from app.models import Customer, Shipment
+
+    shipments = Shipment.query.join(Customer).order_by(Shipment.created_at.desc()).all()
+    for shipment in shipments:
+        # What the list template and CSV export read from every row.
+        shipment.customer.first_name, shipment.customer.last_name, shipment.latest_status()
+        if shipment.courier:
+            shipment.courier.first_name, shipment.courier.last_name
+    return shipments
+
+
+def _load_rows():
+    from app.read_models import shipment_rows
+
+    return shipment_rows()
+
+
+def _child(workdir, mode, trace):
+    app = _app(workdir)
+    load = _load_orm if mode == "orm" else _load_rows
+    with app.test_request_context():
+        if trace:
+            tracemalloc.start()
+        started = time.perf_counter()
+        loaded = load()
+        elapsed = time.perf_counter() - started
+        result = {"rows": len(loaded), "elapsed_ms": elapsed * 1000}
+        if trace:
+            result["retained_bytes"], result["peak_bytes"] = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    print(json.dumps(result))
+
+
+def run_child(*args):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.read_models", *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(workdir, mode, runs):
+    memory = [run_child("--child", workdir, mode, "--trace") for _ in range(runs)]
+    timing = [run_child("--child", workdir, mode) for _ in range(runs)]
+    rows = memory[0]["rows"]
+    per_100k = 100_000 / max(rows, 1)
+    return {
+        "retained_mb": statistics.median(run["retained_bytes"] for run in memory) * per_100k / 2**20,
+        "peak_mb": statistics.median(run["peak_bytes"] for run in memory) * per_100k / 2**20,
+        "bytes_per_row": statistics.median(run["retained_bytes"] for run in memory) / max(rows, 1),
+        "elapsed_ms": statistics.median(run["elapsed_ms"] for run in timing) * per_100k,
+        "min_elapsed_ms": min(run["elapsed_ms"] for run in timing) * per_100k,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ORM objects and read-model rows for the shipment list.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--child", nargs=2, metavar=("WORKDIR", "MODE"), help=argparse.SUPPRESS)
+    parser.add_argument("--trace", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--seed", metavar="WORKDIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        _seed(args.seed, args.rows)
+        return
+    if args.child:
+        _child(*args.child, trace=args.trace)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="shiptrack-read-models-")
+    try:
+        subprocess.run([sys.executable, "-m", "benchmarks.read_models", "--seed", workdir, "--rows", str(args.rows)], cwd=ROOT, check=True)
+        results = {mode: measure(workdir, mode, args.runs) for mode in MODES}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{args.rows} shipments, {args.runs} runs each; figures per 100k rows (median, min ms)")
+    print(f"  {'mode':<6} {'retained MB':>12} {'peak MB':>9} {'bytes/row':>10} {'load ms':>9} {'min ms':>8}")
+    for mode, result in results.items():
+        print(
+            f"  {mode:<6} {result['retained_mb']:12.1f} {result['peak_mb']:9.1f} {result['bytes_per_row']:10.0f}"
+            f" {result['elapsed_ms']:9.1f} {result['min_elapsed_ms']:8.1f}"
+        )
+    orm, rows = results["orm"], results["rows"]
+    print(f"  rows keep {orm['retained_mb'] / max(rows['retained_mb'], 1e-9):.1f}x less memory and load {orm['elapsed_ms'] / max(rows['elapsed_ms'], 1e-9):.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
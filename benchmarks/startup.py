@@ -0,0 +1,143 @@
+"""
+Startup benchmark: import time, app construction and time-to-first-request of a
+fresh worker process, in lazy (default) and preload modes.
+
+Example:
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --runs 5 --max-boot-ms 800   # exit 1 on regression
+
+Each run is a new interpreter, like a freshly spawned worker. The first request
+goes to /track against a scratch database, with an empty compiled-template
+cache in the run's scratch directory (never the repo's ``instance`` folder). In lazy mode the run also fails if
+fpdf, bcrypt or numpy were imported before any request needed them.
+
+Lazy mode is also measured warm: one unmeasured run fills a compiled-template
+cache shared by the runs that follow, like workers of an already deployed
+release. Cold and warm numbers are reported separately; ``--max-boot-ms`` checks
+the cold median.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("fpdf", "bcrypt", "numpy", "app.print_utils")
+
+
+def _child(workdir, cache_dir=None):
+    started = time.perf_counter()
+    from app import create_app, db
+    from config import Config
+
+    imported = time.perf_counter()
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        ARCHIVE_DB_PATH = os.path.join(workdir, "bench_archive.db")
+        # A fresh compiled-template cache per run (a cold start) unless a shared one is given.
+        JINJA_BYTECODE_CACHE_DIR = cache_dir or os.path.join(workdir, "jinja_cache")
+
+    app = create_app(BenchConfig)
+    created = time.perf_counter()
+    eager = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    before_first = time.perf_counter()
+    status = client.get("/track?tracking_number=TRK-BENCH000").status_code
+    first = time.perf_counter()
+    client.get("/track?tracking_number=TRK-BENCH000")
+    second = time.perf_counter()
+
+    print(
+        json.dumps(
+            {
+                "import_ms": (imported - started) * 1000,
+                "create_app_ms": (created - imported) * 1000,
+                "first_request_ms": (first - before_first) * 1000,
+                "second_request_ms": (second - first) * 1000,
+                "boot_ms": (created - started + first - before_first) * 1000,
+                "status": status,
+                "eager_modules": eager,
+            }
+        )
+    )
+
+
+def run_once(preload, cache_dir=None):
+    workdir = tempfile.mkdtemp(prefix="shiptrack-startup-")
+    env = dict(os.environ, SHIPTRACK_PRELOAD="1" if preload else "0")
+    command = [sys.executable, "-m", "benchmarks.startup", "--child", workdir]
+    if cache_dir:
+        command += ["--cache-dir", cache_dir]
+    try:
+        started = time.perf_counter()
+        output = subprocess.run(
+            command,
+            cwd=ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["process_ms"] = (time.perf_counter() - started) * 1000
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def summarize(label, runs):
+    print(f"\n{label} ({len(runs)} runs, median / min ms)")
+    for key in ("import_ms", "create_app_ms", "first_request_ms", "second_request_ms", "boot_ms", "process_ms"):
+        values = [run[key] for run in runs]
+        print(f"  {key:<18} {statistics.median(values):8.1f} {min(values):8.1f}")
+    eager = sorted({name for run in runs for name in run["eager_modules"]})
+    print(f"  loaded at boot     {', '.join(eager) or 'none of ' + ', '.join(HEAVY_MODULES)}")
+    return statistics.median(run["boot_ms"] for run in runs), eager
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure worker cold-start time.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-boot-ms", type=float, default=None, help="Fail if the lazy-mode median boot exceeds this.")
+    parser.add_argument("--skip-preload", action="store_true", help="Only measure the default lazy mode.")
+    parser.add_argument("--skip-warm", action="store_true", help="Skip the lazy-mode runs with a warm template cache.")
+    parser.add_argument("--child", metavar="WORKDIR", help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.cache_dir)
+        return
+
+    lazy_boot, eager = summarize("lazy, cold template cache", [run_once(preload=False) for _ in range(args.runs)])
+    if not args.skip_warm:
+        cache_dir = tempfile.mkdtemp(prefix="shiptrack-startup-cache-")
+        try:
+            run_once(preload=False, cache_dir=cache_dir)  # fills the shared cache; not measured
+            summarize("lazy, warm template cache", [run_once(preload=False, cache_dir=cache_dir) for _ in range(args.runs)])
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    if not args.skip_preload:
+        summarize("preload", [run_once(preload=True) for _ in range(args.runs)])
+
+    failures = []
+    if eager:
+        failures.append(f"heavy modules imported at boot: {', '.join(eager)}")
+    if args.max_boot_ms is not None and lazy_boot > args.max_boot_ms:
+        failures.append(f"median boot {lazy_boot:.1f}ms exceeds {args.max_boot_ms:.1f}ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
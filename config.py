@@ -1,6 +1,14 @@
 import os
 
 
+def _hours_by_status(value, default):
+    """``"Out for delivery=12,Picked up=48"`` as {status: hours}, or ``default`` when unset."""
+    if not value:
+        return default
+    pairs = (item.split("=", 1) for item in value.split(",") if item.strip())
+    return {status.strip(): float(hours) for status, hours in pairs}
+
+
 class Config:
     """Base configuration for the shipment tracking app."""
 
@@ -10,8 +18,158 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.environ.get("SECRET_KEY", "change-me-in-production")
 
+    # Cold storage for tracking history of long-finished shipments (set to None to disable).
+    ARCHIVE_DB_PATH = os.path.join(BASE_DIR, "instance", "shipment_tracking_archive.db")
+    ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 365))
+    ARCHIVE_BATCH_SIZE = 500
+
+    # Import fpdf/bcrypt/numpy and compile templates at startup instead of on first use
+    # (for servers that preload the app before forking workers).
+    PRELOAD_HEAVY_MODULES = os.environ.get("SHIPTRACK_PRELOAD") == "1"
+
+    # Health probes: /health/live fails only on a stalled database, /health/ready
+    # also when queries are slow or the worker is shutting down.
+    HEALTH_LIVE_MAX_DB_MS = 5000
+    HEALTH_READY_MAX_DB_MS = 250
+
+    # Rendered timeline fragments kept per worker (0 disables) and the compiled-template
+    # cache directory inside the instance folder (None disables).
+    FRAGMENT_CACHE_SIZE = 2048
+    JINJA_BYTECODE_CACHE_DIR = "jinja_cache"
+
+    # Shipment pages show the newest events; older ones load in pages of up to TIMELINE_PAGE_MAX.
+    TIMELINE_WINDOW = 20
+    TIMELINE_PAGE_MAX = 100
+
+    # Region-sharded storage: comma-separated Courier.region values, one SQLite file per
+    # region under SHARD_DIR (empty keeps everything in DB_PATH). SQLite attaches at most
+    # 10 databases per connection, the archive included.
+    SHARD_REGIONS = [r.strip() for r in os.environ.get("SHIPTRACK_SHARD_REGIONS", "").split(",") if r.strip()]
+    SHARD_DIR = os.path.join(BASE_DIR, "instance", "shards")
+
+    # Server-Sent Events for live tracking (per worker process limits).
+    LIVE_UPDATES_ENABLED = True
+    LIVE_HEARTBEAT_SECONDS = 15
+    LIVE_POLL_INTERVAL = 1.0
+    LIVE_MAX_STREAM_SECONDS = 300
+    LIVE_MAX_CONNECTIONS = 200
+    LIVE_MAX_CONNECTIONS_PER_CLIENT = 4
+    # Streams and change-feed long-polls each hold a server thread. With the thread count
+    # known (gunicorn.conf.py exports SHIPTRACK_THREADS), they may use all but
+    # LIVE_RESERVED_THREADS of them, so health probes and page requests always get one.
+    SERVER_THREADS = int(os.environ.get("SHIPTRACK_THREADS", 0))
+    LIVE_RESERVED_THREADS = 2
+
+    # Status-change webhooks. Run `flask webhooks-dispatch` as a separate process, or enable
+    # the in-process dispatcher, which one server process at a time runs (app/scheduler.py).
+    WEBHOOK_DISPATCHER_ENABLED = os.environ.get("WEBHOOK_DISPATCHER_ENABLED") == "1"
+    WEBHOOK_BATCH_SIZE = 50
+    WEBHOOK_MAX_CONCURRENCY = 4
+    WEBHOOK_MAX_ATTEMPTS = 8
+    WEBHOOK_BACKOFF_BASE = 30
+    WEBHOOK_BACKOFF_MAX = 3600
+    WEBHOOK_TIMEOUT = 10
+    WEBHOOK_POLL_INTERVAL = 2
+
+    # Public tracking: Bloom filter of known tracking numbers (answers misses without a query)
+    # and per-IP token buckets (requests per second, burst) per worker process; rate 0 disables.
+    BLOOM_FILTER_ENABLED = True
+    BLOOM_CAPACITY = 1_000_000
+    BLOOM_ERROR_RATE = 0.01
+    BLOOM_REFRESH_SECONDS = 2
+    PUBLIC_RATE_LIMIT_RATE = float(os.environ.get("SHIPTRACK_PUBLIC_RATE", 5))
+    PUBLIC_RATE_LIMIT_BURST = int(os.environ.get("SHIPTRACK_PUBLIC_BURST", 60))
+    PUBLIC_RATE_LIMIT_MAX_CLIENTS = 10000
+    # Reverse proxies in front of the app that append X-Forwarded-For/-Proto (0 trusts none).
+    # Rate limits and live-connection caps key on the client address these resolve to.
+    TRUSTED_PROXY_HOPS = int(os.environ.get("SHIPTRACK_TRUSTED_PROXY_HOPS", 0))
+
+    # Results per page of the customer/courier typeahead endpoints.
+    PICKER_PAGE_SIZE = 20
+
+    # Enforce foreign keys (ON DELETE CASCADE/SET NULL) on every connection; ignored when sharded.
+    # Customers with more than PURGE_SYNC_LIMIT shipments are deleted by a background job.
+    SQLITE_FOREIGN_KEYS = True
+    PURGE_SYNC_LIMIT = 2000
+    PURGE_BATCH_SIZE = 500
+    # A background purge with no progress for this long lost its process; deleting again resumes it.
+    PURGE_STALE_SECONDS = 300
+
+    # Automatic courier assignment (`flask auto-assign`). A non-zero interval also runs it
+    # every N seconds in one of the server processes.
+    AUTO_ASSIGN_INTERVAL = int(os.environ.get("SHIPTRACK_AUTO_ASSIGN_INTERVAL", 0))
+    AUTO_ASSIGN_BATCH_SIZE = 200
+
+    # Group commit of courier tracking events: one writer thread per process commits the events that
+    # arrive within the window in one transaction. Helps threaded servers under bursts of submissions.
+    EVENT_GROUP_COMMIT = os.environ.get("SHIPTRACK_GROUP_COMMIT") == "1"
+    EVENT_GROUP_COMMIT_WINDOW_MS = 2
+    EVENT_GROUP_COMMIT_MAX_BATCH = 200
+    EVENT_GROUP_COMMIT_TIMEOUT = 10
+
+    # Change feed of tracking events (`GET /feed/events`, `flask changefeed`). Consumers
+    # authenticate with this bearer token; long-polls wait at most CHANGE_FEED_MAX_WAIT seconds.
+    CHANGE_FEED_TOKEN = os.environ.get("SHIPTRACK_CHANGE_FEED_TOKEN", "")
+    CHANGE_FEED_PAGE_SIZE = 500
+    CHANGE_FEED_PAGE_MAX = 5000
+    CHANGE_FEED_MAX_WAIT = 30
+
+    # Delivery-time analytics (Admin -> Reports -> Delivery times): per-range cache lifetime and entries,
+    # default and longest date range in days.
+    ANALYTICS_CACHE_SECONDS = 300
+    ANALYTICS_CACHE_SIZE = 64
+    ANALYTICS_DEFAULT_DAYS = 30
+    ANALYTICS_MAX_DAYS = 366
+
+    # Stuck-shipment alerts (Admin -> Shipments -> Stuck, `flask stuck-scan`): hours a shipment may stay in
+    # a status without a new tracking event. A non-zero interval also scans in-process every N seconds
+    # (in one of the server processes), opening a support ticket per stuck shipment when STUCK_AUTO_TICKETS is set.
+    STUCK_THRESHOLDS = _hours_by_status(
+        os.environ.get("SHIPTRACK_STUCK_THRESHOLDS"),
+        {"Created": 48, "Assigned": 24, "Picked up": 24, "Out for delivery": 12, "Attempted/Rescheduled": 24},
+    )
+    STUCK_SCAN_INTERVAL = int(os.environ.get("SHIPTRACK_STUCK_SCAN_INTERVAL", 0))
+    STUCK_AUTO_TICKETS = os.environ.get("SHIPTRACK_STUCK_AUTO_TICKETS") == "1"
+    STUCK_TICKET_EMAIL = os.environ.get("SHIPTRACK_STUCK_TICKET_EMAIL", "ops@example.com")
+
+    # gzip/brotli response compression (brotli needs the optional `brotli` package).
+    COMPRESS_ENABLED = os.environ.get("SHIPTRACK_COMPRESS", "1") == "1"
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+    COMPRESS_MIMETYPES = (
+        "text/html",
+        "text/plain",
+        "text/css",
+        "text/csv",
+        "application/javascript",
+        "application/json",
+        "application/x-ndjson",
+    )
+
+    # Courier delta sync (`/courier/api/sync`). Shipments per page, latest events sent for newly
+    # assigned shipments, re-read window for late commits, and how long old cursors stay valid.
+    SYNC_PAGE_SIZE = 50
+    SYNC_PAGE_MAX = 200
+    SYNC_EVENTS_PER_SHIPMENT = 10
+    SYNC_OVERLAP_SECONDS = 10
+    SYNC_LOG_RETENTION_DAYS = 30
+
+    # Online backups (`flask backup-db`, Admin -> Backups). Pages copied per step and the pause
+    # between steps. A copy restarted more than BACKUP_MAX_RESTARTS times by writers starts over
+    # after BACKUP_RETRY_BACKOFF seconds (doubling) with twice the pages per step; after
+    # BACKUP_MAX_ATTEMPTS tries the backup fails rather than block writers.
+    BACKUP_DIR = os.environ.get("SHIPTRACK_BACKUP_DIR", os.path.join(BASE_DIR, "instance", "backups"))
+    BACKUP_PAGES_PER_STEP = 1024
+    BACKUP_STEP_SLEEP = 0.02
+    BACKUP_MAX_RESTARTS = 3
+    BACKUP_MAX_ATTEMPTS = 5
+    BACKUP_RETRY_BACKOFF = 1.0
+    BACKUP_KEEP = 7
+
 
 class TestConfig(Config):
     """Configuration for tests (uses in-memory SQLite)."""
 
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    ARCHIVE_DB_PATH = ":memory:"
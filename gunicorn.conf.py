@@ -0,0 +1,72 @@
+"""
+Production server settings: ``gunicorn -c gunicorn.conf.py wsgi:app``.
+
+Every value can be overridden with the environment variable named next to it
+(or with gunicorn's own command-line flags).
+"""
+import os
+import signal
+
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))  # respects container CPU pinning
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+_cpus = _cpu_count()
+
+bind = os.environ.get("SHIPTRACK_BIND", "0.0.0.0:8000")
+
+# Processes for CPU work (templates, PDFs). Capped because SQLite serializes writers
+# and every worker keeps its own connection pool, live-update hub and caches.
+workers = int(os.environ.get("WEB_CONCURRENCY", min(2 * _cpus + 1, 12)))
+# Threads cover I/O waits and the open live-tracking streams, each of which holds one.
+worker_class = "gthread"
+threads = int(os.environ.get("SHIPTRACK_THREADS", min(max(2 * _cpus, 4), 16)))
+# The app caps streams below this so they can't occupy every thread (LIVE_RESERVED_THREADS).
+os.environ["SHIPTRACK_THREADS"] = str(threads)
+
+# Load the app once in the master and fork workers from it (see app/preload.py).
+# create_app starts no threads: the in-process schedules (webhook dispatcher, auto-assign,
+# stuck scan) start with a worker's first request, and a lock file in the instance folder
+# lets one worker at a time run each of them (app/scheduler.py).
+preload_app = True
+os.environ.setdefault("SHIPTRACK_PRELOAD", "1")
+
+# Recycle workers to bound memory growth; jitter keeps them from restarting together.
+max_requests = int(os.environ.get("SHIPTRACK_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.environ.get("SHIPTRACK_MAX_REQUESTS_JITTER", 200))
+
+# A stopping worker gets this long to finish in-flight requests.
+graceful_timeout = int(os.environ.get("SHIPTRACK_GRACEFUL_TIMEOUT", 30))
+timeout = int(os.environ.get("SHIPTRACK_TIMEOUT", 60))
+keepalive = 5
+
+accesslog = os.environ.get("SHIPTRACK_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # Workers must not reuse connections opened in the master before the fork.
+    from app import db
+
+    with worker.app.wsgi().app_context():
+        db.engine.dispose()
+
+
+def post_worker_init(worker):
+    # On SIGTERM, fail readiness and end live streams before the usual graceful stop,
+    # so load balancers route away and long-lived streams don't hold the worker open.
+    from app.routes.health import start_draining
+
+    app = worker.wsgi
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        start_draining(app)
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
@@ -0,0 +1,308 @@
+"""
+Local load-test driver: replays a realistic traffic mix against a running app
+and reports throughput, error rate and latency percentiles per endpoint.
+
+Example:
+    python load_test.py --base-url http://127.0.0.1:5000 --clients 20 --duration 60 \
+        --mix track=70,courier_event=10,admin_list=12,pdf=8
+
+Sample tracking numbers, courier accounts and shipment ids are read from the
+configured database, so run it from the same checkout as the server.
+
+Redirects are not followed. They count as successes, except redirects to a login
+page (the session was lost or never established), which count as errors. A
+login only counts when it lands on the role's dashboard; otherwise the run stops.
+"""
+import argparse
+import http.cookiejar
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from app import create_app
+from app.models import Courier, Shipment
+from app.sharding import each_shard, region_shard, use_shard
+
+DEFAULT_MIX = "track=70,courier_event=10,admin_list=12,pdf=8"
+ADMIN_LIST_PATHS = ["/admin/shipments", "/admin/customers", "/admin/couriers", "/admin/reports"]
+EVENT_STATUSES = ["Picked up", "Out for delivery", "Attempted/Rescheduled"]
+LOGINS = {"admin": ("/login/admin", "/admin/dashboard"), "courier": ("/login/courier", "/courier/dashboard")}
+
+
+class LoginError(RuntimeError):
+    pass
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects as-is so each request is timed on its own."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise SystemExit(f"Unknown action in mix: {name!r} (choose from {', '.join(ACTIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def load_fixtures(courier_password):
+    app = create_app()
+    with app.app_context():
+        tracking_numbers = []
+        admin_shipment_ids = []
+        for _ in each_shard():
+            tracking_numbers += [row[0] for row in Shipment.query.with_entities(Shipment.tracking_number).limit(5000)]
+            admin_shipment_ids += [row[0] for row in Shipment.query.with_entities(Shipment.id).limit(5000)]
+        couriers = []
+        for courier in Courier.query.all():
+            use_shard(region_shard(courier.region))
+            shipment_ids = [
+                row[0]
+                for row in Shipment.query.with_entities(Shipment.id)
+                .filter_by(assigned_courier_id=courier.id)
+                .limit(500)
+            ]
+            if shipment_ids:
+                couriers.append({"email": courier.email, "password": courier_password, "shipment_ids": shipment_ids})
+    if not tracking_numbers:
+        raise SystemExit("No shipments found; run seed_data.py first.")
+    return {"tracking_numbers": tracking_numbers, "couriers": couriers, "shipment_ids": admin_shipment_ids}
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, elapsed, ok):
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+class Client:
+    """One simulated user with its own cookie jar (and therefore login session)."""
+
+    def __init__(self, base_url, stats, fixtures, args, rng):
+        self.base_url = base_url.rstrip("/")
+        self.stats = stats
+        self.fixtures = fixtures
+        self.args = args
+        self.rng = rng
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+        self.role = None
+        self.courier = None
+
+    def request(self, endpoint, path, data=None, expect_redirect=None):
+        """Send one request and return ``(status, redirect path or None)``.
+
+        With ``expect_redirect``, only a redirect to that path counts as a success.
+        """
+        body = urllib.parse.urlencode(data).encode("utf-8") if data is not None else None
+        location = None
+        start = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + path, data=body, timeout=self.args.timeout) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as exc:
+            exc.read()
+            status = exc.code
+            if 300 <= status < 400:
+                location = urllib.parse.urlsplit(exc.headers.get("Location", "")).path
+        except (urllib.error.URLError, OSError):
+            status = 0
+        elapsed = time.perf_counter() - start
+        if expect_redirect:
+            ok = location == expect_redirect
+        else:
+            ok = 0 < status < 400 and not (location or "").startswith("/login")
+        self.stats.record(endpoint, elapsed, ok)
+        return status, location
+
+    def ensure_role(self, role):
+        if self.role == role:
+            return True
+        if role == "admin":
+            self.courier = None
+            credentials = {"email": self.args.admin_email, "password": self.args.admin_password}
+        else:
+            if not self.fixtures["couriers"]:
+                return False
+            self.courier = self.rng.choice(self.fixtures["couriers"])
+            credentials = {"email": self.courier["email"], "password": self.courier["password"]}
+        login_path, dashboard = LOGINS[role]
+        self.role = None
+        status, location = self.request(f"auth.{role}_login", login_path, credentials, expect_redirect=dashboard)
+        if location != dashboard:
+            raise LoginError(f"{role} login as {credentials['email']} failed (HTTP {status}, redirect to {location or 'nowhere'})")
+        self.role = role
+        return True
+
+    def track(self):
+        tracking_number = self.rng.choice(self.fixtures["tracking_numbers"])
+        if self.rng.random() < self.args.miss_ratio:
+            tracking_number = "TRK-" + "".join(self.rng.choices("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789", k=8))
+        self.request("public.track", "/track?" + urllib.parse.urlencode({"tracking_number": tracking_number}))
+
+    def courier_event(self):
+        if not self.ensure_role("courier"):
+            return self.track()
+        shipment_id = self.rng.choice(self.courier["shipment_ids"])
+        self.request(
+            "courier.track_shipment",
+            f"/courier/shipments/{shipment_id}/track",
+            {
+                "status": self.rng.choice(EVENT_STATUSES),
+                "location_description": "Load test depot",
+                "notes": "Synthetic load-test event",
+            },
+        )
+
+    def admin_list(self):
+        self.ensure_role("admin")
+        path = self.rng.choice(ADMIN_LIST_PATHS)
+        self.request("admin." + path.rsplit("/", 1)[-1], path)
+
+    def pdf(self):
+        if self.rng.random() < 0.5:
+            tracking_number = self.rng.choice(self.fixtures["tracking_numbers"])
+            self.request("public.print_shipment", "/track/print?" + urllib.parse.urlencode({"tracking_number": tracking_number}))
+            return
+        self.ensure_role("admin")
+        shipment_id = self.rng.choice(self.fixtures["shipment_ids"])
+        self.request("admin.print_shipment", f"/admin/shipments/{shipment_id}/print")
+
+
+ACTIONS = {
+    "track": Client.track,
+    "courier_event": Client.courier_event,
+    "admin_list": Client.admin_list,
+    "pdf": Client.pdf,
+}
+
+
+def run_client(client, mix, deadline, think_time):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.monotonic() < deadline:
+        action = client.rng.choices(names, weights)[0]
+        ACTIONS[action](client)
+        if think_time:
+            time.sleep(client.rng.uniform(0, think_time))
+
+
+def print_report(stats, wall_time):
+    header = f"{'endpoint':<28}{'reqs':>8}{'err%':>8}{'rps':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+    print(header)
+    print("-" * len(header))
+    total = errors = 0
+    all_latencies = []
+    for endpoint in sorted(stats.latencies):
+        values = sorted(stats.latencies[endpoint])
+        count = len(values)
+        total += count
+        errors += stats.errors[endpoint]
+        all_latencies.extend(values)
+        print(
+            f"{endpoint:<28}{count:>8}{100 * stats.errors[endpoint] / count:>7.1f}%{count / wall_time:>9.1f}"
+            f"{percentile(values, 50) * 1000:>9.1f}{percentile(values, 90) * 1000:>9.1f}"
+            f"{percentile(values, 99) * 1000:>9.1f}{values[-1] * 1000:>9.1f}"
+        )
+    if not total:
+        print("No requests completed.")
+        return
+    all_latencies.sort()
+    print("-" * len(header))
+    print(
+        f"{'TOTAL':<28}{total:>8}{100 * errors / total:>7.1f}%{total / wall_time:>9.1f}"
+        f"{percentile(all_latencies, 50) * 1000:>9.1f}{percentile(all_latencies, 90) * 1000:>9.1f}"
+        f"{percentile(all_latencies, 99) * 1000:>9.1f}{all_latencies[-1] * 1000:>9.1f}"
+    )
+
+
+def _run_all(clients, mix, duration, think_time):
+    start = time.monotonic()
+    deadline = start + duration
+    threads = [
+        threading.Thread(target=run_client, args=(client, mix, deadline, think_time), daemon=True) for client in clients
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a running ShipTrack instance with a realistic traffic mix.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--clients", type=int, default=10, help="Concurrent simulated users.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run after warm-up.")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds of unrecorded warm-up traffic.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted actions, e.g. track=70,pdf=5.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Max random pause between requests (s).")
+    parser.add_argument("--miss-ratio", type=float, default=0.05, help="Share of /track lookups for unknown numbers.")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--admin-email", default="admin@example.com")
+    parser.add_argument("--admin-password", default="admin123")
+    parser.add_argument("--courier-password", default="courier123")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    fixtures = load_fixtures(args.courier_password)
+    master_rng = random.Random(args.seed)
+
+    # Check the credentials once up front rather than in every client thread.
+    probe = Client(args.base_url, Stats(), fixtures, args, random.Random(args.seed))
+    roles = {"admin": {"admin_list", "pdf"}, "courier": {"courier_event"}}
+    try:
+        for role, actions in roles.items():
+            if actions & set(mix):
+                probe.ensure_role(role)
+    except LoginError as exc:
+        raise SystemExit(str(exc))
+
+    stats = Stats()
+    clients = [
+        Client(args.base_url, stats, fixtures, args, random.Random(master_rng.random())) for _ in range(args.clients)
+    ]
+
+    if args.warmup:
+        warm_stats = Stats()
+        for client in clients:
+            client.stats = warm_stats
+        _run_all(clients, mix, args.warmup, args.think_time)
+        for client in clients:
+            client.stats = stats
+
+    print(f"Running {args.clients} clients for {args.duration:.0f}s against {args.base_url} (mix: {args.mix})")
+    wall_time = _run_all(clients, mix, args.duration, args.think_time)
+    print_report(stats, wall_time)
+
+
+if __name__ == "__main__":
+    main()
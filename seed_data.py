@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from app import create_app, db
 from app.auth_utils import hash_password
 from app.models import Admin, Courier, Customer, Shipment, TrackingEvent
+from app.sharding import each_shard, shard_for_new_shipment, use_shard
 
 
 def generate_tracking_number():
@@ -71,9 +72,10 @@ def seed():
 
         db.session.commit()
 
-        if not Shipment.query.first():
+        if not any(Shipment.query.first() for _ in each_shard()):
             for idx, customer in enumerate(customers):
                 courier = couriers[idx % len(couriers)]
+                use_shard(shard_for_new_shipment(customer.city, courier))
                 shipment = Shipment(
                     customer_id=customer.id,
                     sender_address=customer.address,
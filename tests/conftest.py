@@ -0,0 +1,89 @@
+import json
+import threading
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app import create_app, db
+from config import TestConfig
+
+
+class WebhookTestConfig(TestConfig):
+    TESTING = True
+    JINJA_BYTECODE_CACHE_DIR = None
+    WEBHOOK_BATCH_SIZE = 2
+    WEBHOOK_MAX_CONCURRENCY = 2
+    WEBHOOK_MAX_ATTEMPTS = 3
+    WEBHOOK_BACKOFF_BASE = 30
+    WEBHOOK_BACKOFF_MAX = 3600
+    WEBHOOK_TIMEOUT = 5
+
+
+@pytest.fixture
+def app():
+    app = create_app(WebhookTestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+class Receiver:
+    """Stand-in partner endpoint: records every delivery and answers with the queued status codes (then 204)."""
+
+    def __init__(self):
+        self.deliveries = []
+        self.responses = []
+        self._lock = threading.Lock()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with receiver._lock:
+                    receiver.deliveries.append({"headers": self.headers, "body": body, "json": json.loads(body)})
+                    status = receiver.responses.pop(0) if receiver.responses else 204
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def events(self):
+        return [item for delivery in self.deliveries for item in delivery["json"]["events"]]
+
+
+@pytest.fixture
+def receiver():
+    receiver = Receiver()
+    receiver.thread.start()
+    yield receiver
+    receiver.server.shutdown()
+    receiver.server.server_close()
+
+
+@pytest.fixture
+def shipment(app):
+    from app.models import Courier, Customer, Shipment
+
+    customer = Customer(first_name="Jane", last_name="Doe", email="jane@example.com", phone="1", address="1 Main St", city="Springfield")
+    courier = Courier(first_name="Bob", last_name="Driver", email="bob@example.com", phone="1", region="Springfield", hire_date=date(2020, 1, 1), password_hash="x")
+    db.session.add_all([customer, courier])
+    db.session.flush()
+    shipment = Shipment(
+        customer_id=customer.id,
+        sender_address="a",
+        receiver_address="b",
+        city="Springfield",
+        requested_date=datetime.utcnow(),
+        tracking_number="TRK-TEST0001",
+        assigned_courier_id=courier.id,
+    )
+    db.session.add(shipment)
+    db.session.commit()
+    return shipment
@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from app import create_app, db
+from app.event_writer import EventWriterError, record_event
+from app.models import TrackingEvent
+from conftest import WebhookTestConfig
+
+
+@pytest.fixture
+def app(tmp_path):
+    class GroupCommitConfig(WebhookTestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'events.db'}"
+        SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"timeout": 0.2}}
+        EVENT_GROUP_COMMIT = True
+        EVENT_GROUP_COMMIT_WINDOW_MS = 50
+        EVENT_GROUP_COMMIT_TIMEOUT = 1
+
+    app = create_app(GroupCommitConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def writer(app):
+    writer = app.extensions["event_writer"]
+    commits = []
+    original = writer._commit
+
+    def counting_commit(batch):
+        commits.append(len(batch))
+        return original(batch)
+
+    writer._commit = counting_commit
+    writer.commits = commits
+    return writer
+
+
+def submit_all(app, shipment_ids):
+    """Record one event per shipment id from concurrent threads; returns {shipment_id: id or exception}."""
+    outcomes = {}
+    start = threading.Barrier(len(shipment_ids))
+
+    def submit(shipment_id):
+        start.wait()
+        with app.app_context():
+            try:
+                outcomes[shipment_id] = record_event(
+                    shipment_id=shipment_id, status="Picked up", location_description="Depot", created_at=datetime.utcnow()
+                )
+            except Exception as exc:
+                outcomes[shipment_id] = exc
+
+    threads = [threading.Thread(target=submit, args=(shipment_id,)) for shipment_id in shipment_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_bad_event_fails_alone(app, shipment, writer):
+    # Warm up so the next submissions are batched.
+    submit_all(app, [shipment.id, shipment.id])
+
+    outcomes = submit_all(app, [shipment.id, shipment.id, 999999, shipment.id])
+
+    assert isinstance(outcomes.pop(999999), Exception)
+    assert all(isinstance(event_id, int) for event_id in outcomes.values())
+
+
+def test_locked_database_fails_the_whole_batch_once(app, shipment, writer, tmp_path):
+    submit_all(app, [shipment.id, shipment.id])
+    del writer.commits[:]
+    locker = sqlite3.connect(tmp_path / "events.db")
+    locker.execute("BEGIN IMMEDIATE")
+    try:
+        outcomes = submit_all(app, [shipment.id] * 4)
+    finally:
+        locker.rollback()
+        locker.close()
+
+    assert all(isinstance(outcome, EventWriterError) for outcome in outcomes.values())
+    # Each event was tried once: the batch was not split into single-event retries.
+    assert sum(writer.commits) == 4
+    db.session.expire_all()
+    assert TrackingEvent.query.count() == 2
+
+
+def test_wait_is_bounded_when_the_commit_hangs(app, shipment, writer):
+    release = threading.Event()
+    writer._commit = lambda batch: release.wait(10) and [None] * len(batch)
+
+    started = time.monotonic()
+    with pytest.raises(EventWriterError, match="timeline"):
+        record_event(shipment_id=shipment.id, status="Picked up", location_description="Depot")
+    assert time.monotonic() - started < 3
+    release.set()
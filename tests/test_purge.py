@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from app import db
+from app.models import Customer, Shipment
+from app.purge import PurgeJob, claim_job, run_job
+
+
+def stale_job(shipment, status="running"):
+    job = PurgeJob(
+        customer_id=shipment.customer_id,
+        total=1,
+        status=status,
+        heartbeat_at=datetime.utcnow() - timedelta(hours=1),
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def test_job_is_stale_without_a_recent_heartbeat(shipment):
+    job = stale_job(shipment)
+    assert job.stale
+    job.heartbeat_at = datetime.utcnow()
+    assert not job.stale
+    # Jobs from before the heartbeat column count from their creation.
+    job.heartbeat_at = None
+    assert not job.stale
+    job.status = "failed"
+    job.heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+    assert not job.stale
+
+
+def test_only_one_resumer_claims_a_stale_job(shipment):
+    job = stale_job(shipment)
+    # What a second worker read before the first one claimed the job.
+    other = SimpleNamespace(id=job.id, heartbeat_at=job.heartbeat_at)
+
+    assert claim_job(job)
+    assert not job.stale
+    assert not claim_job(other)
+
+
+def test_resumed_job_finishes_the_purge(shipment):
+    customer_id = shipment.customer_id
+    job = stale_job(shipment)
+
+    assert claim_job(job)
+    assert run_job(job.id)
+
+    db.session.expire_all()
+    assert (job.status, job.done) == ("done", 1)
+    assert db.session.get(Customer, customer_id) is None
+    assert Shipment.query.count() == 0
@@ -0,0 +1,49 @@
+import sqlite3
+
+from app.models import TrackingEvent
+from upgrade_db import ensure_autoincrement
+
+OLD_TRACKING_EVENT = """
+CREATE TABLE tracking_event (
+    id INTEGER NOT NULL,
+    shipment_id INTEGER NOT NULL,
+    courier_id INTEGER,
+    status VARCHAR(50) NOT NULL,
+    location_description VARCHAR(255) NOT NULL,
+    notes TEXT,
+    created_at DATETIME,
+    PRIMARY KEY (id)
+)
+"""
+
+
+def insert_event(conn, notes=None):
+    conn.execute(
+        "INSERT INTO tracking_event (shipment_id, status, location_description, notes) VALUES (1, 'Picked up', 'Depot', ?)",
+        (notes,),
+    )
+    conn.commit()
+
+
+def test_tracking_event_is_rebuilt_with_autoincrement(tmp_path):
+    conn = sqlite3.connect(tmp_path / "old.db")
+    conn.execute(OLD_TRACKING_EVENT)
+    conn.execute("ALTER TABLE tracking_event ADD COLUMN proof_url TEXT")
+    conn.execute("CREATE INDEX ix_tracking_event_shipment_id ON tracking_event (shipment_id, id)")
+    for number in range(3):
+        insert_event(conn, str(number))
+    conn.execute("DELETE FROM tracking_event WHERE id = 3")
+    conn.commit()
+
+    ensure_autoincrement(conn, TrackingEvent.__table__)
+    ensure_autoincrement(conn, TrackingEvent.__table__)
+
+    assert conn.execute("SELECT id, notes FROM tracking_event").fetchall() == [(1, "0"), (2, "1")]
+    indexes = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'tracking_event'").fetchall()
+    assert ("ix_tracking_event_shipment_id",) in indexes
+    insert_event(conn)
+    conn.execute("DELETE FROM tracking_event WHERE id = 3")
+    conn.commit()
+    insert_event(conn)
+    assert conn.execute("SELECT max(id) FROM tracking_event").fetchone() == (4,)
+    conn.close()
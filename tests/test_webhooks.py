@@ -0,0 +1,227 @@
+import hashlib
+import hmac
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import TrackingEvent
+from app.models_webhooks import WebhookOutbox, WebhookSubscription
+from app.webhooks import SIGNATURE_HEADER, WebhookDispatcher, retry_dead
+
+SECRET = "s3cret"
+
+
+@pytest.fixture
+def subscription(app, receiver):
+    subscription = WebhookSubscription(name="Partner", url=receiver.url, secret=SECRET)
+    db.session.add(subscription)
+    db.session.commit()
+    return subscription
+
+
+@pytest.fixture
+def dispatcher(app):
+    return WebhookDispatcher(app)
+
+
+def add_events(shipment, *statuses):
+    events = [
+        TrackingEvent(shipment_id=shipment.id, courier_id=shipment.assigned_courier_id, status=status, location_description="Depot")
+        for status in statuses
+    ]
+    db.session.add_all(events)
+    db.session.commit()
+    return events
+
+
+def outbox():
+    db.session.expire_all()
+    return WebhookOutbox.query.order_by(WebhookOutbox.id).all()
+
+
+def make_due():
+    WebhookOutbox.query.update({"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def test_event_is_delivered(shipment, subscription, dispatcher, receiver):
+    (event,) = add_events(shipment, "Picked up")
+    assert [row.status for row in outbox()] == ["pending"]
+
+    assert dispatcher.run_once() == 1
+
+    (item,) = receiver.events()
+    assert item["event_id"] == event.id
+    assert item["tracking_number"] == "TRK-TEST0001"
+    assert item["status"] == "Picked up"
+    (row,) = outbox()
+    assert (row.status, row.attempts, row.lease_token) == ("delivered", 1, None)
+    assert dispatcher.run_once() == 0
+
+
+def test_delivery_is_signed(shipment, subscription, dispatcher, receiver):
+    add_events(shipment, "Picked up")
+    dispatcher.run_once()
+
+    (delivery,) = receiver.deliveries
+    expected = "sha256=" + hmac.new(SECRET.encode(), delivery["body"], hashlib.sha256).hexdigest()
+    assert delivery["headers"][SIGNATURE_HEADER] == expected
+    assert delivery["headers"]["Content-Type"] == "application/json"
+
+
+def test_events_are_batched_per_subscription(shipment, subscription, dispatcher, receiver):
+    add_events(shipment, "Assigned", "Picked up", "Out for delivery", "Attempted/Rescheduled", "Delivered")
+
+    assert dispatcher.run_once() == 5
+
+    # WEBHOOK_BATCH_SIZE is 2; batches for one endpoint go out in order.
+    assert [len(delivery["json"]["events"]) for delivery in receiver.deliveries] == [2, 2, 1]
+    assert [item["status"] for item in receiver.events()] == [
+        "Assigned", "Picked up", "Out for delivery", "Attempted/Rescheduled", "Delivered"
+    ]
+    assert len({delivery["json"]["delivery_id"] for delivery in receiver.deliveries}) == 3
+    assert {row.status for row in outbox()} == {"delivered"}
+
+
+def test_status_filter(shipment, dispatcher, receiver):
+    db.session.add(WebhookSubscription(name="Deliveries", url=receiver.url, secret=SECRET, statuses="Delivered"))
+    db.session.commit()
+    add_events(shipment, "Picked up", "Delivered")
+
+    dispatcher.run_once()
+
+    assert [item["status"] for item in receiver.events()] == ["Delivered"]
+
+
+def test_failure_is_retried_with_backoff(app, shipment, subscription, dispatcher, receiver):
+    add_events(shipment, "Picked up")
+    receiver.responses = [500]
+    before = datetime.utcnow()
+
+    dispatcher.run_once()
+
+    (row,) = outbox()
+    assert (row.status, row.attempts, row.last_error) == ("pending", 1, "HTTP 500")
+    # First retry waits between half and all of WEBHOOK_BACKOFF_BASE.
+    delay = (row.next_attempt_at - before).total_seconds()
+    assert app.config["WEBHOOK_BACKOFF_BASE"] / 2 - 1 <= delay <= app.config["WEBHOOK_BACKOFF_BASE"] + 1
+    assert dispatcher.run_once() == 0
+
+    make_due()
+    dispatcher.run_once()
+    (row,) = outbox()
+    assert (row.status, row.attempts, row.last_error) == ("delivered", 2, None)
+    assert len(receiver.deliveries) == 2
+
+
+def test_failing_endpoint_skips_the_rest_of_the_round(shipment, subscription, dispatcher, receiver):
+    add_events(shipment, "Assigned", "Picked up", "Out for delivery")
+    receiver.responses = [503]
+    scheduled = outbox()[2].next_attempt_at
+
+    dispatcher.run_once()
+
+    assert len(receiver.deliveries) == 1
+    rows = outbox()
+    assert [(row.status, row.attempts, row.last_error) for row in rows] == [
+        ("pending", 1, "HTTP 503"),
+        ("pending", 1, "HTTP 503"),
+        ("pending", 0, None),
+    ]
+    # The unsent batch is released on its old schedule, so the next round sends it.
+    assert (rows[2].lease_token, rows[2].next_attempt_at) == (None, scheduled)
+    assert dispatcher.run_once() == 1
+    assert [(row.status, row.attempts) for row in outbox()][2] == ("delivered", 1)
+
+
+def test_dead_letter_and_retry(app, shipment, subscription, dispatcher, receiver):
+    add_events(shipment, "Picked up")
+    receiver.responses = [500] * app.config["WEBHOOK_MAX_ATTEMPTS"]
+
+    for _ in range(app.config["WEBHOOK_MAX_ATTEMPTS"]):
+        make_due()
+        dispatcher.run_once()
+
+    (row,) = outbox()
+    assert (row.status, row.attempts) == ("dead", app.config["WEBHOOK_MAX_ATTEMPTS"])
+    make_due()
+    assert dispatcher.run_once() == 0
+
+    assert retry_dead(subscription.id) == 1
+    dispatcher.run_once()
+    (row,) = outbox()
+    assert (row.status, row.attempts) == ("delivered", 1)
+
+
+def test_paused_subscription_holds_deliveries(shipment, subscription, dispatcher, receiver):
+    add_events(shipment, "Picked up")
+    subscription.active = False
+    db.session.commit()
+    add_events(shipment, "Delivered")
+
+    assert dispatcher.run_once() == 0
+    assert receiver.deliveries == []
+    assert [(row.status, row.attempts) for row in outbox()] == [("pending", 0), ("pending", 0)]
+
+    subscription.active = True
+    db.session.commit()
+    assert dispatcher.run_once() == 2
+    assert [item["status"] for item in receiver.events()] == ["Picked up", "Delivered"]
+    assert {row.status for row in outbox()} == {"delivered"}
+
+
+def test_unreachable_endpoint(shipment, subscription, dispatcher, receiver):
+    receiver.server.shutdown()
+    receiver.server.server_close()
+    add_events(shipment, "Picked up")
+
+    dispatcher.run_once()
+
+    (row,) = outbox()
+    assert row.status == "pending" and row.attempts == 1 and row.last_error
+
+
+def test_sharded_events_carry_their_shard(tmp_path, receiver):
+    from app import create_app
+    from app.models import Courier, Customer, Shipment
+    from app.sharding import region_shard, use_shard
+    from conftest import WebhookTestConfig
+
+    class ShardedConfig(WebhookTestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'main.db'}"
+        SHARD_REGIONS = ["Springfield", "East"]
+        SHARD_DIR = str(tmp_path / "shards")
+
+    app = create_app(ShardedConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(WebhookSubscription(name="Partner", url=receiver.url, secret=SECRET))
+        customer = Customer(first_name="Jane", last_name="Doe", email="jane@example.com", phone="1", address="1 Main St", city="Springfield")
+        db.session.add(customer)
+        db.session.commit()
+        for region in ("Springfield", "East"):
+            courier = Courier(first_name="Bob", last_name=region, email=f"{region}@example.com", phone="1", region=region, hire_date=datetime(2020, 1, 1).date(), password_hash="x")
+            db.session.add(courier)
+            db.session.commit()
+            use_shard(region_shard(region))
+            shipment = Shipment(
+                customer_id=customer.id,
+                sender_address="a",
+                receiver_address="b",
+                city=region,
+                requested_date=datetime.utcnow(),
+                tracking_number=f"TRK-{region.upper()}",
+                assigned_courier_id=courier.id,
+            )
+            db.session.add(shipment)
+            db.session.commit()
+            add_events(shipment, "Picked up")
+        use_shard(None)
+
+        assert WebhookDispatcher(app).run_once() == 2
+
+        keys = sorted((item["shard"], item["event_id"]) for item in receiver.events())
+        assert keys == [("east", 1), ("springfield", 1)]
+        assert sorted((row.shard, row.tracking_event_id) for row in outbox()) == keys
+        db.session.remove()
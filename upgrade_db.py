@@ -4,8 +4,14 @@ Lightweight upgrade helper for SQLite: adds new columns/tables without migration
 import sqlite3
 from pathlib import Path
 
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+
 from app import create_app, db
-from app import models_support  # noqa: F401
+from app.models import Courier, Customer, Shipment, TrackingEvent
+from app.models_support import SupportComment, SupportTicket, ensure_search_index
+from app import models_webhooks  # noqa: F401
+from app.sharding import SHARD_SCHEMA
 
 
 def ensure_column(conn, table, column, ddl):
@@ -18,17 +24,106 @@ def ensure_column(conn, table, column, ddl):
         print(f"Column {column} already exists on {table}.")
 
 
+def ensure_autoincrement(conn, table):
+    """Rebuild ``table`` with AUTOINCREMENT, keeping every row and id, so deleted ids are never handed out again.
+
+    ``create_all`` only applies ``sqlite_autoincrement`` to new tables. Ids reused before the
+    upgrade can't be told apart afterwards; the sequence continues from the highest id kept.
+    """
+    name = table.name
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    if row is None:
+        print(f"No {name} table to rebuild.")
+        return
+    if "AUTOINCREMENT" in row[0].upper():
+        print(f"{name} already uses AUTOINCREMENT.")
+        return
+    options = {"schema_translate_map": {SHARD_SCHEMA: "main"}, "render_schema_translate": True}
+    dialect = sqlite.dialect()
+    existing = {info[1] for info in conn.execute(f"PRAGMA table_info({name})")}
+    columns = ", ".join(column.name for column in table.columns if column.name in existing)
+    triggers = [sql for (sql,) in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (name,))]
+    conn.commit()
+    isolation_level, conn.isolation_level = conn.isolation_level, None
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"ALTER TABLE {name} RENAME TO {name}_old")
+            # Indexes and triggers follow the renamed table; recreate them on the new one.
+            for (index,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (f"{name}_old",)
+            ).fetchall():
+                conn.execute(f"DROP INDEX {index}")
+            conn.execute(str(CreateTable(table).compile(dialect=dialect, **options)))
+            conn.execute(f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {name}_old")
+            conn.execute(f"DROP TABLE {name}_old")
+            for index in table.indexes:
+                conn.execute(str(CreateIndex(index).compile(dialect=dialect, **options)))
+            for sql in triggers:
+                conn.execute(sql)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.isolation_level = isolation_level
+    print(f"Rebuilt {name} with AUTOINCREMENT.")
+
+
+def backfill_shipment_status(conn):
+    cur = conn.execute(
+        """
+        UPDATE shipment SET
+            status = coalesce((
+                SELECT te.status FROM tracking_event te WHERE te.shipment_id = shipment.id
+                ORDER BY te.created_at DESC, te.id DESC LIMIT 1
+            ), status),
+            last_event_at = (SELECT max(te.created_at) FROM tracking_event te WHERE te.shipment_id = shipment.id)
+        WHERE last_event_at IS NULL
+        """
+    )
+    print(f"Backfilled status for {cur.rowcount} shipments.")
+
+
 def main():
     app = create_app()
     db_path = Path(app.config["SQLALCHEMY_DATABASE_URI"].replace("sqlite:///", ""))
     conn = sqlite3.connect(db_path)
     ensure_column(conn, "tracking_event", "proof_url", "TEXT")
+    ensure_column(conn, "shipment", "events_archived_at", "DATETIME")
+    ensure_column(conn, "shipment", "status", "VARCHAR(50) NOT NULL DEFAULT 'Created'")
+    ensure_column(conn, "shipment", "last_event_at", "DATETIME")
+    backfill_shipment_status(conn)
     conn.commit()
+    ensure_autoincrement(conn, TrackingEvent.__table__)
     conn.close()
 
     with app.app_context():
         db.create_all()
-        print("Ensured support ticket tables exist.")
+        print("Ensured support ticket, webhook and purge job tables exist.")
+        for path in app.extensions.get("shards", {}).get("paths", {}).values():
+            shard = sqlite3.connect(path)
+            ensure_autoincrement(shard, TrackingEvent.__table__)
+            shard.close()
+        with db.engine.begin() as connection:
+            ensure_column(connection.connection.driver_connection, "webhook_outbox", "shard", "VARCHAR(64)")
+            ensure_column(connection.connection.driver_connection, "purge_job", "heartbeat_at", "DATETIME")
+            ensure_column(connection.connection.driver_connection, "support_ticket", "stuck_since", "DATETIME")
+        for table in (
+            Customer.__table__,
+            Courier.__table__,
+            Shipment.__table__,
+            TrackingEvent.__table__,
+            SupportTicket.__table__,
+            SupportComment.__table__,
+        ):
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+        print("Ensured customer, courier, shipment, tracking event and support ticket indexes exist.")
+        with db.engine.begin() as connection:
+            ensure_search_index(connection)
+        print("Rebuilt support ticket search index.")
     print("Upgrade complete.")
 
 
@@ -0,0 +1,65 @@
+"""
+Local stand-in webhook receiver for trying out and testing webhook delivery.
+
+Example:
+    python webhook_receiver.py --port 8765 --secret <signing secret> --fail-rate 0.2
+
+Point a webhook at http://127.0.0.1:8765/ from Admin -> Webhooks, then run
+`flask --app run.py webhooks-dispatch`. Each delivery is printed; with
+--fail-rate some requests answer 500 so retries and dead-lettering can be observed.
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.webhooks import SIGNATURE_HEADER, sign
+
+
+def make_handler(args):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if args.delay:
+                time.sleep(args.delay)
+            if args.secret and self.headers.get(SIGNATURE_HEADER) != sign(args.secret, body):
+                print("Rejected delivery with a bad signature.")
+                self.send_response(401)
+                self.end_headers()
+                return
+            if random.random() < args.fail_rate:
+                print("Simulating a failure (500).")
+                self.send_response(500)
+                self.end_headers()
+                return
+            delivery = json.loads(body)
+            for item in delivery["events"]:
+                print(f"{delivery['delivery_id'][:8]} {item['tracking_number']} -> {item['status']} (event {item['event_id']})")
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *log_args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive and print ShipTrack webhook deliveries.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--secret", help="Verify the signature header with this signing secret.")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500.")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering.")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    print(f"Listening on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()